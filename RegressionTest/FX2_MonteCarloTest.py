@@ -15,6 +15,7 @@ import argparse
 import datetime
 import traceback
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor
 
 ################################################################################
 # globals
@@ -381,12 +382,36 @@ class TestFixture(object):
     def countCommand(self):
         self.commandCount += 1
         
-    def getSpectrumExternal(self):
-        data = self.dev.read(0x82, self.block_size, timeout=self.timeout_ms)
-        self.countCommand()
-        if self.pixels == 2048:
-            data.extend(self.dev.read(0x86, self.block_size, timeout=self.timeout_ms))
+    def readSpectrumEndpoints(self):
+        """ 
+        2048-pixel FX2s return their halves on 0x82 then 0x86.  With 
+        --concurrent-endpoints, 0x86 is read on a worker thread while reading 
+        0x82 so both halves are in flight at once.
+        """
+        if self.pixels != 2048 or not self.concurrent_endpoints:
+            data = self.dev.read(0x82, self.block_size, timeout=self.timeout_ms)
             self.countCommand()
+            if self.pixels == 2048:
+                if self.endpoint_sleep_ms:
+                    sleep(self.endpoint_sleep_ms / 1000.0)
+                data.extend(self.dev.read(0x86, self.block_size, timeout=self.timeout_ms))
+                self.countCommand()
+            return data
+
+        if getattr(self, "endpointExecutor", None) is None:
+            self.endpointExecutor = ThreadPoolExecutor(max_workers=1)
+        future = self.endpointExecutor.submit(self.dev.read, 0x86, self.block_size, timeout=self.timeout_ms)
+        try:
+            data = self.dev.read(0x82, self.block_size, timeout=self.timeout_ms)
+        finally:
+            data86 = future.result()
+        data.extend(data86)
+        self.countCommand()
+        self.countCommand()
+        return data
+
+    def getSpectrumExternal(self):
+        data = self.readSpectrumEndpoints()
 
         spectrum = [i + 256 * j for i, j in zip(data[::2], data[1::2])] # LSB-MSB
 
@@ -408,11 +433,7 @@ class TestFixture(object):
         self.dev.ctrl_transfer(HOST_TO_DEVICE, 0xad, 0, 0, buf, self.timeout_ms)
         self.countCommand()
         sleep(0.001) #Hecox: introduce a slight delay to test behavior of EP when it's not immediately read
-        data = self.dev.read(0x82, self.block_size, timeout=self.timeout_ms)
-        self.countCommand()
-        if self.pixels == 2048:
-            data.extend(self.dev.read(0x86, self.block_size, timeout=self.timeout_ms))
-            self.countCommand()
+        data = self.readSpectrumEndpoints()
 
         spectrum = [i + 256 * j for i, j in zip(data[::2], data[1::2])] # LSB-MSB
 
@@ -603,6 +624,8 @@ class TestFixture(object):
         parser.add_argument("--externalAcq", action='store_true', help="run external acquisition with laser pulse")
         parser.add_argument("--report", action='store_true', help="generate an API report")
         parser.add_argument("--debug", action='store_true', help="verbose output")
+        parser.add_argument("--concurrent-endpoints", action='store_true', help="read 2048-pixel endpoints 0x82 and 0x86 at the same time (experimental; default is one after the other)")
+        parser.add_argument("--endpoint-sleep-ms", type=int, default=0, help="unless --concurrent-endpoints, sleep between endpoints (ms)")
 
         laser_parser = parser.add_mutually_exclusive_group(required=False)
         laser_parser.add_argument('--laser',    dest='use_laser', action='store_true')
@@ -612,7 +635,7 @@ class TestFixture(object):
         args = parser.parse_args()
 
         # copy results
-        for field in ['pixels', 'block_size', 'debug', 'count', 'delay_ms', 'timeout_ms', 'simple', 'externalAcq', 'max', 'report', 'use_laser']:
+        for field in ['pixels', 'block_size', 'debug', 'count', 'delay_ms', 'timeout_ms', 'simple', 'externalAcq', 'max', 'report', 'use_laser', 'concurrent_endpoints', 'endpoint_sleep_ms']:
             setattr(self, field, getattr(args, field))
 
         self.pid = int(args.pid, 16)
@@ -0,0 +1,281 @@
+"""
+Software stand-in for an Adafruit FT232H wired to a Wasatch Series-XS (SiG)
+FPGA, so that spi_console.py can run without hardware (--simulate).
+
+The three objects returned by create() mimic the Blinka objects spi_console
+normally builds:
+
+    SimulatedSPI    busio.SPI (try_lock, configure, readinto, write_readinto)
+    SimulatedPin    digitalio.DigitalInOut (READY input, TRIGGER output)
+
+Behind them, SimulatedFPGA implements the ENG-0150 framing closely enough for
+spi_console's own encoders and decoders:
+
+    read:  < 0x00 LEN ADDR CRC >          -> < 0x00 LEN ADDR DATA[LEN-1] CRC >
+    write: < 0x00 LEN ADDR|0x80 DATA CRC > -> < CODE >
+
+with responses starting at the last byte of the command (the "missing echo"
+spi_console already accounts for), plus EEPROM page buffering (0xB0/0x31)
+and big-endian spectrum streaming gated by TRIGGER and READY.
+
+Timing model: every SPI call costs call_latency_ms (FT232H USB round-trip)
+plus 8 bits per byte at the configured baud rate; READY asserts readout_ms
+after the integration time following a TRIGGER rising edge.
+
+Error model: above reliable_mhz, each byte on the wire is corrupted with
+probability error_per_mhz * (MHz over).  Independently of baud rate,
+nak_rate NAKs otherwise-valid writes (ERROR_CRC) and drop_rate deasserts
+READY partway through a spectrum.  Injected faults are counted in stats, so
+callers can check how many their error handling actually caught.
+
+Used by spi_console.py --simulate (and its --tune and --benchmark modes).
+"""
+
+import crcmod.predefined
+import numpy as np
+import threading
+import random
+import struct
+import time
+
+START = 0x3c
+END   = 0x3e
+WRITE = 0x80
+
+crc8 = crcmod.predefined.mkPredefinedCrcFun('crc-8-maxim')
+
+class SimulatedFPGA:
+
+    def __init__(self, pixels=1920, revision="01.2.03", serial_number="SIM-00001", excitation_nm=785.0,
+                 readout_ms=0.0, nak_rate=0.0, drop_rate=0.0, seed=0):
+        self.pixels = pixels
+        self.revision = revision
+        self.readout_ms = readout_ms
+        self.nak_rate = nak_rate
+        self.drop_rate = drop_rate
+        self.lock = threading.Lock()
+        self.stats = { "reads": 0, "writes": 0, "bad_frames": 0, "naks_injected": 0, "spectra": 0, "drops_injected": 0 }
+
+        self.registers = { 0x11: 3, 0x14: 0x1800, 0x50: 250, 0x51: 750 }
+        self.eeprom = self.generate_eeprom(serial_number, excitation_nm)
+        self.eeprom_buffer = bytes(64)
+
+        self.stream = b""           # spectrum bytes not yet clocked out
+        self.ready_time = None      # when the current spectrum becomes readable
+        self.trigger = False
+        self.spectrum_count = 0
+
+        x = np.arange(pixels)
+        self.template = 800 + 400 * np.exp(-0.5 * ((x - pixels * 0.4) / 12) ** 2) \
+                            + 250 * np.exp(-0.5 * ((x - pixels * 0.7) / 20) ** 2)
+        self.rng = np.random.default_rng(seed)
+
+    def generate_eeprom(self, serial_number, excitation_nm):
+        pages = [ bytearray(64) for i in range(5) ]
+        pages[0][16:16 + len(serial_number)] = serial_number.encode()
+        pages[0][63] = 8
+        for i, coeff in enumerate([ 700.0, 0.1, 1e-5, 0.0 ]):
+            struct.pack_into("f", pages[1], i * 4, coeff)
+        struct.pack_into("H", pages[2], 16, self.pixels)
+        struct.pack_into("f", pages[2], 21, 0.0)
+        struct.pack_into("f", pages[3], 36, excitation_nm)
+        return pages
+
+    ############################################################################
+    # GPIO
+    ############################################################################
+
+    def set_trigger(self, value):
+        with self.lock:
+            if value and not self.trigger:
+                integration_time_ms = self.registers.get(0x11, 1)
+                spectrum = self.template * integration_time_ms / 3.0 + self.rng.normal(0, 5, self.pixels)
+                spectrum = np.clip(spectrum, 0, 0xffff).astype(">u2")
+                spectrum[0] = self.spectrum_count & 0xffff # frame counter
+                self.spectrum_count += 1
+                self.stream = spectrum.tobytes()
+                self.ready_time = time.perf_counter() + (integration_time_ms + self.readout_ms) / 1000.0
+                self.stats["spectra"] += 1
+                if self.drop_rate and self.rng.random() < self.drop_rate:
+                    self.stream = self.stream[:2 * int(self.rng.integers(0, self.pixels))]
+                    self.stats["drops_injected"] += 1
+            self.trigger = value
+
+    def get_ready(self):
+        with self.lock:
+            return len(self.stream) > 0 and time.perf_counter() >= self.ready_time
+
+    ############################################################################
+    # SPI
+    ############################################################################
+
+    ## clock out up to count bytes of pending spectrum (zeros once drained)
+    def read_stream(self, count):
+        with self.lock:
+            data = self.stream[:count]
+            self.stream = self.stream[count:]
+        return data + bytes(count - len(data))
+
+    ## @returns the full MISO byte sequence clocked back while "out" is written
+    def transfer(self, out):
+        response = bytearray(len(out))
+        if len(out) < 5 or out[0] != START:
+            return response
+
+        length = (out[1] << 8) | out[2]
+        addr = out[3]
+
+        if addr & WRITE:
+            frame_len = 4 + (length - 1) + 2
+            frame = out[:frame_len]
+            data = frame[4:-2]
+            self.stats["writes"] += 1
+            if len(frame) != frame_len or frame[-1] != END:
+                code = 1 # ERROR_LENGTH
+                self.stats["bad_frames"] += 1
+            elif crc8(bytes(frame[1:-2])) != frame[-2]:
+                code = 2 # ERROR_CRC
+                self.stats["bad_frames"] += 1
+            elif self.nak_rate and self.rng.random() < self.nak_rate:
+                code = 2
+                self.stats["naks_injected"] += 1
+            else:
+                code = self.write_register(addr & ~WRITE & 0xff, data)
+            reply = [START, code, END]
+        else:
+            self.stats["reads"] += 1
+            frame_len = 6 if len(out) > 5 and out[5] == END else 5
+            payload = self.read_register(addr, length)
+            if payload is None:
+                reply = [START, 3, END] # ERROR_UNRECOGNIZED_COMMAND
+            else:
+                body = [ (length >> 8) & 0xff, length & 0xff, addr ] + list(payload)
+                reply = [START] + body + [crc8(bytes(body)), END]
+
+        offset = frame_len - 1
+        reply = reply[:max(0, len(out) - offset)]
+        response[offset : offset + len(reply)] = bytes(reply)
+        return response
+
+    def write_register(self, addr, data):
+        if addr == 0x30: # 0xB0: load EEPROM page into the FPGA buffer
+            page = (data[0] - 0x40) if data else -1
+            if not 0 <= page < len(self.eeprom):
+                return 1
+            self.eeprom_buffer = bytes(self.eeprom[page])
+            return 0
+
+        value = 0
+        for i, b in enumerate(data):
+            value |= b << (8 * i)
+        self.registers[addr] = value
+        return 0
+
+    def read_register(self, addr, length):
+        payload_len = max(0, length - 1)
+        if addr == 0x10:
+            payload = self.revision.encode()
+        elif addr == 0x31:
+            payload = self.eeprom_buffer
+        elif addr in self.registers:
+            payload = self.registers[addr].to_bytes(4, "little")
+        else:
+            return None
+        return (payload + bytes(payload_len))[:payload_len]
+
+class SimulatedSPI:
+
+    def __init__(self, fpga, call_latency_ms=0.3, reliable_mhz=20, error_per_mhz=1e-3, seed=None):
+        self.fpga = fpga
+        self.call_latency_ms = call_latency_ms
+        self.reliable_mhz = reliable_mhz
+        self.error_per_mhz = error_per_mhz
+        self.baudrate = 1e6
+        self.locked = False
+        self.rng = random.Random(seed)
+
+        self.calls = 0
+        self.bytes = 0
+        self.corrupted = 0
+
+    def try_lock(self):
+        if self.locked:
+            return False
+        self.locked = True
+        return True
+
+    def unlock(self):
+        self.locked = False
+
+    def configure(self, baudrate=100000, phase=0, polarity=0, bits=8):
+        self.baudrate = baudrate
+
+    ## simulated bus time for one (full-duplex) call of count bytes
+    def clock(self, count):
+        self.calls += 1
+        self.bytes += count
+        time.sleep(self.call_latency_ms / 1000.0 + count * 8 / self.baudrate)
+
+    ## simulated signal-integrity errors above reliable_mhz
+    def corrupt(self, data):
+        over_mhz = self.baudrate / 1e6 - self.reliable_mhz
+        if over_mhz <= 0:
+            return data
+
+        p = self.error_per_mhz * over_mhz
+        data = bytearray(data)
+        for i in range(len(data)):
+            if self.rng.random() < p:
+                data[i] ^= 1 << self.rng.randrange(8)
+                self.corrupted += 1
+        return data
+
+    def readinto(self, buf, start=0, end=None, write_value=0):
+        end = len(buf) if end is None else end
+        self.clock(end - start)
+        buf[start:end] = self.corrupt(self.fpga.read_stream(end - start))
+
+    def write(self, buf, start=0, end=None):
+        end = len(buf) if end is None else end
+        self.clock(end - start)
+        self.fpga.transfer(self.corrupt(buf[start:end]))
+
+    def write_readinto(self, buffer_out, buffer_in, out_start=0, out_end=None, in_start=0, in_end=None):
+        out_end = len(buffer_out) if out_end is None else out_end
+        in_end = len(buffer_in) if in_end is None else in_end
+        self.clock(out_end - out_start)
+        response = self.fpga.transfer(self.corrupt(buffer_out[out_start:out_end]))
+        buffer_in[in_start:in_end] = self.corrupt(response)[:in_end - in_start]
+
+    def summary(self):
+        stats = ", ".join(f"{key} {value}" for key, value in self.fpga.stats.items())
+        return f"SimulatedSPI: {self.calls} calls, {self.bytes} bytes, {self.corrupted} bytes corrupted; FPGA: {stats}"
+
+class SimulatedPin:
+
+    def __init__(self, getter=None, setter=None):
+        self.getter = getter
+        self.setter = setter
+        self.direction = None
+        self._value = False
+
+    @property
+    def value(self):
+        return self.getter() if self.getter else self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        if self.setter:
+            self.setter(value)
+
+##
+# @returns (SPI, ready, trigger) wired to a new SimulatedFPGA
+# @see SimulatedFPGA and SimulatedSPI for the timing and fault parameters
+def create(pixels=1920, call_latency_ms=0.3, reliable_mhz=20, error_per_mhz=1e-3,
+           readout_ms=0.0, nak_rate=0.0, drop_rate=0.0, seed=None):
+    fpga = SimulatedFPGA(pixels=pixels, readout_ms=readout_ms, nak_rate=nak_rate, drop_rate=drop_rate, seed=seed)
+    spi = SimulatedSPI(fpga, call_latency_ms=call_latency_ms, reliable_mhz=reliable_mhz, error_per_mhz=error_per_mhz, seed=seed)
+    ready = SimulatedPin(getter=fpga.get_ready)
+    trigger = SimulatedPin(setter=fpga.set_trigger)
+    return spi, ready, trigger
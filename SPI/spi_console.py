@@ -14,6 +14,8 @@ Features include:
 - add on-screen traces for visual comparison
 - "test mode" for automated unit QC
 - resizable graph with pan/zoom
+- acquisition on a background thread, with the live trace blitted over a
+  cached background, so graphing doesn't limit the scan rate
 
 See --help for command-line options.
 
@@ -34,12 +36,33 @@ Test Mode
     data collection from a single connected spectrometer.  When running in this 
     mode, the script will:
 
-    - disable the GUI (real-time graphing enacts a speed penalty)
+    - run on a worker thread, leaving the GUI responsive (the live graph only
+      ever shows the newest spectrum, at most --max-fps times a second)
     - automatically collect --test-count measurements at the configured 
       integration time, gain and vertical ROI
     - compute individual and aggregate timing metrics on each measurement
     - save a test report under data/ containing all measurements and metrics
 
+Tuning
+    --tune sweeps baud rate and block size, measuring spectra/sec and error
+    rates (CRC mismatches, revision readback mismatches, write NAKs, short
+    spectra) at each combination, and writes the fastest acceptable pair to
+    spi_profile.json (--profile).  Later runs load --baud-mhz and --block-size
+    from that file unless given on the command-line.  Add --simulate to run
+    against the software FT232H/FPGA in SimulatedFT232H.py instead of hardware;
+    simulated runs use spi_profile-sim.json, and a profile is only loaded by 
+    runs of the kind (simulated or hardware) that tuned it.
+
+Benchmark (and Simulation)
+    --benchmark times the SPI framing primitives (computeCRC, send_command,
+    register read + decode_read_response, flushInputBuffer, waitForDataReady,
+    block spectrum reads, EEPROM paging) and reports latency, throughput and
+    errors detected.  With --simulate, the --sim-* options set the simulated
+    latency and inject write NAKs, early DATA_READY drops and (above
+    --sim-reliable-mhz) bit errors, and the report compares injected faults
+    with those detected.  The script can also be imported without starting
+    the GUI, so the framing functions can be exercised from other scripts.
+
 Troubleshooting
     - You may need to plug the FT232H USB cable in before connecting 12V to the 
       spectrometer.
@@ -72,20 +95,25 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 
 import crcmod.predefined
+import numpy as np
 
 import threading
 import argparse
+import queue
 import datetime
 import platform
 import logging
 import struct
 import math
 import time
+import contextlib
 import json
 import sys
 import os
 
 from statistics import median
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 def checkZadig():
     if platform.system() == "Windows":
@@ -94,6 +122,7 @@ def checkZadig():
 runnable = True
 try:
     os.environ["BLINKA_FT232H"] = "1"
+    from pyftdi.ftdi import FtdiError
     import board
     import digitalio
     import busio
@@ -106,6 +135,9 @@ except ValueError as ex:
     print("MacOS:  $ export DYLD_LIBRARY_PATH=/usr/local/lib")
     print("Linux:  $ export LD_LIBRARY_PATH=/usr/local/lib")
     runnable = False
+except ImportError as ex:
+    print(f"Adafruit Blinka not available ({ex})\n")
+    runnable = False
 except FtdiError as ex:
     print("No FT232H connected.\n")
     checkZadig()
@@ -126,7 +158,9 @@ END   = 0x3e                # >
 WRITE = 0x80                # bit changing opcodes from 'getter' to 'setter'
 CRC   = 0xff                # for readability
 DATA_DIR = "data"           # under the current working directory
-MIN_DELAY_MS = 100          # varies by hardware / OS -- this is to ensure responsive GUI, even with --debug
+DEFAULT_MAX_FPS = 20        # live graph refresh cap (acquisition itself runs on its own thread)
+DEFAULT_BAUD_MHZ = 10       # unless overridden by --profile
+DEFAULT_BLOCK_SIZE = 256    # unless overridden by --profile
 
 # these acquisition are not currently exposed by the GUI 
 HARDCODED_PARAMETERS = [
@@ -152,6 +186,7 @@ HARDCODED_PARAMETERS = [
 crc8 = crcmod.predefined.mkPredefinedCrcFun('crc-8-maxim')
 lock = threading.Lock()
 args = None
+crc_errors = 0              # running count of CRC mismatches seen by checkCRC (for --tune)
 
 def parseArgs(argv):
 
@@ -165,20 +200,23 @@ def parseArgs(argv):
 
     parser.add_argument("--ready-pin",           type=str,   default="C1",         help="FT232H pin for DATA_READY")
     parser.add_argument("--trigger-pin",         type=str,   default="C0",         help="FT232H pin for TRIGGER")
-    parser.add_argument("--baud-mhz",            type=int,   default=10,           help="baud rate in MHz")
+    parser.add_argument("--baud-mhz",            type=int,                         help=f"baud rate in MHz ({DEFAULT_BAUD_MHZ} unless set by --profile)")
     parser.add_argument("--integration-time-ms", type=int,   default=3,            help="startup integration time in ms")
     parser.add_argument("--gain-db",             type=int,   default=24,           help="startup gain in INTEGRAL dB (24 sent as FunkyFloat 0x1800)")
     parser.add_argument("--start-line",          type=int,   default=250,          help="startup ROI top")
     parser.add_argument("--stop-line",           type=int,   default=750,          help="startup ROI bottom")
-    parser.add_argument("--delay-ms",            type=int,   default=MIN_DELAY_MS, help="delay between acquisitions (zero for --test)")
+    parser.add_argument("--delay-ms",            type=int,   default=0,            help="delay between acquisitions (zero for --test)")
+    parser.add_argument("--max-fps",             type=int,   default=DEFAULT_MAX_FPS, help="maximum live graph refresh rate (does not limit acquisition)")
     parser.add_argument("--test-count",          type=int,   default=100,          help="collect this many spectra in --test")
     parser.add_argument("--test-ramp-start",     type=int,   default=3,            help="start ramp at this integration time")
     parser.add_argument("--test-ramp-stop",      type=int,   default=10,           help="stop ramp at this integration time")
     parser.add_argument("--test-ramp-incr",      type=int,   default=1,            help="increment ramp at this integration time")
     parser.add_argument("--throwaways",          type=int,   default=3,            help="automatic throwaway measurements")
-    parser.add_argument("--block-size",          type=int,   default=256,          help="block size for --fast SPI reads")
+    parser.add_argument("--block-size",          type=int,                         help=f"block size for --fast SPI reads ({DEFAULT_BLOCK_SIZE} unless set by --profile)")
+    parser.add_argument("--test-block-sizes",    type=str,                         help="in --test, also compare legacy and preallocated reads at these comma-delimited block sizes")
     parser.add_argument("--pixels",              type=int,   default=1920,         help="how many pixels to use if --no-eeprom")
     parser.add_argument("--batch-count",         type=int,   default=10,           help="how many spectra to save when clicking 'batch'")
+    parser.add_argument("--npz",                 action="store_true",              help="also write a compressed .npz (spectra, axes and metadata) beside each batch and test report")
     parser.add_argument("--excitation-nm",       type=float, default=-1,           help="laser excitation wavelength (creates wavenumber axis if positive)")
     parser.add_argument("--save",                type=bool,  default=True,         help="save each spectrum (--no-save to disable)", action=argparse.BooleanOptionalAction)
     parser.add_argument("--eeprom",              type=bool,  default=True,         help="load and act on EEPROM configuration (--no-eeprom to disable)", action=argparse.BooleanOptionalAction)
@@ -187,17 +225,51 @@ def parseArgs(argv):
     parser.add_argument("--paused",              action="store_true",              help="launch with acquisition paused")
     parser.add_argument("--debug",               action="store_true",              help="output verbose debug messages")
     parser.add_argument("--test",                action="store_true",              help="run one test then exit")
+    parser.add_argument("--legacy-read",         action="store_true",              help="read spectra with the original per-block bytearray path (for comparison)")
     parser.add_argument("--ext-trigger",         action="store_true",              help="don't send triggers via FT232H (requires external function generator)")
+    parser.add_argument("--profile",             type=str,                         help="load --baud-mhz and --block-size from this file if present (written by --tune; default spi_profile.json, or spi_profile-sim.json with --simulate)")
+    parser.add_argument("--tune",                action="store_true",              help="sweep baud rate and block size, write the fastest error-free pair to --profile, then exit")
+    parser.add_argument("--tune-baud-mhz",       type=str,   default="1,2,5,10,15,20,25,30", help="comma-delimited baud rates (MHz) to try in --tune")
+    parser.add_argument("--tune-block-sizes",    type=str,   default="64,128,256,512,1024,2048,4096", help="comma-delimited block sizes to try in --tune")
+    parser.add_argument("--tune-count",          type=int,   default=20,           help="spectra (and revision readbacks) per configuration in --tune")
+    parser.add_argument("--tune-max-error-rate", type=float, default=0,            help="highest error rate (errors per transaction) --tune will accept")
+    parser.add_argument("--benchmark",           action="store_true",              help="time the SPI framing primitives (commands, reads, spectra), report throughput and errors, then exit")
+    parser.add_argument("--benchmark-count",     type=int,   default=100,          help="iterations per --benchmark operation")
+    parser.add_argument("--simulate",            action="store_true",              help="use a simulated FT232H and FPGA (see SimulatedFT232H.py) instead of hardware")
+    parser.add_argument("--sim-latency-ms",      type=float, default=0.3,          help="with --simulate, FT232H round-trip latency per SPI call")
+    parser.add_argument("--sim-readout-ms",      type=float, default=0,            help="with --simulate, delay from end of integration to DATA_READY")
+    parser.add_argument("--sim-reliable-mhz",    type=float, default=20,           help="with --simulate, baud rate above which bytes start getting corrupted")
+    parser.add_argument("--sim-nak-rate",        type=float, default=0,            help="with --simulate, fraction of valid writes NAK'd")
+    parser.add_argument("--sim-drop-rate",       type=float, default=0,            help="with --simulate, fraction of spectra whose DATA_READY drops early")
+    parser.add_argument("--sim-seed",            type=int,                         help="with --simulate, random seed")
 
     args = parser.parse_args(argv[1:])
 
-    # positive --delay-ms is required for interactive GUI, but zeroed for --test
+    # --test starts paused and runs back-to-back
     if args.test:
         args.paused = True
         args.delay_ms = 0
-    elif args.delay_ms < MIN_DELAY_MS:
-        print(f"WARNING: interactive GUI recommends --delay-ms of at least {MIN_DELAY_MS}ms")
-        args.delay_ms = MIN_DELAY_MS
+
+    # keep settings tuned against the simulator away from real hardware
+    if args.profile is None:
+        args.profile = "spi_profile-sim.json" if args.simulate else "spi_profile.json"
+
+    # fill in anything not given on the command-line from a previous --tune
+    if not args.tune and args.profile and os.path.exists(args.profile) and (args.baud_mhz is None or args.block_size is None):
+        with open(args.profile) as f:
+            profile = json.load(f)
+        if bool(profile.get("simulated")) != args.simulate:
+            print(f"ignoring {args.profile}: tuned {'with' if profile.get('simulated') else 'without'} --simulate")
+        else:
+            if args.baud_mhz is None:
+                args.baud_mhz = int(profile["baud_mhz"])
+            if args.block_size is None:
+                args.block_size = int(profile["block_size"])
+            print(f"loaded {args.baud_mhz} MHz, block size {args.block_size} from {args.profile} (tuned {profile.get('tuned')})")
+    if args.baud_mhz is None:
+        args.baud_mhz = DEFAULT_BAUD_MHZ
+    if args.block_size is None:
+        args.block_size = DEFAULT_BLOCK_SIZE
 
     return args
 
@@ -215,10 +287,14 @@ def toHex(values):
     return "[ " + ", ".join([ f"0x{v:02x}" for v in values ]) + " ]"
 
 ## confirm the received CRC matches our computed CRC for the list or bytearray "data"
-def checkCRC(crc_received, data):
+def checkCRC(crc_received, data) -> bool:
+    global crc_errors
     crc_computed = crc8(data)
     if crc_computed != crc_received:
         print(f"\nERROR *** CRC mismatch: received 0x{crc_received:02x}, computed 0x{crc_computed:02x}\n")
+        crc_errors += 1
+        return False
+    return True
 
 ## given a list or bytearray of data elements, return the checksum
 def computeCRC(data):
@@ -345,7 +421,7 @@ def decode_write_response_UNUSED(unbuffered_cmd, buffered_response, name=None, m
 
     return response_data
 
-def send_command(SPI, ready, address, value, write_len, name=""):
+def send_command(SPI, ready, address, value, write_len, name="", verbose=True):
     txData = []
     txData      .append( value        & 0xff) # LSB
     if write_len > 2:
@@ -369,7 +445,9 @@ def send_command(SPI, ready, address, value, write_len, name=""):
         SPI.write_readinto(buffered_cmd, buffered_response)
 
     errorMsg = validateWriteResponse(buffered_response[-3:])
-    print(f">><< cCfgEntry[{name:16s}].write: {toHex(buffered_cmd)} -> {toHex(buffered_response)} ({errorMsg})")
+    if verbose or errorMsg != "SUCCESS":
+        print(f">><< cCfgEntry[{name:16s}].write: {toHex(buffered_cmd)} -> {toHex(buffered_response)} ({errorMsg})")
+    return errorMsg
 
 # Simple verification function for Integer inputs
 def fIntValidate(input):
@@ -390,6 +468,45 @@ def flushInputBuffer(ready, spi):
         debug(".", lf=False, ts=False)
     debug(f"flushed {count} bytes from input buffer")
 
+##
+# Read a triggered spectrum in block_size chunks directly into view (a
+# memoryview over a preallocated buffer), draining until READY drops.  Caller
+# holds lock.
+#
+# @returns number of bytes read into view
+def readBlocksInto(SPI, ready, view, block_size):
+    bytes_total = len(view)
+    bytes_read = 0
+    while ready.value:
+        if bytes_read < bytes_total:
+            bytes_this_read = min(block_size, bytes_total - bytes_read)
+
+            # there is latency associated with this call, so call it as
+            # few times as possible (with the largest possible block size)
+            SPI.readinto(view[bytes_read : bytes_read + bytes_this_read])
+            bytes_read += bytes_this_read
+    return bytes_read
+
+## Trigger (unless --ext-trigger) and read one spectrum into view. @returns bytes read
+def acquireInto(SPI, ready, trigger, view, block_size):
+    with lock:
+        if args.ext_trigger:
+            waitForDataReady(ready)
+        else:
+            trigger.value = True
+            waitForDataReady(ready)
+            trigger.value = False
+        return readBlocksInto(SPI, ready, view, block_size)
+
+## @returns the raw FPGA revision payload (bytes, e.g. b"01.2.03")
+def readRevision(SPI):
+    unbuffered_cmd = fixCRC([START, 0x00, 8, 0x10, CRC, END])
+    buffered_response = bytearray(len(unbuffered_cmd) + READ_RESPONSE_OVERHEAD + 8 - 1)
+    buffered_cmd = buffer_bytearray(unbuffered_cmd, len(buffered_response))
+    with lock:
+        SPI.write_readinto(buffered_cmd, buffered_response)
+    return bytes(decode_read_response(unbuffered_cmd, buffered_response, "FPGA Revision", missing_echo_len=1))
+
 def waitForDataReady(ready):
     # debug("waiting for data ready...")
     while not ready.value:
@@ -417,6 +534,88 @@ def sleep_ms(ms):
     debug(f"sleeping {ms} ms")
     time.sleep(sec)
 
+# generate_axes() and _generate_axes() from generic/Wavecal.py (documented there)
+def generate_axes(coeffs, pixels, excitation_nm=None):
+    coeffs = tuple(0.0 if c is None or math.isnan(c) else float(c) for c in coeffs)
+    if excitation_nm is None or math.isnan(excitation_nm) or excitation_nm <= 0:
+        excitation_nm = None
+    else:
+        excitation_nm = float(excitation_nm)
+    return _generate_axes(coeffs, int(pixels), excitation_nm)
+
+@lru_cache(maxsize=64)
+def _generate_axes(coeffs, pixels, excitation_nm):
+    x = np.arange(pixels, dtype=np.float64)
+    wavelengths = np.full(pixels, coeffs[-1] if coeffs else 0.0)
+    for c in reversed(coeffs[:-1]):
+        wavelengths *= x
+        wavelengths += c
+    wavelengths.setflags(write=False)
+
+    wavenumbers = None
+    if excitation_nm is not None:
+        with np.errstate(divide="ignore"):
+            wavenumbers = np.where(wavelengths != 0, 1e7 / excitation_nm - 1e7 / wavelengths, 0.0)
+        wavenumbers.setflags(write=False)
+
+    return wavelengths, wavenumbers
+
+################################################################################
+#                                                                              #
+#                               Report Writing                                 #
+#                                                                              #
+################################################################################
+
+##
+# Write spectra in the batch/test CSV layout: "key, value" metadata lines, a 
+# blank line, optional per-measurement header rows, the label row, then one
+# row per pixel (pixel, wavelength, [wavenumber,] one column per spectrum).
+#
+# The spectra are stacked into one (pixels x measurements) array, transposed
+# to pixel-major rows in a single step, and the whole table is emitted with 
+# one write rather than one write per cell.
+#
+# @param metadata    list of (key, value)
+# @param header_rows dict of key -> one value per spectrum (formatted %.2f)
+def writeSpectraCSV(pathname, metadata, labels, spectra, wavelengths, wavenumbers=None, header_rows=None):
+    spectra = np.array(spectra)
+    pixels = spectra.shape[1] if spectra.ndim == 2 else len(wavelengths)
+    pad = "," if wavenumbers is not None else ""
+
+    lines = [ f"{key}, {value}" for key, value in metadata ]
+    lines.append("")
+    for key, values in (header_rows or {}).items():
+        lines.append(f", {key}{pad}" + "".join(f", {value:.2f}" for value in values))
+    lines.append("pixel, wavelength" + (", wavenumber" if wavenumbers is not None else "") + "".join(f", {label}" for label in labels))
+
+    if wavenumbers is not None:
+        prefixes = [ f"{pixel}, {nm:.2f}, {cm:.2f}" for pixel, nm, cm in zip(range(pixels), np.asarray(wavelengths).tolist(), np.asarray(wavenumbers).tolist()) ]
+    else:
+        prefixes = [ f"{pixel}, {nm:.2f}" for pixel, nm in zip(range(pixels), np.asarray(wavelengths).tolist()) ]
+    rows = spectra.reshape(-1, pixels).T.tolist()
+    lines.extend(f"{prefix}, {', '.join(map(str, row))}" if row else prefix for prefix, row in zip(prefixes, rows))
+
+    with open(pathname, "w") as outfile:
+        outfile.write("\n".join(lines) + "\n")
+    print(f"saved {pathname}")
+
+## Binary sidecar to writeSpectraCSV: the same data and metadata in a compressed .npz.
+def writeSpectraNPZ(pathname, metadata, labels, spectra, wavelengths, wavenumbers=None, header_rows=None):
+    spectra = np.array(spectra)
+    if spectra.dtype.kind in "iu" and spectra.size and 0 <= spectra.min() and spectra.max() <= 0xffff:
+        spectra = spectra.astype(np.uint16)
+    arrays = { "spectra":         spectra,
+               "labels":          np.array(labels, dtype=str),
+               "wavelengths":     np.asarray(wavelengths),
+               "metadata_keys":   np.array([ key for key, value in metadata ], dtype=str),
+               "metadata_values": np.array([ str(value) for key, value in metadata ], dtype=str) }
+    if wavenumbers is not None:
+        arrays["wavenumbers"] = np.asarray(wavenumbers)
+    for key, values in (header_rows or {}).items():
+        arrays[f"header_{key}"] = np.array(values, dtype=np.float64)
+    np.savez_compressed(pathname, **arrays)
+    print(f"saved {pathname}")
+
 ################################################################################
 #                                                                              #
 #                                 cCfgString                                   #
@@ -576,10 +775,17 @@ class cCfgEntry:
             return True
         return False
 
-    # Override the value in the GUI widget then update to device
-    def Override(self, value):
-        self.stringVar.set(value)
-        self.Update()
+    # Override the value in the GUI widget then update to device.  From a worker
+    # thread, pass dispatch (cWinMain.runOnUiThread) so that only the widget
+    # update happens on the Tk thread.
+    def Override(self, value, dispatch=None):
+        if dispatch is None:
+            self.stringVar.set(value)
+            self.Update()
+        else:
+            self.value = int(value)
+            self.SPIWrite()
+            dispatch(lambda: self.stringVar.set(value))
 
 ################################################################################
 #                                                                              #
@@ -597,9 +803,19 @@ class cWinMain(tk.Tk):
         self.ready      = ready
         self.trigger    = trigger
 
-        self.next_cb = None
         self.acquireActive = False
+        self.acquireEvent = threading.Event()   # set while the acquisition thread should run
+        self.acquirePauses = 0                  # acquisitionPaused() blocks in progress
+        self.acquirePauseLock = threading.Lock()
+        self.spectrumQueue = queue.Queue()      # acquisition thread -> GUI (spectra to graph)
+        self.uiQueue = queue.Queue()            # worker threads -> GUI (callables to run on the Tk thread)
+        self.liveLine = None
+        self.background = None
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer") # file output, in request order
         self.lastSpectrum = None
+        self.lastTiming = None
+        self.rawBuffer = None
+        self.rawView = None
         self.dark = None
         self.clear()
 
@@ -633,6 +849,7 @@ class cWinMain(tk.Tk):
         self.canvas = FigureCanvasTkAgg(self.figure, master=self.drawFrame)
         self.graph = self.figure.add_subplot()
         self.canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.canvas.mpl_connect("draw_event", self.onDraw)
         self.drawFrame.grid(row=0, column=1, sticky="news")
         self.grid_rowconfigure(0, weight=1)
         self.grid_columnconfigure(1, weight=1)
@@ -660,6 +877,11 @@ class cWinMain(tk.Tk):
 
         debug("writing initial values to FPGA")
         self.FPGAInit()
+        self.initGraph()
+
+        self.acquireThread = threading.Thread(target=self.acquireLoop, name="acquire", daemon=True)
+        self.acquireThread.start()
+        self.pollQueues()
 
         self.stop() if args.paused else self.start()
 
@@ -757,21 +979,44 @@ class cWinMain(tk.Tk):
             self.configFrame.grid_rowconfigure(row, minsize=30)
 
     def start(self):
-        with lock:
-            debug("starting acquisition loop")
-            self.textStart.set("Stop")
-            self.acquireActive = True
-            self.schedule_acquire(args.delay_ms)
+        debug("starting acquisition loop")
+        self.textStart.set("Stop")
+        self.acquireActive = True
+        self.updateAcquireEvent()
 
     def stop(self):
-        with lock:
-            debug("pausing acquisition loop")
-            self.textStart.set("Start")
-            self.acquireActive = False
+        debug("pausing acquisition loop")
+        self.textStart.set("Start")
+        self.acquireActive = False
+        self.updateAcquireEvent()
 
     def toggleStart(self):
         self.stop() if self.acquireActive else self.start()
 
+    ## run the acquisition thread only while started and not paused
+    def updateAcquireEvent(self):
+        with self.acquirePauseLock:
+            if self.acquireActive and self.acquirePauses == 0:
+                self.acquireEvent.set()
+            else:
+                self.acquireEvent.clear()
+
+    ##
+    # Hold the acquisition thread between spectra for the duration of the block,
+    # so other acquisitions (throwaways, batches) don't interleave with live 
+    # ones.  Nests, and Start/Stop within the block take effect at its end.
+    @contextlib.contextmanager
+    def acquisitionPaused(self):
+        with self.acquirePauseLock:
+            self.acquirePauses += 1
+        self.updateAcquireEvent()
+        try:
+            yield
+        finally:
+            with self.acquirePauseLock:
+                self.acquirePauses -= 1
+            self.updateAcquireEvent()
+
     def generateBasename(self):
         ts = timestamp()
         integ = self.getValue("Integration Time")
@@ -797,25 +1042,32 @@ class cWinMain(tk.Tk):
     ##
     # @param to_disk: specify False if you only want the spectrum saved "on the
     #                 graph" (as a historical trace)
+    #
+    # May be called from the test thread: the note widget and savedSpectra 
+    # (which the graph iterates) are only touched on the Tk thread.
     def save(self, to_disk=True):
         if not args.save:
             return
 
         spectrum = self.lastSpectrum
         if spectrum is not None:
-            basename = self.generateBasename()
-            self.savedSpectra[basename] = spectrum
-
-            if to_disk:
-                self.makeDataDir()
-                pathname = os.path.join(DATA_DIR, f"{basename}.csv")
-                with open(pathname, "w") as outfile:
-                    outfile.write("pixel, wavelength, wavenumber, intensity\n")
-                    for px in range(len(spectrum)):
-                        nm = 0 if self.wavelengths is None else self.wavelengths[px]
-                        cm = 0 if self.wavenumbers is None else self.wavenumbers[px]
-                        outfile.write(f"{px}, {nm:0.2f}, {cm:0.2f}, {spectrum[px]}\n")
-                print(f"saved {pathname}")
+            self.runOnUiThread(lambda: self.saveOnUiThread(spectrum, to_disk))
+
+    def saveOnUiThread(self, spectrum, to_disk):
+        basename = self.generateBasename()
+        self.savedSpectra[basename] = spectrum
+        self.initGraph()
+
+        if to_disk:
+            self.makeDataDir()
+            pathname = os.path.join(DATA_DIR, f"{basename}.csv")
+            with open(pathname, "w") as outfile:
+                outfile.write("pixel, wavelength, wavenumber, intensity\n")
+                for px in range(len(spectrum)):
+                    nm = 0 if self.wavelengths is None else self.wavelengths[px]
+                    cm = 0 if self.wavenumbers is None else self.wavenumbers[px]
+                    outfile.write(f"{px}, {nm:0.2f}, {cm:0.2f}, {spectrum[px]}\n")
+            print(f"saved {pathname}")
 
     def take_dark(self):
         if self.dark is None:
@@ -825,6 +1077,8 @@ class cWinMain(tk.Tk):
 
     def clear(self):
         self.savedSpectra = {}
+        if self.liveLine is not None:
+            self.initGraph()
 
     def getValue(self, name) -> int:
         if name not in self.configMap:
@@ -840,12 +1094,14 @@ class cWinMain(tk.Tk):
         return binned
 
     def getSpectrum(self):
+        timing = { "trigger_ms": 0, "read_ms": 0, "decode_ms": 0 }
         with lock:
 
             ####################################################################
             # Trigger Acquisition
             ####################################################################
 
+            time_start = time.perf_counter()
             if args.ext_trigger:
                 debug("waiting on external trigger...")
                 waitForDataReady(self.ready)
@@ -854,67 +1110,188 @@ class cWinMain(tk.Tk):
                 self.trigger.value = True
                 waitForDataReady(self.ready)
                 self.trigger.value = False
+            time_trigger = time.perf_counter()
+            timing["trigger_ms"] = (time_trigger - time_start) * 1000.0
 
             ####################################################################
             # Read the spectrum (MZ: big-endian, seriously?)
             ####################################################################
 
-            spectrum = []
-            bytes_remaining = self.pixels * 2
-
             debug(f"getSpectrum: reading spectrum of {self.pixels} pixels")
-            raw = []
-            while self.ready.value:
-                if bytes_remaining > 0:
-                    bytes_this_read = min(args.block_size, bytes_remaining)
-
-                    debug(f"getSpectrum: reading block of {bytes_this_read} bytes")
-                    buf = bytearray(bytes_this_read)
-
-                    # there is latency associated with this call, so call it as
-                    # few times as possible (with the largest possible block size)
-                    self.SPI.readinto(buf)
-
-                    debug(f"getSpectrum: read block of {len(buf)} bytes")
-                    raw.extend(list(buf))
+            if args.legacy_read:
+                raw = self.readSpectrumLegacy()
+            else:
+                bytes_read = self.readSpectrumInto()
+            time_read = time.perf_counter()
+            timing["read_ms"] = (time_read - time_trigger) * 1000.0
 
-                    bytes_remaining -= len(buf)
+            # copy out of the shared rawBuffer before another thread reads into it
+            if not args.legacy_read:
+                spectrum = np.frombuffer(self.rawBuffer, dtype=">u2", count=bytes_read // 2).tolist()
 
         ########################################################################
-        # post-process spectrum
+        # post-process spectrum (lock released)
         ########################################################################
 
-        # demarshall big-endian
-        for i in range(0, len(raw)-1, 2):
-            spectrum.append((raw[i] << 8) | raw[i+1])
+        if args.legacy_read:
+            # demarshall big-endian
+            spectrum = []
+            for i in range(0, len(raw)-1, 2):
+                spectrum.append((raw[i] << 8) | raw[i+1])
         debug(f"getSpectrum: {len(spectrum)} pixels read")
 
+        timing["decode_ms"] = (time.perf_counter() - time_read) * 1000.0
+        self.lastTiming = timing
+
         return spectrum
 
+    ##
+    # Read blocks directly into one preallocated buffer through memoryview 
+    # slices, so no per-block bytearray or list is created.  Caller holds lock.
+    #
+    # @returns number of bytes read into self.rawBuffer
+    def readSpectrumInto(self):
+        bytes_total = self.pixels * 2
+        if self.rawBuffer is None or len(self.rawBuffer) != bytes_total:
+            self.rawBuffer = bytearray(bytes_total)
+            self.rawView = memoryview(self.rawBuffer)
+
+        return readBlocksInto(self.SPI, self.ready, self.rawView, args.block_size)
+
+    ## The original per-block bytearray/list path, kept for comparison (--legacy-read).
+    def readSpectrumLegacy(self):
+        bytes_remaining = self.pixels * 2
+        raw = []
+        while self.ready.value:
+            if bytes_remaining > 0:
+                bytes_this_read = min(args.block_size, bytes_remaining)
+
+                debug(f"getSpectrum: reading block of {bytes_this_read} bytes")
+                buf = bytearray(bytes_this_read)
+
+                self.SPI.readinto(buf)
+
+                debug(f"getSpectrum: read block of {len(buf)} bytes")
+                raw.extend(list(buf))
+
+                bytes_remaining -= len(buf)
+        return raw
+
     def getXAxis(self):
         if self.wavenumbers is not None:
             return self.wavenumbers
         elif self.wavelengths is not None:
             return self.wavelengths
         else:
-            return range(len(self.pixels))
+            return range(self.pixels)
 
-    ## @todo probably faster if we used set_ydata()
-    def graphSpectrum(self, y, label="live"):
+    ############################################################################
+    #                                                                          #
+    #                                Graphing                                  #
+    #                                                                          #
+    ############################################################################
+
+    ##
+    # Redraw the static background (axes, legend and saved spectra), and create
+    # the animated "live" line that graphSpectrum() blits over it.  Only needed
+    # when the saved spectra change; the draw_event handler re-captures the 
+    # background after resizes, pan and zoom.
+    def initGraph(self):
+        self.graph.clear()
         x = self.getXAxis()
-        self.graph.plot(x, y, linewidth=0.5, label=label)
+        for label in sorted(self.savedSpectra):
+            self.graph.plot(x, self.savedSpectra[label], linewidth=0.5, label=label)
+
+        y = self.lastSpectrum if self.lastSpectrum is not None and len(self.lastSpectrum) == len(x) else np.zeros(len(x))
+        self.liveLine, = self.graph.plot(x, y, linewidth=0.5, label="live", animated=True)
         self.update_axes()
         self.graph.legend()
-
+        self.rescaleY(y, force=True)
         self.canvas.draw()
 
-    def initGraph(self):
-        self.graph.clear()
-        i = 0
-        for label in sorted(self.savedSpectra):
-            spectrum = self.savedSpectra[label]
-            self.graphSpectrum(spectrum, label=label)
+    ## draw_event callback: snapshot everything but the live line, then put it back
+    def onDraw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.graph.bbox)
+        if self.liveLine is not None:
+            self.graph.draw_artist(self.liveLine)
+
+    ##
+    # Fit the y-axis to the live and saved spectra if the live spectrum has left
+    # the current limits or shrunk to under half of them.  Not while the 
+    # toolbar is panning or zooming.
+    #
+    # @returns True if the limits changed (a full redraw is needed)
+    def rescaleY(self, y, force=False):
+        if len(y) == 0 or (self.toolbar.mode and not force):
+            return False
+        lo, hi = min(y), max(y)
+        bottom, top = self.graph.get_ylim()
+        if not force and bottom <= lo and hi <= top and (hi - lo) >= 0.5 * (top - bottom):
+            return False
+
+        for spectrum in self.savedSpectra.values():
+            lo, hi = min(lo, min(spectrum)), max(hi, max(spectrum))
+        margin = max(1, 0.05 * (hi - lo))
+        self.graph.set_ylim(lo - margin, hi + margin)
+        return True
+
+    ## update the live line in place and blit it over the cached background
+    def graphSpectrum(self, y):
+        if self.liveLine is None:
+            self.initGraph()
+        if len(y) == len(self.liveLine.get_xdata()):
+            self.liveLine.set_ydata(y)
+        else:
+            self.liveLine.set_data(range(len(y)), y)
+
+        if self.background is None or self.rescaleY(y):
+            self.canvas.draw()
+            return
+
+        self.canvas.restore_region(self.background)
+        self.graph.draw_artist(self.liveLine)
+        self.canvas.blit(self.graph.bbox)
 
+    ## Runs fn on the Tk thread at the next pollQueues() tick.
+    def runOnUiThread(self, fn):
+        if threading.current_thread() is threading.main_thread():
+            fn()
+        else:
+            self.uiQueue.put(fn)
+
+    ##
+    # Tk-thread timer at --max-fps: run any dispatched callables, then graph 
+    # only the newest queued spectrum (older ones were already recorded by the
+    # acquisition thread, they just aren't drawn).
+    def pollQueues(self):
+        while True:
+            try:
+                self.uiQueue.get_nowait()()
+            except queue.Empty:
+                break
+
+        spectrum = None
+        while True:
+            try:
+                spectrum = self.spectrumQueue.get_nowait()
+            except queue.Empty:
+                break
+        if spectrum is not None:
+            self.graphSpectrum(spectrum)
+
+        self.after(max(1, int(1000 / args.max_fps)), self.pollQueues)
+
+    ############################################################################
+    #                                                                          #
+    #                               Acquisition                                #
+    #                                                                          #
+    ############################################################################
+
+    ##
+    # Acquire and post-process one spectrum.  Safe to call from any thread: SPI
+    # access is serialized by lock, and graphing is handed to the Tk thread.
+    #
+    # @param graph: queue the spectrum for the live graph
     def Acquire(self, graph=True, batch=False):
         # get the new spectrum
         debug("calling getSpectrum")
@@ -936,22 +1313,18 @@ class cWinMain(tk.Tk):
 
         # graph
         if graph and not batch:
-            debug(f"graphing spectrum: y {spectrum[:5]}, x {self.wavelengths[:5]}")
-            self.initGraph()
-            self.graphSpectrum(spectrum)
-
-        # schedule next tick
-        if self.acquireActive and not batch:
-            self.schedule_acquire(args.delay_ms + self.getValue("Integration Time"))
+            self.spectrumQueue.put(spectrum)
 
         # for test()
         return spectrum
 
-    def schedule_acquire(self, ms):
-        debug(f"scheduling next tick in {ms}ms")
-        if self.next_cb is not None:
-            self.after_cancel(self.next_cb)
-        self.next_cb = self.after(ms, self.Acquire)
+    ## background thread: acquire continuously while started
+    def acquireLoop(self):
+        while True:
+            self.acquireEvent.wait()
+            self.Acquire()
+            if args.delay_ms > 0:
+                sleep_ms(args.delay_ms)
 
     def FPGAInit(self):
         debug("performing FPGA Init")
@@ -979,9 +1352,9 @@ class cWinMain(tk.Tk):
     def take_throwaways(self):
         if args.throwaways > 0:
             debug("taking throwaways")
-            for i in range(args.throwaways):
-                self.Acquire()
-                self.btnStart.update_idletasks()
+            with self.acquisitionPaused():
+                for i in range(args.throwaways):
+                    self.Acquire()
             debug("done taking throwaways")
 
     def FPGAUpdate(self, force=False):
@@ -1006,55 +1379,55 @@ class cWinMain(tk.Tk):
     #                                                                          #
     ############################################################################
 
+    ## [Batch] button: collect on a worker thread so the GUI stays live
     def batch(self):
+        basename = self.generateBasename()
+        threading.Thread(target=self.runBatch, args=(basename,), name="batch", daemon=True).start()
+
+    def runBatch(self, basename):
         spectra = []
         labels = []
-        for i in range(args.batch_count):
-            label = f"meas-{i+1:02d}"
-            debug(f"batch: collecting {label}")
-            spectrum = self.Acquire(batch=True)
-            spectra.append(spectrum)
-            labels.append(label)
-
-            delay_ms = args.delay_ms + self.getValue("Integration Time")
-            sleep_ms(delay_ms)
+        # live acquisitions would otherwise interleave with the batch
+        with self.acquisitionPaused():
+            for i in range(args.batch_count):
+                label = f"meas-{i+1:02d}"
+                debug(f"batch: collecting {label}")
+                spectrum = self.Acquire(batch=True)
+                spectra.append(spectrum)
+                labels.append(label)
+
+                delay_ms = args.delay_ms + self.getValue("Integration Time")
+                sleep_ms(delay_ms)
 
         self.makeDataDir()
+        pathname = os.path.join(DATA_DIR, "batch-" + basename + ".csv")
+        self.writeSpectra(pathname, self.getMetadata(), labels, spectra)
 
-        filename = "batch-" + self.generateBasename() + ".csv"
-        pathname = os.path.join(DATA_DIR, filename)
+    ##
+    # Snapshot "key, value" metadata for batch and test reports: version,
+    # cfg.*, fixed.*, args.*, eeprom.* and any metrics.* keys given.
+    def getMetadata(self, metrics=()):
+        metadata = [ ("spi_console", VERSION) ]
+        metadata.extend((f"cfg.{key}", value.value) for key, value in self.configMap.items())
+        metadata.extend((f"fixed.{name}", value) for address, value, write_len, name in HARDCODED_PARAMETERS)
+        metadata.extend((f"args.{key}", value) for key, value in args.__dict__.items())
+        if self.eeprom is not None:
+            metadata.extend((f"eeprom.{key}", value) for key, value in self.eeprom.__dict__.items())
+        metadata.extend((f"metrics.{key}", getattr(self, key)) for key in metrics)
+        return metadata
 
-        with open(pathname, "w") as outfile:
-            # metadata
-            outfile.write(f"spi_console, {VERSION}\n")
-            for key, value in self.configMap.items():
-                outfile.write(f"cfg.{key}, {value.value}\n")
-            for address, value, write_len, name in HARDCODED_PARAMETERS:
-                outfile.write(f"fixed.{name}, {value}\n")
-            for key, value in args.__dict__.items():
-                outfile.write(f"args.{key}, {value}\n")
-            if self.eeprom is not None:
-                for key, value in self.eeprom.__dict__.items():
-                    outfile.write(f"eeprom.{key}, {value}\n")
-            outfile.write("\n")
-
-            # header row
-            outfile.write("pixel, wavelength")
-            if self.wavenumbers is not None:
-                outfile.write(", wavenumber")
-            for label in labels:
-                outfile.write(f", {label}")
-            outfile.write("\n")
-
-            # data
-            for pixel in range(self.pixels):
-                outfile.write(f"{pixel}, {self.wavelengths[pixel]:.2f}")
-                if self.wavenumbers is not None:
-                    outfile.write(f", {self.wavenumbers[pixel]:.2f}")
-                for spectrum in spectra:
-                    outfile.write(f", {spectrum[pixel]}")
-                outfile.write("\n")
-        print(f"saved {pathname}")
+    ##
+    # Queue a CSV (and with --npz, .npz sidecar) write on the writer thread.  
+    # Arguments are copied first, so the caller may keep collecting.
+    #
+    # @returns Future completing when the file(s) are written
+    def writeSpectra(self, pathname, metadata, labels, spectra, header_rows=None):
+        def write(spectra, labels, header_rows):
+            writeSpectraCSV(pathname, metadata, labels, spectra, self.wavelengths, self.wavenumbers, header_rows)
+            if args.npz:
+                writeSpectraNPZ(os.path.splitext(pathname)[0] + ".npz", metadata, labels, spectra, self.wavelengths, self.wavenumbers, header_rows)
+        header_rows = { key: list(values) for key, values in (header_rows or {}).items() }
+        return self.writer.submit(write, list(spectra), list(labels), header_rows)
 
     ############################################################################
     #                                                                          #
@@ -1063,15 +1436,15 @@ class cWinMain(tk.Tk):
     ############################################################################
 
     ##
-    # @note This is a blocking callback run from a button event...not generally
-    #       the most robust design.  If we want to grow this, we should spin-off
-    #       a thread and flow-up graph updates via a dispatch to the GUI thread
-    #       (or whatever the Tkinter equivalent would be).
+    # Runs runTest() on a worker thread, so the GUI stays live; graph updates and
+    # widget changes flow back to the Tk thread through runOnUiThread().
     def test(self):
         if not args.paused:
             print("test() can only be started from a paused state")
             return
+        threading.Thread(target=self.runTest, name="test", daemon=True).start()
 
+    def runTest(self):
         ########################################################################
         # Data Collection
         ########################################################################
@@ -1086,14 +1459,17 @@ class cWinMain(tk.Tk):
             "elapsed_ms": [],
             "lo": [],
             "hi": [],
-            "median": []
+            "median": [],
+            "trigger_ms": [],
+            "read_ms": [],
+            "decode_ms": []
         }
         for i in range(args.test_count):
             debug(f"starting test measurement {i+1:3d}/{args.test_count}")
             time_start = datetime.datetime.now()
 
             debug("calling acquire")
-            spectrum = self.Acquire(graph=False)
+            spectrum = self.Acquire()
             debug("back from acquire")
 
             elapsed_ms = (datetime.datetime.now() - time_start).total_seconds() * 1000.0
@@ -1112,6 +1488,8 @@ class cWinMain(tk.Tk):
             self.headers["median"].append(med)
             self.headers["lo"].append(lo)
             self.headers["hi"].append(hi)
+            for key, value in self.lastTiming.items():
+                self.headers[key].append(value)
 
             sleep_ms(args.delay_ms)
 
@@ -1124,14 +1502,26 @@ class cWinMain(tk.Tk):
         self.elapsed_ms = (self.test_stop - self.test_start).total_seconds() * 1000.0
         self.avg_measurement_period_ms = self.elapsed_ms / args.test_count
         self.scan_rate = 1000.0 / self.avg_measurement_period_ms
+        self.avg_trigger_ms = sum(self.headers["trigger_ms"]) / args.test_count
+        self.avg_read_ms    = sum(self.headers["read_ms"])    / args.test_count
+        self.avg_decode_ms  = sum(self.headers["decode_ms"])  / args.test_count
 
         print("=" * 50)
         print(f"Settings:        {args.baud_mhz} MHz with block size {args.block_size} bytes")
         print(f"Total Elapsed:   {self.elapsed_ms:.2f} ms for {args.test_count} measurements")
         print(f"Avg Meas Period: {self.avg_measurement_period_ms:.2f} ms per measurement (min {self.min_elapsed_ms:.2f}, max {self.max_elapsed_ms:.2f})")
         print(f"Avg Scan Rate:   {self.scan_rate:.2f} measurements/sec")
+        print(f"Avg Breakdown:   trigger {self.avg_trigger_ms:.2f} ms, read {self.avg_read_ms:.2f} ms, decode {self.avg_decode_ms:.2f} ms ({'legacy' if args.legacy_read else 'preallocated'} read path)")
         print("=" * 50)
 
+        ########################################################################
+        # Block Size Comparison (optional)
+        ########################################################################
+
+        self.block_size_results = []
+        if args.test_block_sizes:
+            self.test_block_sizes()
+
         ########################################################################
         # Linearity Ramp (optional)
         ########################################################################
@@ -1139,29 +1529,53 @@ class cWinMain(tk.Tk):
         if args.test_linearity:
             for ms in range(args.test_ramp_start, args.test_ramp_stop + 1, args.test_ramp_incr):
                 print(f"collecting ramp measurement at {ms}ms")
-                self.configMap["Integration Time"].Override(ms)
+                self.configMap["Integration Time"].Override(ms, dispatch=self.runOnUiThread)
                 self.take_throwaways()
 
                 time_start = datetime.datetime.now()
                 spectrum = self.Acquire()
                 elapsed_ms = (datetime.datetime.now() - time_start).total_seconds() * 1000.0
-                self.btnClear.update_idletasks()
 
                 self.spectra.append(spectrum)
                 self.headers["label"].append(f"ramp-{ms}ms")
                 self.headers["elapsed_ms"].append(elapsed_ms)
 
                 self.save(to_disk=False)
-                self.btnClear.update_idletasks()
                 sleep_ms(args.delay_ms)
 
         ########################################################################
         # Done
         ########################################################################
 
-        self.save_report()
-        self.quit()
+        self.save_report().result()
+        self.runOnUiThread(self.quit)
 
+    ##
+    # For each --test-block-sizes entry, time --test-count spectra through both
+    # the legacy and preallocated read paths, and report how much of the 
+    # per-spectrum time each block size saves.
+    def test_block_sizes(self):
+        orig = (args.block_size, args.legacy_read)
+        for block_size in [ int(x) for x in args.test_block_sizes.split(",") ]:
+            avg = {}
+            for legacy_read in [True, False]:
+                args.block_size, args.legacy_read = block_size, legacy_read
+                totals = { "trigger_ms": 0, "read_ms": 0, "decode_ms": 0 }
+                for i in range(args.test_count):
+                    self.getSpectrum()
+                    for key, value in self.lastTiming.items():
+                        totals[key] += value
+                avg[legacy_read] = { key: value / args.test_count for key, value in totals.items() }
+            self.block_size_results.append((block_size, avg[True], avg[False]))
+        args.block_size, args.legacy_read = orig
+
+        print(f"{'block':>6s} | {'legacy read':>11s} {'decode':>7s} | {'prealloc read':>13s} {'decode':>7s} | {'saved ms':>8s}")
+        for block_size, legacy, fast in self.block_size_results:
+            saved_ms = (legacy["read_ms"] + legacy["decode_ms"]) - (fast["read_ms"] + fast["decode_ms"])
+            print(f"{block_size:6d} | {legacy['read_ms']:11.2f} {legacy['decode_ms']:7.2f} | {fast['read_ms']:13.2f} {fast['decode_ms']:7.2f} | {saved_ms:8.2f}")
+        print("=" * 50)
+
+    ## @returns Future from writeSpectra
     def save_report(self):
         self.makeDataDir()
         if self.eeprom is not None:
@@ -1170,49 +1584,16 @@ class cWinMain(tk.Tk):
             filename = f"test-{timestamp()}.csv"
         pathname = os.path.join(DATA_DIR, filename)
 
-        with open(pathname, "w") as outfile:
-            # metadata
-            outfile.write(f"spi_console, {VERSION}\n")
-            for key, value in self.configMap.items():
-                outfile.write(f"cfg.{key}, {value.value}\n")
-            for address, value, write_len, name in HARDCODED_PARAMETERS:
-                outfile.write(f"fixed.{name}, {value}\n")
-            for key, value in args.__dict__.items():
-                outfile.write(f"args.{key}, {value}\n")
-            if self.eeprom is not None:
-                for key, value in self.eeprom.__dict__.items():
-                    outfile.write(f"eeprom.{key}, {value}\n")
-            for key in ['test_start', 'test_stop', 'elapsed_ms', 'min_elapsed_ms', 'max_elapsed_ms', 'avg_measurement_period_ms', 'scan_rate']:
-                outfile.write(f"metrics.{key}, {getattr(self, key)}\n")
-            outfile.write("\n")
-
-            # extra header rows
-            for key in self.headers:
-                if key != "label":
-                    outfile.write(f", {key}")
-                    if self.wavenumbers is not None:
-                        outfile.write(",")
-                    for value in self.headers[key]:
-                        outfile.write(f", {value:.2f}")
-                    outfile.write("\n")
-
-            # label header row
-            outfile.write("pixel, wavelength")
-            if self.wavenumbers is not None:
-                outfile.write(", wavenumber")
-            for label in self.headers["label"]:
-                outfile.write(f", {label}")
-            outfile.write("\n")
-
-            # data
-            for pixel in range(self.pixels):
-                outfile.write(f"{pixel}, {self.wavelengths[pixel]:.2f}")
-                if self.wavenumbers is not None:
-                    outfile.write(f", {self.wavenumbers[pixel]:.2f}")
-                for spectrum in self.spectra:
-                    outfile.write(f", {spectrum[pixel]}")
-                outfile.write("\n")
-        print(f"saved {pathname}")
+        metrics = ['test_start', 'test_stop', 'elapsed_ms', 'min_elapsed_ms', 'max_elapsed_ms', 'avg_measurement_period_ms', 'scan_rate',
+                   'avg_trigger_ms', 'avg_read_ms', 'avg_decode_ms']
+        metadata = self.getMetadata(metrics)
+        for block_size, legacy, fast in self.block_size_results:
+            for label, timing in [("legacy", legacy), ("prealloc", fast)]:
+                for key, value in timing.items():
+                    metadata.append((f"block_size.{block_size}.{label}.{key}", f"{value:.3f}"))
+
+        header_rows = { key: values for key, values in self.headers.items() if key != "label" }
+        return self.writeSpectra(pathname, metadata, self.headers["label"], self.spectra, header_rows)
 
     def generate_wavecal(self):
         if self.eeprom is not None:
@@ -1223,24 +1604,9 @@ class cWinMain(tk.Tk):
         else:
             coeffs = [0, 1, 0, 0, 0]
 
-        self.wavelengths = []
-        for i in range(self.pixels):
-            wavelength = coeffs[0]               \
-                       + coeffs[1] * i           \
-                       + coeffs[2] * i * i       \
-                       + coeffs[3] * i * i * i   \
-                       + coeffs[4] * i * i * i * i
-            self.wavelengths.append(wavelength)
+        self.wavelengths, self.wavenumbers = generate_axes(tuple(coeffs), self.pixels, args.excitation_nm)
         debug(f"wavelengths = ({self.wavelengths[0]:.2f}, {self.wavelengths[-1]:.2f})")
-
-        if args.excitation_nm > 0:
-            self.wavenumbers = []
-            base = 1e7 / args.excitation_nm
-            for i in range(self.pixels):
-                wavenumber = 0
-                if self.wavelengths[i] != 0:
-                    wavenumber = base - 1e7 / self.wavelengths[i]
-                self.wavenumbers.append(wavenumber)
+        if self.wavenumbers is not None:
             debug(f"wavenumbers = ({self.wavenumbers[0]:.2f}, {self.wavenumbers[-1]:.2f})")
 
     def update_axes(self):
@@ -1384,35 +1750,273 @@ class EEPROM:
             debug("Unpacked [%s]: %s (%s)" % (data_type, unpack_result, label))
         return unpack_result
 
+################################################################################
+#                                                                              #
+#                                   Tuning                                     #
+#                                                                              #
+################################################################################
+
+##
+# Sweep --tune-baud-mhz x --tune-block-sizes against the connected FPGA (or 
+# --simulate), measuring spectra/sec and error rate at each pair, then write the
+# fastest pair within --tune-max-error-rate to --profile for later runs to load.
+#
+# Errors counted per configuration (each spectrum and each readback is one 
+# transaction):
+#
+# - CRC mismatches on FPGA revision reads
+# - revision reads that decode differently than at the slowest baud rate
+# - write acknowledgements other than SUCCESS
+# - spectra shorter than the expected pixel count
+class cTuner:
+
+    def __init__(self, SPI, ready, trigger):
+        self.SPI     = SPI
+        self.ready   = ready
+        self.trigger = trigger
+        self.results = []
+
+        self.baud_rates  = sorted(int(x) for x in args.tune_baud_mhz.split(","))
+        self.block_sizes = sorted(int(x) for x in args.tune_block_sizes.split(","))
+
+    def configure(self, baud_mhz):
+        self.SPI.configure(baudrate=baud_mhz * 1e6, phase=0, polarity=0, bits=8)
+
+    def writeIntegrationTime(self):
+        return send_command(SPI=self.SPI, ready=self.ready, address=0x11, value=args.integration_time_ms, write_len=4, name="Integration Time")
+
+    def setup(self):
+        self.configure(self.baud_rates[0])
+        with lock:
+            flushInputBuffer(self.ready, self.SPI)
+
+        self.eeprom = None
+        self.pixels = args.pixels
+        if args.eeprom_file:
+            self.eeprom = EEPROM(pathname=args.eeprom_file)
+        elif args.eeprom:
+            self.eeprom = EEPROM(spi=self.SPI)
+        if self.eeprom is not None:
+            self.pixels = self.eeprom.active_pixels_horizontal
+
+        for address, value, write_len, name in HARDCODED_PARAMETERS:
+            send_command(SPI=self.SPI, ready=self.ready, address=address, value=value, write_len=write_len, name=name)
+        send_command(SPI=self.SPI, ready=self.ready, address=0x14, value=gain_to_ff(args.gain_db), write_len=3, name="Detector Gain")
+        send_command(SPI=self.SPI, ready=self.ready, address=0x50, value=args.start_line,          write_len=3, name="Start Line 0")
+        send_command(SPI=self.SPI, ready=self.ready, address=0x51, value=args.stop_line,           write_len=3, name="Stop Line 0")
+        self.writeIntegrationTime()
+
+        # reference revision at the slowest (most reliable) baud rate
+        self.revision = readRevision(self.SPI)
+        print(f"tuning {self.pixels} pixels against FPGA revision {self.revision.decode(errors='replace')}")
+
+    def measure(self, baud_mhz, block_size):
+        self.block_size = block_size
+        errors = 0
+        crc_errors_start = crc_errors
+
+        if self.writeIntegrationTime() != "SUCCESS":
+            errors += 1
+        for i in range(args.tune_count):
+            if readRevision(self.SPI) != self.revision:
+                errors += 1
+        errors += crc_errors - crc_errors_start
+
+        buf = bytearray(self.pixels * 2)
+        view = memoryview(buf)
+        time_start = time.perf_counter()
+        for i in range(args.tune_count):
+            if acquireInto(self.SPI, self.ready, self.trigger, view, self.block_size) < len(buf):
+                errors += 1
+        elapsed_sec = time.perf_counter() - time_start
+
+        transactions = 1 + 2 * args.tune_count
+        result = { "baud_mhz": baud_mhz, 
+                   "block_size": block_size, 
+                   "spectra_per_sec": args.tune_count / elapsed_sec, 
+                   "errors": errors,
+                   "error_rate": errors / transactions }
+        print(f"{baud_mhz:4d} MHz  {block_size:5d} bytes  {result['spectra_per_sec']:8.2f} spectra/sec  {errors:3d} errors ({result['error_rate']:.3f})")
+        return result
+
+    ## @returns the best result, or None if nothing met --tune-max-error-rate
+    def run(self):
+        self.setup()
+        for baud_mhz in self.baud_rates:
+            self.configure(baud_mhz)
+            for block_size in self.block_sizes:
+                self.results.append(self.measure(baud_mhz, block_size))
+        self.configure(self.baud_rates[0])
+
+        acceptable = [ r for r in self.results if r["error_rate"] <= args.tune_max_error_rate ]
+        if not acceptable:
+            print(f"no configuration met --tune-max-error-rate {args.tune_max_error_rate}; {args.profile} not written")
+            return None
+
+        # fastest wins; among near-ties (within 2%), prefer the lower baud rate for margin
+        fastest = max(r["spectra_per_sec"] for r in acceptable)
+        best = min((r for r in acceptable if r["spectra_per_sec"] >= 0.98 * fastest), 
+                   key=lambda r: (r["baud_mhz"], -r["spectra_per_sec"]))
+
+        profile = { "baud_mhz": best["baud_mhz"],
+                    "block_size": best["block_size"],
+                    "spectra_per_sec": best["spectra_per_sec"],
+                    "error_rate": best["error_rate"],
+                    "tuned": timestamp(),
+                    "serial_number": self.eeprom.serial_number if self.eeprom is not None else None,
+                    "fpga_revision": self.revision.decode(errors="replace"),
+                    "simulated": args.simulate,
+                    "results": self.results }
+        with open(args.profile, "w") as f:
+            json.dump(profile, f, indent=2)
+
+        print("=" * 50)
+        print(f"Best:            {best['baud_mhz']} MHz with block size {best['block_size']} bytes")
+        print(f"Scan Rate:       {best['spectra_per_sec']:.2f} spectra/sec (error rate {best['error_rate']:.3f})")
+        print(f"Saved:           {args.profile}")
+        print("=" * 50)
+        return best
+
+################################################################################
+#                                                                              #
+#                                 Benchmark                                    #
+#                                                                              #
+################################################################################
+
+##
+# Time each SPI framing primitive --benchmark-count times against the connected
+# FPGA (or --simulate), reporting per-operation latency, throughput and the 
+# errors detected.  Under --simulate, detected errors are compared with the 
+# faults the simulator actually injected.
+class cBenchmark:
+
+    def __init__(self, SPI, ready, trigger):
+        self.SPI     = SPI
+        self.ready   = ready
+        self.trigger = trigger
+        self.results = []
+
+    ## @param op returns the number of errors it detected (or None)
+    def time(self, name, op, count):
+        errors = 0
+        time_start = time.perf_counter()
+        for i in range(count):
+            errors += op() or 0
+        elapsed_ms = (time.perf_counter() - time_start) * 1000.0
+        self.results.append((name, count, elapsed_ms, errors))
+
+    def run(self):
+        count = args.benchmark_count
+        pixels = args.pixels
+        view = memoryview(bytearray(pixels * 2))
+        cmd = [START, 0x00, 4, 0x91, 3, 0, 0, CRC, END]
+
+        with lock:
+            flushInputBuffer(self.ready, self.SPI)
+        revision = readRevision(self.SPI)
+
+        def write():
+            return send_command(self.SPI, self.ready, 0x11, args.integration_time_ms, 4, "Integration Time", verbose=False) != "SUCCESS"
+        def read():
+            crc_errors_start = crc_errors
+            mismatch = readRevision(self.SPI) != revision
+            return max(int(mismatch), crc_errors - crc_errors_start)
+        def trigger():
+            with lock:
+                self.trigger.value = True
+                waitForDataReady(self.ready)
+                self.trigger.value = False
+        def flush():
+            with lock:
+                flushInputBuffer(self.ready, self.SPI)
+        def crc():
+            computeCRC(cmd[1:-2])
+        def wait():
+            trigger()
+            with lock:
+                return readBlocksInto(self.SPI, self.ready, view, len(view)) < len(view) # drain in one call
+        def pending_flush():
+            trigger()
+            flush()
+        def spectrum():
+            return acquireInto(self.SPI, self.ready, self.trigger, view, args.block_size) < len(view)
+        def eeprom():
+            EEPROM(spi=self.SPI)
+
+        wait_name = "trigger + waitForDataReady (+drain)"
+        spectrum_name = f"spectrum ({args.block_size}-byte blocks)"
+        self.time("computeCRC",                             crc, count)
+        self.time("send_command",                           write, count)
+        self.time("read + decode_read_response",            read, count)
+        self.time("flushInputBuffer (idle)",                flush, count)
+        self.time("flushInputBuffer (whole spectrum)",      pending_flush, 1)
+        self.time(wait_name,                                wait, count)
+        self.time(spectrum_name,                            spectrum, count)
+        self.time("EEPROM (5 pages)",                       eeprom, 1)
+
+        print("=" * 90)
+        print(f"Settings: {args.baud_mhz} MHz, block size {args.block_size} bytes, {pixels} pixels{' (simulated)' if args.simulate else ''}")
+        print(f"{'operation':40s} {'count':>6s} {'ms/op':>9s} {'ops/sec':>10s} {'errors':>7s}")
+        for name, n, elapsed_ms, errors in self.results:
+            print(f"{name:40s} {n:6d} {elapsed_ms / n:9.3f} {1000.0 * n / elapsed_ms:10.1f} {errors:7d}")
+        print("=" * 90)
+
+        if args.simulate:
+            detected = { name: errors for name, n, elapsed_ms, errors in self.results }
+            stats = self.SPI.fpga.stats
+            print(self.SPI.summary())
+            print(f"write NAKs:    {detected['send_command']} detected, {stats['naks_injected']} injected + {stats['bad_frames']} corrupted frames (including EEPROM page loads, whose ack is not checked)")
+            print(f"short spectra: {detected[wait_name] + detected[spectrum_name]} detected, {stats['drops_injected']} READY drops injected (including any in whole-spectrum flush)")
+            print(f"read errors:   {detected['read + decode_read_response']} detected, {self.SPI.corrupted} bytes corrupted in total")
+
 ################################################################################
 #                                                                              #
 #                                   main()                                     #
 #                                                                              #
 ################################################################################
 
-# parse command-line args (user may need different trigger/ready pins)
-args = parseArgs(sys.argv)
-if not runnable:
-    sys.exit(1)
+if __name__ == "__main__":
+    # parse command-line args (user may need different trigger/ready pins)
+    args = parseArgs(sys.argv)
+
+    if args.simulate:
+        import SimulatedFT232H
+        SPI, ready, trigger = SimulatedFT232H.create(pixels          = args.pixels,
+                                                     call_latency_ms = args.sim_latency_ms,
+                                                     readout_ms      = args.sim_readout_ms,
+                                                     reliable_mhz    = args.sim_reliable_mhz,
+                                                     nak_rate        = args.sim_nak_rate,
+                                                     drop_rate       = args.sim_drop_rate,
+                                                     seed            = args.sim_seed)
+    else:
+        if not runnable:
+            sys.exit(1)
+
+        # Initialize the SPI bus on the FT232H
+        SPI = busio.SPI(clock=board.SCK, MISO=board.MISO, MOSI=board.MOSI)
 
-# Initialize the SPI bus on the FT232H
-SPI = busio.SPI(clock=board.SCK, MISO=board.MISO, MOSI=board.MOSI)
+        # Initialize READY (input)
+        ready = digitalio.DigitalInOut(getattr(board, args.ready_pin.upper()))
+        ready.direction = digitalio.Direction.INPUT
 
-# Initialize READY (input)
-ready = digitalio.DigitalInOut(getattr(board, args.ready_pin.upper()))
-ready.direction = digitalio.Direction.INPUT
+        # Initialize TRIGGER (output)
+        trigger = digitalio.DigitalInOut(getattr(board, args.trigger_pin.upper()))
+        trigger.direction = digitalio.Direction.OUTPUT
+        trigger.value = False
+
+    # Take control of the SPI Bus
+    while not SPI.try_lock():
+        pass
 
-# Initialize TRIGGER (output)
-trigger = digitalio.DigitalInOut(getattr(board, args.trigger_pin.upper()))
-trigger.direction = digitalio.Direction.OUTPUT
-trigger.value = False
+    # Configure the SPI bus
+    SPI.configure(baudrate=args.baud_mhz * 1e6, phase=0, polarity=0, bits=8)
 
-# Take control of the SPI Bus
-while not SPI.try_lock():
-    pass
+    if args.tune:
+        sys.exit(0 if cTuner(SPI, ready, trigger).run() else 1)
 
-# Configure the SPI bus
-SPI.configure(baudrate=args.baud_mhz * 1e6, phase=0, polarity=0, bits=8)
+    if args.benchmark:
+        cBenchmark(SPI, ready, trigger).run()
+        sys.exit(0)
 
-# Create the main window and pass in the handles
-winSIG = cWinMain(SPI, ready, trigger, fIntValidate)
+    # Create the main window and pass in the handles
+    winSIG = cWinMain(SPI, ready, trigger, fIntValidate)
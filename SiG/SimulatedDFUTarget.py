@@ -0,0 +1,314 @@
+"""
+Software stand-in for a SiG (STM32 bridging USB to the BL652 / nRF52832
+bootloader), so that ble_dfu.py can run a full application upgrade without
+hardware (--simulate).
+
+The object returned by create() mimics the pyusb device ble_dfu.py normally
+finds, answering the two vendor requests it uses:
+
+    0x8c (HOST_TO_DEVICE)  [ LEN, SLIP-encoded request ..., 0xC0 ]
+    0x8d (DEVICE_TO_HOST)  [ LEN, SLIP-encoded response ..., 0xC0 ], or a
+                           lone byte when no response is waiting
+
+Behind that, the target implements the Nordic serial DFU object protocol
+closely enough for ble_dfu.py's own encoders and parsers: MTU_GET,
+OBJECT_SELECT, OBJECT_CREATE, OBJECT_WRITE, CRC_GET, OBJECT_EXECUTE,
+FIRMWARE_VERSION, PING and ABORT, with the usual command (init packet) and
+data objects, and a CRC32 over everything received so far.
+
+https://infocenter.nordicsemi.com/topic/sdk_nrf5_v16.0.0/lib_dfu_transport_serial.html
+
+Timing model: every request spends chunk_ms crossing the STM32-to-BLE link,
+one at a time, and responses only become readable once their request has
+been delivered.  Creating a data object erases flash for erase_ms.
+
+Fault model: OBJECT_WRITE chunks are lost when more than queue_depth are
+already waiting for the link, when they are delivered during an erase, and
+additionally at drop_rate; corrupt_rate flips a bit in a delivered chunk.
+Control requests are never lost.  All of these show up on the host as an
+offset or CRC mismatch, and are counted in stats.  disconnect_after raises
+OSError (as a dropped USB connection would) once that many data objects
+have been executed by this instance.
+
+Persistence: given a state_file, the init packet and executed data objects
+are loaded from it at startup and saved whenever they change, so the target
+"survives" the host process like the real bootloader's flash and settings
+page do.  As on the real bootloader, creating a new command object discards
+all data progress.
+"""
+
+import array
+import json
+import os
+import random
+import time
+import zlib
+
+SLIP_END     = 0xC0
+SLIP_ESC     = 0xDB
+SLIP_ESC_END = 0xDC
+SLIP_ESC_ESC = 0xDD
+
+OP_PROTOCOL_VERSION = 0x00
+OP_OBJECT_CREATE    = 0x01
+OP_RECEIPT_NOTIF    = 0x02
+OP_CRC_GET          = 0x03
+OP_OBJECT_EXECUTE   = 0x04
+OP_OBJECT_SELECT    = 0x06
+OP_MTU_GET          = 0x07
+OP_OBJECT_WRITE     = 0x08
+OP_PING             = 0x09
+OP_FIRMWARE_VERSION = 0x0B
+OP_ABORT            = 0x0C
+OP_RESPONSE         = 0x60
+
+RES_SUCCESS                 = 0x01
+RES_OP_CODE_NOT_SUPPORTED   = 0x02
+RES_INVALID_PARAMETER       = 0x03
+RES_OPERATION_NOT_PERMITTED = 0x08
+
+OBJ_TYPE_COMMAND = 0x1
+OBJ_TYPE_DATA    = 0x2
+
+TX_MSG_TO_TGT = 0x8c
+POLL_TGT      = 0x8d
+
+def slip_encode(data):
+    return bytes(data).replace(bytes([SLIP_ESC]), bytes([SLIP_ESC, SLIP_ESC_ESC])) \
+                      .replace(bytes([SLIP_END]), bytes([SLIP_ESC, SLIP_ESC_END])) + bytes([SLIP_END])
+
+def slip_decode(data):
+    """ @returns the payload up to the first END, or None on a protocol violation """
+    data = bytes(data)
+    end = data.find(SLIP_END)
+    if end >= 0:
+        data = data[:end]
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        if data[i] == SLIP_ESC:
+            if i + 1 >= len(data) or data[i + 1] not in (SLIP_ESC_END, SLIP_ESC_ESC):
+                return None
+            out.append(SLIP_END if data[i + 1] == SLIP_ESC_END else SLIP_ESC)
+            i += 2
+        else:
+            out.append(data[i])
+            i += 1
+    return bytes(out)
+
+def le32(value):
+    return (value & 0xffffffff).to_bytes(4, "little")
+
+class SimulatedDFUTarget:
+
+    def __init__(self, max_command_size=256, max_data_size=4096, mtu=64, fw_version=40301,
+                 chunk_ms=5.0, queue_depth=4, erase_ms=90.0, drop_rate=0.0, corrupt_rate=0.0, seed=None,
+                 state_file=None, disconnect_after=None):
+        self.idVendor = 0x24aa
+        self.idProduct = 0x4000
+
+        self.max_size = { OBJ_TYPE_COMMAND: max_command_size, OBJ_TYPE_DATA: max_data_size }
+        self.mtu = mtu
+        self.fw_version = fw_version
+        self.chunk_ms = chunk_ms
+        self.queue_depth = queue_depth
+        self.erase_ms = erase_ms
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.rng = random.Random(seed)
+        self.state_file = state_file
+        self.disconnect_after = disconnect_after
+
+        self.link_free_at = 0       # when the STM32-to-BLE link finishes its current backlog
+        self.responses = []         # (ready time, encoded response)
+        self.stats = { "requests": 0, "writes": 0, "queue_drops": 0, "erase_drops": 0, "random_drops": 0,
+                       "corrupted": 0, "objects_executed": 0, "crc_requests": 0 }
+        self.reset()
+        self.load()
+
+    def reset(self):
+        """ forget everything, as after ABORT """
+        self.command = bytearray()  # init packet received so far
+        self.command_size = 0
+        self.command_valid = False
+        self.reset_data()
+        self.selected = OBJ_TYPE_COMMAND
+
+    def reset_data(self):
+        self.image = bytearray()    # executed (committed) data objects
+        self.current = bytearray()  # data object in progress
+        self.current_size = 0
+        self.erase_until = 0
+
+    def load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        with open(self.state_file) as infile:
+            state = json.load(infile)
+        self.command = bytearray.fromhex(state["command"])
+        self.command_size = len(self.command)
+        self.command_valid = state["command_valid"]
+        self.image = bytearray.fromhex(state["image"])
+
+    def save(self):
+        if not self.state_file:
+            return
+        state = { "command": self.command.hex(), "command_valid": self.command_valid, "image": self.image.hex() }
+        with open(self.state_file + ".tmp", "w") as outfile:
+            json.dump(state, outfile)
+        os.replace(self.state_file + ".tmp", self.state_file)
+
+    ############################################################################
+    # USB
+    ############################################################################
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+        if bRequest == TX_MSG_TO_TGT:
+            data = bytes(data_or_wLength)
+            self.receive(data[1 : 1 + data[0]])
+            return len(data)
+        elif bRequest == POLL_TGT:
+            now = time.perf_counter()
+            if self.responses and self.responses[0][0] <= now:
+                response = self.responses.pop(0)[1]
+                return array.array('B', bytes([len(response)]) + response)
+            return array.array('B', [0])
+        return 0 # anything else (e.g. the UART reset) is acknowledged and ignored
+
+    def receive(self, encoded):
+        now = time.perf_counter()
+        self.stats["requests"] += 1
+
+        request = slip_decode(encoded)
+        if not request:
+            return
+
+        # queue the request behind whatever is still crossing the link
+        start = max(now, self.link_free_at)
+        if request[0] == OP_OBJECT_WRITE:
+            self.stats["writes"] += 1
+            if start - now > self.queue_depth * self.chunk_ms / 1000.0:
+                self.stats["queue_drops"] += 1
+                return
+        self.link_free_at = start + self.chunk_ms / 1000.0
+
+        response = self.process(request, delivered=self.link_free_at)
+        if response is not None:
+            self.responses.append((self.link_free_at, slip_encode(bytes([OP_RESPONSE, request[0]]) + response)))
+
+    ############################################################################
+    # DFU object protocol
+    ############################################################################
+
+    def crc(self):
+        return zlib.crc32(self.current, zlib.crc32(self.image))
+
+    def process(self, request, delivered):
+        """ @returns the response payload following [0x60, opcode], or None """
+        op, params = request[0], request[1:]
+
+        if op == OP_OBJECT_WRITE:
+            self.write(params, delivered)
+            return None
+        elif op == OP_PING:
+            return bytes([RES_SUCCESS]) + params[:1]
+        elif op == OP_MTU_GET:
+            return bytes([RES_SUCCESS]) + self.mtu.to_bytes(2, "little")
+        elif op == OP_RECEIPT_NOTIF:
+            return bytes([RES_SUCCESS])
+        elif op == OP_ABORT:
+            self.reset()
+            self.save()
+            return bytes([RES_SUCCESS])
+        elif op == OP_FIRMWARE_VERSION:
+            return bytes([RES_SUCCESS, 0x01]) + le32(self.fw_version) + le32(0x26000) + le32(len(self.image))
+        elif op == OP_OBJECT_SELECT:
+            if not params or params[0] not in self.max_size:
+                return bytes([RES_INVALID_PARAMETER])
+            self.selected = params[0]
+            if self.selected == OBJ_TYPE_COMMAND:
+                offset, crc = len(self.command), zlib.crc32(self.command)
+            else:
+                offset, crc = len(self.image) + len(self.current), self.crc()
+            return bytes([RES_SUCCESS]) + le32(self.max_size[self.selected]) + le32(offset) + le32(crc)
+        elif op == OP_OBJECT_CREATE:
+            return self.create(params, delivered)
+        elif op == OP_CRC_GET:
+            self.stats["crc_requests"] += 1
+            if self.selected == OBJ_TYPE_COMMAND:
+                return bytes([RES_SUCCESS]) + le32(len(self.command)) + le32(zlib.crc32(self.command))
+            return bytes([RES_SUCCESS]) + le32(len(self.image) + len(self.current)) + le32(self.crc())
+        elif op == OP_OBJECT_EXECUTE:
+            return self.execute()
+        return bytes([RES_OP_CODE_NOT_SUPPORTED])
+
+    def create(self, params, delivered):
+        if len(params) < 5:
+            return bytes([RES_INVALID_PARAMETER])
+        obj_type, size = params[0], int.from_bytes(params[1:5], "little")
+        if obj_type not in self.max_size or not 0 < size <= self.max_size[obj_type]:
+            return bytes([RES_INVALID_PARAMETER])
+
+        self.selected = obj_type
+        if obj_type == OBJ_TYPE_COMMAND:
+            self.command = bytearray()
+            self.command_size = size
+            self.command_valid = False
+            self.reset_data()
+            self.save()
+        else:
+            if not self.command_valid:
+                return bytes([RES_OPERATION_NOT_PERMITTED])
+            self.current = bytearray()
+            self.current_size = size
+            self.erase_until = delivered + self.erase_ms / 1000.0
+        return bytes([RES_SUCCESS])
+
+    def write(self, data, delivered):
+        if self.selected == OBJ_TYPE_COMMAND:
+            self.command.extend(data[:self.command_size - len(self.command)])
+            return
+
+        if delivered < self.erase_until:
+            self.stats["erase_drops"] += 1
+            return
+        if self.drop_rate and self.rng.random() < self.drop_rate:
+            self.stats["random_drops"] += 1
+            return
+        if self.corrupt_rate and data and self.rng.random() < self.corrupt_rate:
+            data = bytearray(data)
+            data[self.rng.randrange(len(data))] ^= 1 << self.rng.randrange(8)
+            self.stats["corrupted"] += 1
+        self.current.extend(data[:self.current_size - len(self.current)])
+
+    def execute(self):
+        if self.selected == OBJ_TYPE_COMMAND:
+            if not self.command or len(self.command) != self.command_size:
+                return bytes([RES_OPERATION_NOT_PERMITTED])
+            self.command_valid = True
+            self.save()
+            return bytes([RES_SUCCESS])
+
+        if not self.current or len(self.current) != self.current_size:
+            return bytes([RES_OPERATION_NOT_PERMITTED])
+        self.image.extend(self.current)
+        self.current = bytearray()
+        self.current_size = 0
+        self.stats["objects_executed"] += 1
+        self.save()
+        if self.disconnect_after is not None and self.stats["objects_executed"] >= self.disconnect_after:
+            raise OSError("SimulatedDFUTarget: simulated USB disconnect after {} data objects".format(self.stats["objects_executed"]))
+        return bytes([RES_SUCCESS])
+
+    def summary(self):
+        stats = ", ".join(f"{key} {value}" for key, value in self.stats.items())
+        return f"SimulatedDFUTarget: {len(self.image)} image bytes committed; {stats}"
+
+##
+# @returns a SimulatedDFUTarget standing in for the SiG's pyusb device
+# @see SimulatedDFUTarget for the timing and fault parameters
+def create(chunk_ms=5.0, queue_depth=4, erase_ms=90.0, drop_rate=0.0, corrupt_rate=0.0, seed=None,
+           state_file=None, disconnect_after=None):
+    return SimulatedDFUTarget(chunk_ms=chunk_ms, queue_depth=queue_depth, erase_ms=erase_ms,
+                              drop_rate=drop_rate, corrupt_rate=corrupt_rate, seed=seed,
+                              state_file=state_file, disconnect_after=disconnect_after)
@@ -1,20 +1,42 @@
 #!/usr/bin/python3
 
 '''
-Converts a binary file into an intel hex file
+Converts a binary file into an intel hex file, or (-r) back
 Usage: Bin2Hex.py [-A base_address] [-n] [-F yes|no] -b <binary_file> -o <hex_to_be_created>
+       Bin2Hex.py -r [-A base_address] -o <hex_file> -b <binary_to_be_created>
+       Bin2Hex.py --benchmark [-b <binary_file>] [-A base_address]
 
 pavel_a@fastmail.fm 05-aug-2022
 Original: https://community.silabs.com/s/article/converting-binary-firmware-image-files-to-intel-hex-files-bin-to-hex-x
+
+convertBinaryToHex() reads the binary one 64 KiB address segment at a time
+and formats each segment's records in bulk: one bytes.hex() for the segment,
+precomputed record prefixes and checksum suffixes, and erased (all-FF) rows
+located with bytes.find rather than byte by byte.  Its output is identical 
+to convertBinaryToHexLegacy(), the original byte-at-a-time implementation, 
+which --benchmark checks and times it against.
 '''
 
 import argparse
+import os
+import random
 import sys
+import tempfile
+import time
 
 sDESC="Converts binary file to Intel Hex"
 sEPILOG="Long series of FF bytes will not be copied to the output file unless -F yes flag is given"
 
 HEX_LINE_LEN = 32
+SEGMENT_LEN = 0x10000
+
+ERASED_ROW = b'\xFF' * HEX_LINE_LEN
+
+# ':LLAAAA00' for every full, aligned data record in a segment, and the sum of
+# its header bytes for the checksum
+ROW_PREFIXES = [':{:02X}{:04X}00'.format(HEX_LINE_LEN, addr) for addr in range(0, SEGMENT_LEN, HEX_LINE_LEN)]
+ROW_HEADER_SUMS = [HEX_LINE_LEN + (addr >> 8) + (addr & 0xFF) for addr in range(0, SEGMENT_LEN, HEX_LINE_LEN)]
+CHECKSUM_SUFFIXES = ['{:02X}\n'.format(checksum) for checksum in range(256)]
 
 def ConstructRecord(recordType, address, data) -> bytes:
 
@@ -49,7 +71,7 @@ def ConstructRecord(recordType, address, data) -> bytes:
     
     return recordStr.encode('ascii', errors='strict')
 
-def convertBinaryToHex(binaryPath, hexPath, start_addr = 0, noEndRecord = False, ignoreErasedRecords = True):
+def convertBinaryToHexLegacy(binaryPath, hexPath, start_addr = 0, noEndRecord = False, ignoreErasedRecords = True):
     
     address = start_addr & 0xFFFF  # initial offset, low part
     addr_high = (start_addr >> 16) & 0xFFFF
@@ -94,23 +116,256 @@ def convertBinaryToHex(binaryPath, hexPath, start_addr = 0, noEndRecord = False,
         hexFile.write(ConstructRecord(0x01, 0x0000, []))
     hexFile.close()
 
+def findRecordRows(data, ignoreErasedRecords = True):
+    '''
+    Yields the offsets of the HEX_LINE_LEN rows of data to write as records,
+    leaving out rows that are entirely 0xFF if ignoreErasedRecords.
+    '''
+    n = len(data)
+    if not ignoreErasedRecords:
+        yield from range(0, n, HEX_LINE_LEN)
+        return
+
+    offset = 0
+    while offset < n:
+        # No erased row can start before the first full row's worth of FF
+        found = data.find(ERASED_ROW, offset)
+        stop = n if found < 0 else found + (-found % HEX_LINE_LEN)
+        for row in range(offset, stop, HEX_LINE_LEN):
+            if row + HEX_LINE_LEN <= n or data[row:].strip(b'\xFF'):
+                yield row
+        if found < 0:
+            return
+
+        # skip the erased rows from stop on, if the FF run covers any
+        while data.startswith(ERASED_ROW, stop):
+            stop += HEX_LINE_LEN
+        offset = stop
+
+def formatDataRecords(data, address, ignoreErasedRecords = True) -> bytes:
+    '''
+    Data records for data starting at the 16-bit address, HEX_LINE_LEN bytes
+    per record; data must not extend past the end of the 64 KiB segment.
+    '''
+    assert 0 <= address and address + len(data) <= SEGMENT_LEN
+    view = memoryview(data)
+    text = data.hex().upper()
+    aligned = address % HEX_LINE_LEN == 0
+
+    lines = []
+    for offset in findRecordRows(data, ignoreErasedRecords):
+        row = view[offset : offset + HEX_LINE_LEN]
+        rowAddr = address + offset
+        if aligned and len(row) == HEX_LINE_LEN:
+            lines.append(ROW_PREFIXES[rowAddr // HEX_LINE_LEN])
+            headerSum = ROW_HEADER_SUMS[rowAddr // HEX_LINE_LEN]
+        else:
+            lines.append(':{:02X}{:04X}00'.format(len(row), rowAddr))
+            headerSum = len(row) + (rowAddr >> 8) + (rowAddr & 0xFF)
+        lines.append(text[2 * offset : 2 * (offset + len(row))])
+        lines.append(CHECKSUM_SUFFIXES[-(headerSum + sum(row)) & 0xFF])
+    return ''.join(lines).encode('ascii')
+
+def convertBinaryToHex(binaryPath, hexPath, start_addr = 0, noEndRecord = False, ignoreErasedRecords = True):
+
+    address = start_addr & 0xFFFF  # initial offset, low part
+    addr_high = (start_addr >> 16) & 0xFFFF
+
+    with open(binaryPath, 'rb') as binaryFile, open(hexPath, 'wb') as hexFile:
+        if address != 0 :
+            hexFile.write(ConstructRecord(0x04, 0x0000, addr_high.to_bytes(2, 'big')))
+
+        while True:
+            segment = binaryFile.read(SEGMENT_LEN - address)
+            if not segment:
+                break
+            if address == 0 :
+                hexFile.write(ConstructRecord(0x04, 0x0000, addr_high.to_bytes(2, 'big')))
+            hexFile.write(formatDataRecords(segment, address, ignoreErasedRecords))
+
+            address += len(segment)
+            if address == SEGMENT_LEN:
+                assert (SEGMENT_LEN - (start_addr & 0xFFFF)) % HEX_LINE_LEN == 0, \
+                    "start addr must be aligned on HEX_LINE_LEN else revise!"
+                addr_high += 1
+                address = 0
+
+        if not noEndRecord:
+            hexFile.write(ConstructRecord(0x01, 0x0000, []))
+
+def convertHexToBinary(hexPath, binaryPath, start_addr = None, fill = 0xFF):
+    '''
+    Writes the data records of an Intel Hex file to a binary image starting at
+    start_addr (default: the address of the first data record).  Gaps are 
+    filled with fill, so erased rows left out by convertBinaryToHex come back
+    as 0xFF; trailing erased rows are not restored.  Extended linear (04) and
+    extended segment (02) address records are honoured, start address records
+    (03, 05) ignored, and every record's checksum is verified.
+    '''
+    base = start_addr
+    addr_high = 0
+    end = 0         # length of the binary written so far
+    position = 0    # current position in the binary file
+
+    with open(hexPath, 'rb') as hexFile, open(binaryPath, 'wb') as binaryFile:
+        for lineNum, line in enumerate(hexFile, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line[:1] != b':':
+                raise ValueError("{}:{}: not an Intel Hex record".format(hexPath, lineNum))
+            try:
+                record = bytes.fromhex(line[1:].decode('ascii'))
+            except ValueError:
+                raise ValueError("{}:{}: invalid hex digits".format(hexPath, lineNum))
+            if len(record) < 5 or len(record) != record[0] + 5:
+                raise ValueError("{}:{}: record length does not match its byte count".format(hexPath, lineNum))
+            if sum(record) & 0xFF:
+                raise ValueError("{}:{}: checksum mismatch".format(hexPath, lineNum))
+
+            recordType = record[3]
+            data = record[4:-1]
+            if recordType == 0x00:
+                address = addr_high + ((record[1] << 8) | record[2])
+                if base is None:
+                    base = address
+                offset = address - base
+                if offset < 0:
+                    raise ValueError("{}:{}: address 0x{:08X} is below the base address 0x{:08X}".format(hexPath, lineNum, address, base))
+                if offset > end:
+                    if position != end:
+                        binaryFile.seek(end)
+                    binaryFile.write(bytes([fill]) * (offset - end))
+                elif offset != position:
+                    binaryFile.seek(offset)
+                binaryFile.write(data)
+                position = offset + len(data)
+                end = max(end, position)
+            elif recordType == 0x01:
+                break
+            elif recordType == 0x02:
+                addr_high = int.from_bytes(data, 'big') << 4
+            elif recordType == 0x04:
+                addr_high = int.from_bytes(data, 'big') << 16
+
+def makeBenchmarkImage(rng, size):
+    ''' random data with erased (FF) runs of random length and alignment '''
+    image = bytearray(rng.randbytes(size))
+    offset = 0
+    while offset < size:
+        offset += rng.randrange(1, 8192)
+        runLen = rng.choice([1, 17, 31, 32, 33, 63, 64, 100, 4096, 40000])
+        image[offset : offset + runLen] = b'\xFF' * len(image[offset : offset + runLen])
+        offset += runLen
+    return bytes(image)
+
+def benchmark(binaryPath = None, start_addr = 0, size = 4 << 20, cases = 200):
+    '''
+    Checks convertBinaryToHex against convertBinaryToHexLegacy on random
+    images, and convertHexToBinary against the original, then times both 
+    converters on binaryPath (or a random image of size bytes).
+    @returns True if every output was identical
+    '''
+    rng = random.Random(0)
+    ok = True
+    with tempfile.TemporaryDirectory() as tmpDir:
+        binPath = os.path.join(tmpDir, 'image.bin')
+        legacyPath = os.path.join(tmpDir, 'legacy.hex')
+        hexPath = os.path.join(tmpDir, 'new.hex')
+        backPath = os.path.join(tmpDir, 'back.bin')
+
+        def read(path):
+            with open(path, 'rb') as f:
+                return f.read()
+
+        mismatches = 0
+        for case in range(cases):
+            image = makeBenchmarkImage(rng, rng.randrange(0, 3 * SEGMENT_LEN))
+            with open(binPath, 'wb') as f:
+                f.write(image)
+            base = rng.choice([0, 0x08000000, 0x0800FFE0, 0x1234560]) & ~(HEX_LINE_LEN - 1)
+            noEnd = rng.random() < 0.2
+            ignoreFF = rng.random() < 0.8
+            convertBinaryToHexLegacy(binPath, legacyPath, base, noEnd, ignoreFF)
+            convertBinaryToHex(binPath, hexPath, base, noEnd, ignoreFF)
+            if read(legacyPath) != read(hexPath):
+                mismatches += 1
+                print("case {}: {} bytes at 0x{:08X}: hex output differs !!".format(case, len(image), base))
+                continue
+
+            # the round trip restores everything but trailing erased rows
+            convertHexToBinary(hexPath, backPath, base)
+            back = read(backPath)
+            if back != image[:len(back)] or image[len(back):].strip(b'\xFF'):
+                mismatches += 1
+                print("case {}: {} bytes at 0x{:08X}: hex -> bin round trip differs !!".format(case, len(image), base))
+        print("{} random images: {} mismatches".format(cases, mismatches))
+        ok = mismatches == 0
+
+        if binaryPath is None:
+            with open(binPath, 'wb') as f:
+                f.write(makeBenchmarkImage(rng, size))
+            binaryPath = binPath
+        size = os.path.getsize(binaryPath)
+
+        start = time.perf_counter()
+        convertBinaryToHexLegacy(binaryPath, legacyPath, start_addr)
+        legacySecs = time.perf_counter() - start
+
+        start = time.perf_counter()
+        convertBinaryToHex(binaryPath, hexPath, start_addr)
+        newSecs = time.perf_counter() - start
+
+        start = time.perf_counter()
+        convertHexToBinary(hexPath, backPath, start_addr)
+        reverseSecs = time.perf_counter() - start
+
+        identical = read(legacyPath) == read(hexPath)
+        ok = ok and identical
+        print("{} bytes at 0x{:08X} -> {} bytes of hex".format(size, start_addr, os.path.getsize(hexPath)))
+        print("  legacy bin -> hex   {:8.3f} s".format(legacySecs))
+        print("  bin -> hex          {:8.3f} s  ({:.1f}x, output {})".format(newSecs, legacySecs / newSecs,
+                                                                           "identical" if identical else "DIFFERS"))
+        print("  hex -> bin          {:8.3f} s".format(reverseSecs))
+    return ok
+
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description=sDESC, prog="bin2hexp", epilog=sEPILOG)
-    parser.add_argument("-o", "--hexPath", required=True,
-                                        help="Path to the hex file to be generated")
-    parser.add_argument("-b", "--binaryPath", required=True,
-                                        help="Path to the source binary file")
-    parser.add_argument("-A", "--baseAddress", default = 0,
+    parser.add_argument("-o", "--hexPath",
+                                        help="Path to the hex file to be generated (with -r, the source hex file)")
+    parser.add_argument("-b", "--binaryPath",
+                                        help="Path to the source binary file (with -r, the binary file to be generated)")
+    parser.add_argument("-A", "--baseAddress", default = None,
                         type= lambda arg: int(arg, 16), 
-                        help= 'Base address for the hex file (32-bit)')
+                        help= 'Base address for the hex file (32-bit). With -r, address of the first binary byte; default: first data record')
     parser.add_argument("-n", "--noEndRecord", action='store_true', default=False,
                         help="Do not end the output file with 'end' record. Use for merging several hex files.")
     #Note: type=bool args do not work! so use choice:
     parser.add_argument("-F", "--copyFF", choices=['yes','no'], default='no',
                         help="Copy long sequences of FF bytes to output ('erased flash' areas). default: no")
+    parser.add_argument("-r", "--reverse", action='store_true', default=False,
+                        help="Convert the hex file (-o) back into a binary file (-b), filling gaps with FF")
+    parser.add_argument("--benchmark", action='store_true', default=False,
+                        help="Check the converter against the original on random images, then time both on -b (or a random image)")
+    parser.add_argument("--benchmarkSize", default = 4 << 20, type=int,
+                        help="Size of the random --benchmark image without -b. default: 4 MiB")
     args = parser.parse_args()
 
+    if args.benchmark:
+        sys.exit(0 if benchmark(args.binaryPath, args.baseAddress or 0, args.benchmarkSize) else 1)
+
+    if args.hexPath is None or args.binaryPath is None:
+        parser.error("-o/--hexPath and -b/--binaryPath are required")
+
+    if args.reverse:
+        convertHexToBinary(args.hexPath, args.binaryPath, args.baseAddress)
+        print("Done! Created binary file: {}".format(args.binaryPath))
+        sys.exit(0)
+
+    if args.baseAddress is None:
+        args.baseAddress = 0
+
     if not (0 <= args.baseAddress < 0xFFFFFFFF) :
         print("Base address is longer than 32 bits!")
         sys.exit(1)
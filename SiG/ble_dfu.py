@@ -5,7 +5,11 @@ import usb.core
 import argparse
 import zlib
 import time
+import random
 import datetime
+import hashlib
+import json
+import os
 from time import sleep
 
 # BLE652 / nRF52832 message sequence charts
@@ -191,6 +195,8 @@ BLE_DFU_FW_VER_RESP_PYLD_SZ = BLE_DFU_RESP_RESULT_CODE_FIELD_SZ \
 
 BLE_DFU_OBJ_EXEC_RESP_PYLD_SZ = BLE_DFU_RESP_RESULT_CODE_FIELD_SZ
 
+BLE_DFU_ABORT_RESP_PYLD_SZ = BLE_DFU_RESP_RESULT_CODE_FIELD_SZ
+
 BLE_DFU_GET_MTU_RESP_MSG_PYLD_SZ  = BLE_DFU_RESP_RESULT_CODE_FIELD_SZ + BLE_DFU_MTU_FIELD_SZ
 
 BLE_DFU_GET_CRC_RESP_PYLD_SZ = BLE_DFU_RESP_RESULT_CODE_FIELD_SZ \
@@ -216,6 +222,46 @@ BLE_DFU_POLL_TGT = 0x8d
 # Variables
 BLE_DFU_tgtInitPktValid = False
 BLE_DFU_pktIntvSecs = 0.5
+BLE_DFU_LEGACY_ERASE_WAIT_SECS = 1.0
+BLE_DFU_eraseWaitSecs = BLE_DFU_LEGACY_ERASE_WAIT_SECS
+
+# Adaptive pacing (default, unless --fixed-pacing): the packet interval and the
+# wait for the target to erase each new data object start at the values below
+# (or --intv), and halve after every data object the target confirms (offset 
+# and CRC32 both match).  A failure at pacing that has not yet been proven by a
+# confirmed object, or a repeated failure, doubles one of them (to at least one
+# step) and makes the result a floor, so pacing never returns to a rate that 
+# has failed.  Which one depends on the failure: the erase wait for a failed
+# OBJECT_CREATE or for an object that lost exactly its leading chunks (written
+# while the target was still erasing), and the packet interval for any other
+# loss.  The erase wait backs off no further than the legacy fixed 1s unless
+# erase failures continue there.  A single failure at proven pacing is taken 
+# as a random loss and just retried.
+BLE_DFU_adaptivePacing = True
+BLE_DFU_pacingProven = False
+BLE_DFU_ADAPTIVE_PKT_INTV_SECS = 0.02
+BLE_DFU_minPktIntvSecs = 0
+BLE_DFU_minEraseWaitSecs = 0
+BLE_DFU_PKT_INTV_STEP_SECS = 0.005
+BLE_DFU_ERASE_WAIT_STEP_SECS = 0.05
+BLE_DFU_MAX_PKT_INTV_SECS = 5
+BLE_DFU_MAX_ERASE_WAIT_SECS = 5
+BLE_DFU_MAX_POLL_INTV_SECS = 0.3
+
+# CRC32 of the app fw image prefix ending at each offset computed so far, so 
+# each check only has to extend a previous value over the newest data object
+BLE_DFU_crc32ByOffset = { 0: 0 }
+BLE_DFU_dataObjBytesTxd = 0
+BLE_DFU_eraseFailure = False
+
+# Transfer journal (--journal, unless --no-journal): identifies the image being
+# uploaded (SHA-256 of the init packet and app fw image) and records the offset,
+# size and image CRC32 of every data object the target has executed, rewritten
+# after each one.  If the script or host dies mid-upgrade, the next run checks
+# the target's progress against it and continues from the first data object 
+# that is not confirmed by both.  Removed once the upgrade completes or is 
+# aborted.
+BLE_DFU_journal = None
 
 # Local error codes
 BLE_DFU_RC_FAILURE = 0
@@ -295,6 +341,51 @@ def __calcCRC32(inBuff):
        print("Calc CRC32 is 0x{:08x}".format(crc32))
     return crc32 
 
+def __calcImageCRC32(imageBuff, offset):
+    # CRC32 of imageBuff[0:offset], continuing zlib.crc32's running value from
+    # the nearest offset at or below this one
+    base = max(o for o in BLE_DFU_crc32ByOffset if o <= offset)
+    crc32 = zlib.crc32(imageBuff[base:offset], BLE_DFU_crc32ByOffset[base])
+    BLE_DFU_crc32ByOffset[offset] = crc32
+    if args.debug:
+       print("Calc CRC32 over {} bytes (from {}) is 0x{:08x}".format(offset, base, crc32))
+    return crc32
+
+def __halveIntv(secs):
+    secs /= 2
+    return secs if secs >= 0.001 else 0
+
+def ble_dfu_paceAfterSuccess():
+    global BLE_DFU_pktIntvSecs, BLE_DFU_eraseWaitSecs, BLE_DFU_pacingProven
+    if not BLE_DFU_adaptivePacing:
+       return
+    pacing = (BLE_DFU_pktIntvSecs, BLE_DFU_eraseWaitSecs)
+    BLE_DFU_pktIntvSecs = max(BLE_DFU_minPktIntvSecs, __halveIntv(BLE_DFU_pktIntvSecs))
+    BLE_DFU_eraseWaitSecs = max(BLE_DFU_minEraseWaitSecs, __halveIntv(BLE_DFU_eraseWaitSecs))
+    BLE_DFU_pacingProven = pacing == (BLE_DFU_pktIntvSecs, BLE_DFU_eraseWaitSecs)
+    if args.debug:
+       print("Pacing: pkt interval {:.4f} s, erase wait {:.4f} s".format(BLE_DFU_pktIntvSecs, BLE_DFU_eraseWaitSecs))
+
+def ble_dfu_paceAfterFailure(tryCnt, eraseFailure):
+    global BLE_DFU_pktIntvSecs, BLE_DFU_eraseWaitSecs, BLE_DFU_minPktIntvSecs, BLE_DFU_minEraseWaitSecs, BLE_DFU_pacingProven
+    if not BLE_DFU_adaptivePacing:
+       return
+    if BLE_DFU_pacingProven and tryCnt < 2:
+       print("Failure at proven pacing, retrying without backing off")
+       return
+    if eraseFailure:
+       # past the legacy wait only if erase failures continue there
+       maxEraseWaitSecs = BLE_DFU_LEGACY_ERASE_WAIT_SECS
+       if BLE_DFU_eraseWaitSecs >= BLE_DFU_LEGACY_ERASE_WAIT_SECS:
+          maxEraseWaitSecs = BLE_DFU_MAX_ERASE_WAIT_SECS
+       BLE_DFU_eraseWaitSecs = min(maxEraseWaitSecs, max(2 * BLE_DFU_eraseWaitSecs, BLE_DFU_ERASE_WAIT_STEP_SECS))
+       BLE_DFU_minEraseWaitSecs = BLE_DFU_eraseWaitSecs
+    else:
+       BLE_DFU_pktIntvSecs = min(BLE_DFU_MAX_PKT_INTV_SECS, max(2 * BLE_DFU_pktIntvSecs, BLE_DFU_PKT_INTV_STEP_SECS))
+       BLE_DFU_minPktIntvSecs = BLE_DFU_pktIntvSecs
+    BLE_DFU_pacingProven = False
+    print("Backing off: pkt interval {:.4f} s, erase wait {:.4f} s".format(BLE_DFU_pktIntvSecs, BLE_DFU_eraseWaitSecs))
+
 def ble_dfu_send_msg(txMsgBuff):
     if args.debug:
        print("Txing ble dfu msg of len {} ".format(len(txMsgBuff)))
@@ -311,7 +402,7 @@ def ble_dfu_get_tgt_msg():
     msg = raw[1:].tolist()
     return msg
 
-def SLIP_decodeMsg(inBuff):
+def SLIP_legacyDecodeMsg(inBuff):
     decState = SLIP_RX_STATE_DECODING
     outBuff = []
 
@@ -347,7 +438,7 @@ def SLIP_decodeMsg(inBuff):
        print("Encoded Buff sz {}, decoded buff sz {}".format(len(inBuff), len(outBuff)))
     return outBuff
 
-def SLIP_encodeCtrlMsg(inBuff):
+def SLIP_legacyEncodeCtrlMsg(inBuff):
     error = False
 
     if args.debug:
@@ -397,7 +488,7 @@ def SLIP_encodeCtrlMsg(inBuff):
 
     return outBuff
 
-def SLIP_encodeChunk(msgType, inBuff, maxEncSz):
+def SLIP_legacyEncodeChunk(msgType, inBuff, maxEncSz):
     outBuff = [msgType]
     inOffset = 0
     spaceLeft = maxEncSz - 1 - 1  # for the message type byte and the terminating byte
@@ -454,6 +545,184 @@ def SLIP_encodeChunk(msgType, inBuff, maxEncSz):
 
     return outBuff, inOffset
 
+# Bulk SLIP codec.  Byte-for-byte equivalent to the SLIP_legacy*() functions 
+# above (see --slip-test), but escapes and unescapes whole buffers with 
+# bytes.replace() instead of appending one byte at a time.
+
+SLIP_BYTES_END = bytes([SLIP_BYTE_END])
+SLIP_BYTES_ESC = bytes([SLIP_BYTE_ESC])
+SLIP_BYTES_ESC_END = bytes([SLIP_BYTE_ESC, SLIP_BYTE_ESC_END])
+SLIP_BYTES_ESC_ESC = bytes([SLIP_BYTE_ESC, SLIP_BYTE_ESC_ESC])
+
+# the nrf_fstorage_write() "multiple of 4" hack in SLIP_legacyEncodeChunk
+SLIP_MAX_CHUNK_BYTES = 48
+
+def SLIP_escape(inBuff):
+    # ESC first, since escaping END introduces ESC bytes
+    return bytes(inBuff).replace(SLIP_BYTES_ESC, SLIP_BYTES_ESC_ESC).replace(SLIP_BYTES_END, SLIP_BYTES_ESC_END)
+
+def SLIP_decodeMsg(inBuff):
+    inBuff = bytes(inBuff)
+    end = inBuff.find(SLIP_BYTE_END)
+    if end >= 0:
+       if args.debug:
+          print("SLIP_dec(): fnd EOP :-)")
+       encBuff = inBuff[:end]
+    elif inBuff.endswith(SLIP_BYTES_ESC):
+       # unterminated, and cut off mid-escape: keep what was decoded so far
+       encBuff = inBuff[:-1]
+    else:
+       encBuff = inBuff
+
+    escCnt = encBuff.count(SLIP_BYTE_ESC)
+    if escCnt == 0:
+       outBuff = list(encBuff)
+    elif escCnt != encBuff.count(SLIP_BYTES_ESC_END) + encBuff.count(SLIP_BYTES_ESC_ESC):
+       # some ESC is not followed by ESC_END or ESC_ESC
+       print("SLIP_dec(): proto violation fnd !!")
+       outBuff = []
+    else:
+       outBuff = list(encBuff.replace(SLIP_BYTES_ESC_END, SLIP_BYTES_END).replace(SLIP_BYTES_ESC_ESC, SLIP_BYTES_ESC))
+
+    if args.debug:
+       print("Encoded Buff sz {}, decoded buff sz {}".format(len(inBuff), len(outBuff)))
+    return outBuff
+
+def SLIP_encodeCtrlMsg(inBuff):
+    if args.debug:
+       __dump(inBuff)
+
+    encBuff = SLIP_escape(inBuff)
+    if len(encBuff) > BLE_DFU_MAX_SLIP_PDU_LEN:
+       print("SLIP_eCM(): No space left ... !!")
+       sys.exit()
+
+    # First byte is msg length (used by STM32)
+    outBuff = bytes([len(encBuff) + 1]) + encBuff + SLIP_BYTES_END
+
+    if args.debug:
+      __dump(outBuff)
+
+    return outBuff
+
+def SLIP_encodeChunk(msgType, inBuff, maxEncSz, inOffset=0):
+    # @returns the encoded chunk of inBuff starting at inOffset, and the number
+    #          of input bytes it holds
+    inBuff = bytes(inBuff)
+    spaceLeft = maxEncSz - 1 - 1  # for the message type byte and the terminating byte
+
+    inLen = min(SLIP_MAX_CHUNK_BYTES, len(inBuff) - inOffset, max(0, spaceLeft))
+    chunk = inBuff[inOffset : inOffset + inLen]
+    escCnt = chunk.count(SLIP_BYTE_END) + chunk.count(SLIP_BYTE_ESC)
+    while inLen + escCnt > spaceLeft:
+       # escapes don't all fit: drop trailing bytes until they do
+       inLen -= 1
+       if chunk[inLen] in (SLIP_BYTE_END, SLIP_BYTE_ESC):
+          escCnt -= 1
+       chunk = chunk[:inLen]
+
+    return bytes([msgType]) + SLIP_escape(chunk) + SLIP_BYTES_END, inLen
+
+def SLIP_encodeObject(msgType, objBuff, maxEncSz):
+    # @returns [ (encoded chunk, input bytes it holds), ... ] covering all of objBuff
+    objBuff = bytes(objBuff)
+    chunks = []
+    totBytesCons = 0
+    while totBytesCons < len(objBuff):
+       encTxBuff, bytesCons = SLIP_encodeChunk(msgType, objBuff, maxEncSz, totBytesCons)
+       if bytesCons == 0:
+          print("SLIP_eO(): max enc sz {} too small !!".format(maxEncSz))
+          break
+       chunks.append((encTxBuff, bytesCons))
+       totBytesCons += bytesCons
+    return chunks
+
+def SLIP_legacyEncodeObject(msgType, objBuff, maxEncSz):
+    chunks = []
+    totBytesCons = 0
+    while totBytesCons < len(objBuff):
+       encTxBuff, bytesCons = SLIP_legacyEncodeChunk(msgType, objBuff[totBytesCons:], maxEncSz)
+       chunks.append((encTxBuff, bytesCons))
+       totBytesCons += bytesCons
+    return chunks
+
+def SLIP_randomBuff(rng, size):
+    # random bytes, with END and ESC at a random density (up to all of them)
+    density = rng.random()
+    return bytes(rng.choice((SLIP_BYTE_END, SLIP_BYTE_ESC)) if rng.random() < density else rng.randrange(256) for i in range(size))
+
+def SLIP_selfTest(iterations=2000, seed=0):
+    # randomized equivalence of the bulk and legacy codecs, plus round-trips
+    rng = random.Random(seed)
+    failures = 0
+
+    def check(name, legacy, bulk, detail):
+       nonlocal failures
+       if legacy != bulk:
+          failures += 1
+          if failures <= 10:
+             print("SLIP self-test: {} mismatch for {}: legacy {}, bulk {}".format(name, detail, legacy, bulk))
+
+    for i in range(iterations):
+       # control messages, including ones too long to fit in a PDU
+       buff = SLIP_randomBuff(rng, rng.randrange(0, 70))
+       legacyMsg = bulkMsg = None
+       try:
+          legacyMsg = bytes(SLIP_legacyEncodeCtrlMsg(list(buff)))
+       except SystemExit:
+          pass
+       try:
+          bulkMsg = SLIP_encodeCtrlMsg(list(buff))
+       except SystemExit:
+          pass
+       check("SLIP_encodeCtrlMsg", legacyMsg, bulkMsg, buff.hex())
+       if bulkMsg is not None:
+          check("ctrl msg round-trip", list(buff), SLIP_decodeMsg(bulkMsg[1:]), buff.hex())
+
+       # data objects, chunked at a range of PDU sizes
+       buff = SLIP_randomBuff(rng, rng.randrange(1, 600))
+       maxEncSz = rng.choice((BLE_DFU_MAX_SLIP_PDU_LEN, rng.randrange(4, 128)))
+       legacyChunks = [ (bytes(enc), cnt) for enc, cnt in SLIP_legacyEncodeObject(BLE_DFU_OP_OBJECT_WRITE, list(buff), maxEncSz) ]
+       bulkChunks = SLIP_encodeObject(BLE_DFU_OP_OBJECT_WRITE, buff, maxEncSz)
+       check("SLIP_encodeObject", legacyChunks, bulkChunks, "{} (max enc sz {})".format(buff.hex(), maxEncSz))
+       decoded = b"".join(bytes(SLIP_decodeMsg(enc[1:])) for enc, cnt in bulkChunks)
+       check("data object round-trip", buff, decoded, buff.hex())
+
+       # arbitrary (mostly invalid) encoded streams
+       buff = SLIP_randomBuff(rng, rng.randrange(0, 70))
+       check("SLIP_decodeMsg", SLIP_legacyDecodeMsg(list(buff)), SLIP_decodeMsg(buff), buff.hex())
+
+    print("SLIP self-test: {} iterations, {} mismatches".format(iterations, failures))
+    return failures == 0
+
+def SLIP_benchmark(imageBuff, maxDataObjSz=4096):
+    # legacy vs bulk encode of a full image into write PDUs, then decode of every PDU
+    results = []
+    for name, encodeObject, decodeMsg in [ ("legacy", SLIP_legacyEncodeObject, SLIP_legacyDecodeMsg),
+                                           ("bulk", SLIP_encodeObject, SLIP_decodeMsg) ]:
+       objBuffs = [ imageBuff[off : off + maxDataObjSz] for off in range(0, len(imageBuff), maxDataObjSz) ]
+       if name == "legacy":
+          objBuffs = [ list(objBuff) for objBuff in objBuffs ]
+
+       start = time.perf_counter()
+       chunks = [ chunk for objBuff in objBuffs for chunk in encodeObject(BLE_DFU_OP_OBJECT_WRITE, objBuff, BLE_DFU_MAX_SLIP_PDU_LEN) ]
+       encSecs = time.perf_counter() - start
+
+       start = time.perf_counter()
+       decoded = [ decodeMsg(enc[1:]) for enc, cnt in chunks ]
+       decSecs = time.perf_counter() - start
+
+       encoded = b"".join(bytes(enc) for enc, cnt in chunks)
+       roundTrip = b"".join(bytes(dec) for dec in decoded) == bytes(imageBuff)
+       results.append((name, encSecs, decSecs, len(chunks), encoded, roundTrip))
+
+    print("SLIP benchmark over {} byte image ({} byte data objects, {} byte PDUs):".format(len(imageBuff), maxDataObjSz, BLE_DFU_MAX_SLIP_PDU_LEN))
+    for name, encSecs, decSecs, chunkCnt, encoded, roundTrip in results:
+       print("  {:6s} encode {:8.1f} ms ({:7.2f} MB/s), decode {:8.1f} ms ({:7.2f} MB/s), {} PDUs, round-trip {}".format(
+             name, encSecs * 1000, len(imageBuff) / encSecs / 1e6, decSecs * 1000, len(imageBuff) / decSecs / 1e6, chunkCnt, roundTrip))
+    print("  bulk encode output identical to legacy: {}, speedup encode {:.1f}x, decode {:.1f}x".format(
+          results[0][4] == results[1][4], results[0][1] / results[1][1], results[0][2] / results[1][2]))
+
 def BLE_DFU_checkRespForError(respLen, respMsg):
     rc = BLE_DFU_RC_RCVD_MSG_TOO_SHORT
     if respLen >= BLE_DFU_RESP_RESULT_CODE_FIELD_SZ:
@@ -550,6 +819,21 @@ def ble_dfu_parse_resp(respMsg):
              print("Response length < {}!!".format(BLE_DFU_OBJ_CREATE_RESP_PYLD_LEN_SZ))
              retList[0] = BLE_DFU_RC_RCVD_MSG_TOO_SHORT
 
+
+       if origReqType == BLE_DFU_OP_ABORT:
+          print("Rcvd response to ABORT request")
+          if respLen >= BLE_DFU_ABORT_RESP_PYLD_SZ:
+             rc = respMsg[1] 
+             print("Result Code 0x{:02x}".format(rc))
+             if rc == BLE_DFU_RES_CODE_SUCCESS:
+                retList[0] = BLE_DFU_RC_SUCCESS
+             else:
+                print("Response indicates error !! ")
+                retList[0] = BLE_DFU_RC_TGT_RESP_ERROR_BASE + rc
+          else:
+             print("Response length < {}!!".format(BLE_DFU_ABORT_RESP_PYLD_SZ))
+             retList[0] = BLE_DFU_RC_RCVD_MSG_TOO_SHORT
+
            
        if origReqType == BLE_DFU_OP_OBJECT_SELECT:
           print("Rcvd response to OBJ SEL request")
@@ -603,12 +887,15 @@ def ble_dfu_parse_tgt_msg(msg):
 
 def ble_dfu_get_resp():
   retList = []
+  # with adaptive pacing, poll quickly at first and back off while waiting
+  pollIntvSecs = 0.002 if BLE_DFU_adaptivePacing else BLE_DFU_MAX_POLL_INTV_SECS
   while (1):
     msg = ble_dfu_get_tgt_msg()
     if len(msg) == 0:
        if args.debug:
           print("No msg from tgt... ")
-       sleep(0.3)
+       sleep(pollIntvSecs)
+       pollIntvSecs = min(BLE_DFU_MAX_POLL_INTV_SECS, pollIntvSecs * 2)
     else:
        print("Rcvd msg of len {} from target ".format(len(msg)))
        if args.debug:
@@ -732,7 +1019,152 @@ def ble_dfu_displayAppFwInfo():
                                                                                  tgtAppFwCRC32))
     return rc
 
+def ble_dfu_loadJournal():
+    try:
+       with open(args.journal) as journalFileObj:
+          return json.load(journalFileObj)
+    except FileNotFoundError:
+       return None
+    except (OSError, ValueError) as exc:
+       print("Ignoring unreadable DFU journal {}: {}".format(args.journal, exc))
+       return None
+
+def ble_dfu_saveJournal():
+    if BLE_DFU_journal is None:
+       return
+    BLE_DFU_journal["updated"] = datetime.datetime.now().isoformat(timespec="seconds")
+    # write-then-rename, so a crash never leaves a half-written journal behind
+    tmpFileName = args.journal + ".tmp"
+    with open(tmpFileName, "w") as journalFileObj:
+       json.dump(BLE_DFU_journal, journalFileObj, indent=2)
+    os.replace(tmpFileName, args.journal)
+
+def ble_dfu_clearJournal(reason):
+    global BLE_DFU_journal
+    BLE_DFU_journal = None
+    if not args.no_journal and os.path.exists(args.journal):
+       os.remove(args.journal)
+       print("Removed DFU journal {} ({})".format(args.journal, reason))
+
+def ble_dfu_journalCommittedBytes(journal):
+    objects = journal["objects"]
+    return objects[-1][0] + objects[-1][1] if objects else 0
+
+def ble_dfu_startJournal(initBuff, imageBuff, version):
+    """ load the journal if it is for this image, else start a new one """
+    global BLE_DFU_journal
+    if args.no_journal:
+       return
+
+    imageHash = hashlib.sha256(bytes(initBuff) + bytes(imageBuff)).hexdigest()
+    journal = ble_dfu_loadJournal()
+    if journal is not None and journal.get("image_sha256") == imageHash:
+       print("DFU journal {}: {} data objects ({} of {} bytes) committed as of {}".format(
+             args.journal, len(journal["objects"]), ble_dfu_journalCommittedBytes(journal),
+             len(imageBuff), journal.get("updated")))
+    else:
+       if journal is not None:
+          print("DFU journal {} is for another image (version {}), starting a new one".format(
+                args.journal, journal.get("version")))
+       journal = { "version": version,
+                   "image_sha256": imageHash,
+                   "init_size": len(initBuff),
+                   "init_crc32": __calcCRC32(bytes(initBuff)),
+                   "image_size": len(imageBuff),
+                   "objects": [] }
+    BLE_DFU_journal = journal
+    ble_dfu_saveJournal()
+
+def ble_dfu_journalCommit(offset, size, crc32):
+    """ record a data object the target has executed (replacing any recorded at or after offset) """
+    if BLE_DFU_journal is None:
+       return
+    objects = [obj for obj in BLE_DFU_journal["objects"] if obj[0] < offset]
+    objects.append([offset, size, crc32])
+    BLE_DFU_journal["objects"] = objects
+    ble_dfu_saveJournal()
+
+def ble_dfu_journalTruncate(offset):
+    """ forget data objects at or after offset, which the target no longer holds """
+    if BLE_DFU_journal is None:
+       return
+    BLE_DFU_journal["objects"] = [obj for obj in BLE_DFU_journal["objects"] if obj[0] + obj[1] <= offset]
+    ble_dfu_saveJournal()
+
+def ble_dfu_checkResume(imageBuff):
+    """ 
+    Compare the target's data object progress with the image and the journal.
+
+    @returns the offset the upload will continue from, or None if the data the
+             target holds is not a prefix of this image (so the upload has to be 
+             restarted with a new init packet)
+    """
+    respList = ble_dfu_getAppFwInfo()
+    rc = respList[0]
+    if rc != BLE_DFU_RC_SUCCESS:
+       BLE_DFU_dispTgtErrorCode(rc)
+       print("Could not get app fw offset and/or CRC32 from target !!! ")
+       return None
+
+    tgtAppMaxObjSz = respList[1]
+    tgtAppFwOffset = respList[2]
+    tgtAppFwCRC32 = respList[3]
+
+    imageBuff = bytes(imageBuff)
+    if tgtAppFwOffset > len(imageBuff):
+       print("Target holds {} bytes of app fw, more than the {} byte image !!".format(tgtAppFwOffset, len(imageBuff)))
+       return None
+
+    calcdCRC32 = __calcImageCRC32(imageBuff, tgtAppFwOffset)
+    if calcdCRC32 != tgtAppFwCRC32:
+       print("Target's CRC32 over its {} bytes of app fw is 0x{:08x}, image's is 0x{:08x} !!".format(
+             tgtAppFwOffset, tgtAppFwCRC32, calcdCRC32))
+       return None
+
+    # a partially received data object is re-sent from its start
+    resumeOffset = tgtAppFwOffset
+    if resumeOffset < len(imageBuff):
+       resumeOffset -= resumeOffset % tgtAppMaxObjSz
+
+    if BLE_DFU_journal is not None:
+       committedBytes = ble_dfu_journalCommittedBytes(BLE_DFU_journal)
+       if resumeOffset < committedBytes:
+          print("Target no longer holds the data objects the journal recorded after offset {}".format(resumeOffset))
+          ble_dfu_journalTruncate(resumeOffset)
+       for offset in range(committedBytes, resumeOffset, tgtAppMaxObjSz):
+          # executed by the target, but the journal was not updated before we stopped
+          size = min(tgtAppMaxObjSz, resumeOffset - offset)
+          ble_dfu_journalCommit(offset, size, __calcImageCRC32(imageBuff, offset + size))
+
+    if resumeOffset > 0:
+       print("Target has confirmed {} of {} app fw bytes, resuming at offset {}".format(
+             resumeOffset, len(imageBuff), resumeOffset))
+    return resumeOffset
+
+def ble_dfu_displayJournal(tgtAppFwOffset, tgtAppFwCRC32):
+    journal = ble_dfu_loadJournal()
+    if journal is None:
+       print("No DFU journal at {}".format(args.journal))
+       return
+
+    committedBytes = ble_dfu_journalCommittedBytes(journal)
+    print("DFU journal {}: version {}, {} data objects ({} of {} bytes) committed as of {}".format(
+          args.journal, journal.get("version"), len(journal["objects"]), committedBytes,
+          journal.get("image_size"), journal.get("updated")))
+    if tgtAppFwOffset is None:
+       return
+
+    journalCRC32 = journal["objects"][-1][2] if journal["objects"] else 0
+    if tgtAppFwOffset == committedBytes and tgtAppFwCRC32 == journalCRC32:
+       print("Target matches the journal: upgrading to {} again will resume at offset {}".format(
+             journal.get("version"), committedBytes))
+    elif tgtAppFwOffset < committedBytes:
+       print("Target holds fewer bytes ({}) than the journal records; the upgrade will check and resend them".format(tgtAppFwOffset))
+    else:
+       print("Target holds {} bytes, beyond the journal; the upgrade will check them against the image".format(tgtAppFwOffset))
+
 def ble_dfu_sendNextAppFwDataObject(imageBuff, imageOffset, maxDataObjSz):
+    global BLE_DFU_dataObjBytesTxd, BLE_DFU_eraseFailure
 
     if args.debug:
        print("\n\n")
@@ -753,14 +1185,17 @@ def ble_dfu_sendNextAppFwDataObject(imageBuff, imageOffset, maxDataObjSz):
     currDataObjSz = lenLeftToSend
     if currDataObjSz >= maxDataObjSz:
        currDataObjSz = maxDataObjSz
+    BLE_DFU_eraseFailure = False
     rc = ble_dfu_sendCreateObjMsg(BLE_DFU_OBJ_TYPE_DATA, currDataObjSz)
     if rc != BLE_DFU_RC_SUCCESS:
        BLE_DFU_dispTgtErrorCode(rc)
+       BLE_DFU_eraseFailure = True
        return rc, 0
 
-    if args.debug:
-       print("sleeping for 1 sec for erase to happen ....")
-    sleep(1)
+    if BLE_DFU_eraseWaitSecs > 0:
+       if args.debug:
+          print("sleeping for {} sec for erase to happen ....".format(BLE_DFU_eraseWaitSecs))
+       sleep(BLE_DFU_eraseWaitSecs)
 
     if args.debug:
        print("Sending data obj of sz {} bytes at off {}".format(currDataObjSz,
@@ -768,25 +1203,21 @@ def ble_dfu_sendNextAppFwDataObject(imageBuff, imageOffset, maxDataObjSz):
     chunkSize = BLE_DFU_MAX_SLIP_PDU_LEN
     chunkTxCnt = 0
     totBytesCons = 0
+    chunkEndOffsets = set()
 
     currDataObjImageDataBuff = imageBuff[imageOffset : imageOffset + currDataObjSz]
 
-    while True:
-
-       if totBytesCons >= currDataObjSz:
-          break
-
-       encTxBuff, bytesCons = SLIP_encodeChunk(BLE_DFU_OP_OBJECT_WRITE,
-                                               currDataObjImageDataBuff[totBytesCons:],
-                                               BLE_DFU_MAX_SLIP_PDU_LEN)
+    for encTxBuff, bytesCons in SLIP_encodeObject(BLE_DFU_OP_OBJECT_WRITE,
+                                                  currDataObjImageDataBuff,
+                                                  BLE_DFU_MAX_SLIP_PDU_LEN):
        chunkTxCnt += 1
        totBytesCons += bytesCons
+       chunkEndOffsets.add(totBytesCons)
        if args.debug:
           print("Data Obj Chunk # {}, Out Buff len {}, tot bytes consumed {}".format(chunkTxCnt, len(encTxBuff), totBytesCons))
        # __dump(encTxBuff)
 
-       txMsgBuff = [len(encTxBuff)]
-       txMsgBuff += encTxBuff
+       txMsgBuff = bytes([len(encTxBuff)]) + encTxBuff
 
        ble_dfu_send_msg(txMsgBuff)
       
@@ -797,13 +1228,15 @@ def ble_dfu_sendNextAppFwDataObject(imageBuff, imageOffset, maxDataObjSz):
        else:
            print("Sent Image Chunk # {:02}, image off {:06}".format(chunkTxCnt, imageOffset + totBytesCons))
 
-       if args.debug:
-          print("sleeping for {} sec .... ".format(BLE_DFU_pktIntvSecs))
-       sleep(BLE_DFU_pktIntvSecs)
+       if BLE_DFU_pktIntvSecs > 0:
+          if args.debug:
+             print("sleeping for {} sec .... ".format(BLE_DFU_pktIntvSecs))
+          sleep(BLE_DFU_pktIntvSecs)
        if args.debug:
           print("--------------------------------------------------------------------------")
 
     print("All chunks in the current data obj sent ... ")
+    BLE_DFU_dataObjBytesTxd += currDataObjSz
 
     # Get CRC32
     print("Getting CRC32 from target .... ")
@@ -827,13 +1260,21 @@ def ble_dfu_sendNextAppFwDataObject(imageBuff, imageOffset, maxDataObjSz):
     print("Offset rcvd {}, expected {}".format(tgtDataObjOffset,
                                                (imageOffset + currDataObjSz)))
 
-    currDataObjCRC32 = __calcCRC32(bytes(imageBuff[0: tgtDataObjOffset]))
+    currDataObjCRC32 = __calcImageCRC32(imageBuff, tgtDataObjOffset)
     print("CRC32 calcd over {} bytes is 0x{:08x}".format(tgtDataObjOffset, currDataObjCRC32))
     print("CRC32 rcvd 0x{:08x}, calcd 0x{:08x}".format(tgtDataObjCRC32, 
                                                        currDataObjCRC32))
 
     if tgtDataObjOffset != (imageOffset + currDataObjSz): 
        print("Target has not received the current data object fully !! ")
+       # the target appends whatever arrives, so if it holds everything but the
+       # leading chunks, they were written while it was still erasing
+       lostLen = imageOffset + currDataObjSz - tgtDataObjOffset
+       if lostLen in chunkEndOffsets:
+          erasedCRC32 = zlib.crc32(currDataObjImageDataBuff[lostLen:], __calcImageCRC32(imageBuff, imageOffset))
+          if erasedCRC32 == tgtDataObjCRC32:
+             print("Target lost the first {} bytes, during flash erase".format(lostLen))
+             BLE_DFU_eraseFailure = True
        return BLE_DFU_RC_DATA_OBJ_TRANSFER_ERROR, 0
     else:
        print("Target has received the sent data object fully :-) ")
@@ -848,6 +1289,7 @@ def ble_dfu_sendNextAppFwDataObject(imageBuff, imageOffset, maxDataObjSz):
        return rc, 0
 
     print("Data Object written to flash by target :- )")
+    ble_dfu_journalCommit(imageOffset, currDataObjSz, currDataObjCRC32)
 
     return BLE_DFU_RC_SUCCESS, currDataObjSz
 
@@ -870,6 +1312,10 @@ def ble_dfu_sendAppFwToTgt(fwImageBuff):
        print("SAFTT(): app fw sz {}".format(len(fwImageBuff)))
     rc = BLE_DFU_RC_SUCCESS
 
+    fwImageBuff = bytes(fwImageBuff)
+    startTime = time.perf_counter()
+    startOffset = None
+
     dataObjTxCnt = 0
 
     tryCnt = 0
@@ -891,6 +1337,8 @@ def ble_dfu_sendAppFwToTgt(fwImageBuff):
        print("App FW info from target: max Sz {}, off {}, crc32 0x{:02x}".format(tgtAppMaxObjSz,
                                                                                  tgtAppFwOffset,
                                                                                  tgtAppFwCRC32))
+       if startOffset is None:
+          startOffset = tgtAppFwOffset - (tgtAppFwOffset % tgtAppMaxObjSz)
 
        if tgtAppFwOffset == len(fwImageBuff):
           print("Full app firmware image transferred ... :-) ")
@@ -905,6 +1353,7 @@ def ble_dfu_sendAppFwToTgt(fwImageBuff):
        rc, currObjBytesTxd = ble_dfu_sendNextAppFwDataObject(fwImageBuff, tgtAppFwOffset, tgtAppMaxObjSz)
        if rc != BLE_DFU_RC_SUCCESS:
           tryCnt += 1
+          ble_dfu_paceAfterFailure(tryCnt, BLE_DFU_eraseFailure)
           print("Failed to transfer data object ... tries so far {} / max {} !!".format(tryCnt, BLE_DFU_MAX_TRY_CNT))
           if tryCnt >= BLE_DFU_MAX_TRY_CNT:
              print("Giving up !!")
@@ -913,6 +1362,7 @@ def ble_dfu_sendAppFwToTgt(fwImageBuff):
              print("Retrying !!")
              continue
        else:
+          ble_dfu_paceAfterSuccess()
           tryCnt = 0
 
        if args.debug:
@@ -924,15 +1374,22 @@ def ble_dfu_sendAppFwToTgt(fwImageBuff):
            rc = BLE_DFU_RC_SUCCESS
            break
 
-       if args.debug:
-          print("Sleep for 0.5 secs before sending next data obj ...")
-       sleep(0.5)
+       if not BLE_DFU_adaptivePacing:
+          if args.debug:
+             print("Sleep for 0.5 secs before sending next data obj ...")
+          sleep(0.5)
 
        dataObjTxCnt += 1
        # if dataObjTxCnt >= 5:
        #    rc = BLE_DFU_RC_PARTIAL_SUCCESS 
        #    break
 
+    elapsedSecs = time.perf_counter() - startTime
+    if startOffset is not None and elapsedSecs > 0:
+       sentLen = len(fwImageBuff) - startOffset
+       print("App fw upload took {:.1f} s: {} image bytes at {:.0f} bytes/sec effective ({} bytes sent incl. retries, pkt interval now {:.4f} s)".format(
+             elapsedSecs, sentLen, sentLen / elapsedSecs, BLE_DFU_dataObjBytesTxd, BLE_DFU_pktIntvSecs))
+
     return rc
 
 def BLE_DFU_sendInitPktToTgt(initPktDataBuff, mtu):
@@ -967,17 +1424,15 @@ def BLE_DFU_sendInitPktToTgt(initPktDataBuff, mtu):
 
     chunkTxCnt = 0
     totBytesCons = 0
-    while [ 1 ]:
-       encTxBuff, bytesCons = SLIP_encodeChunk(BLE_DFU_OP_OBJECT_WRITE,
-                                               BLE_DFU_initPacketData[totBytesCons:], 
-                                               BLE_DFU_MAX_SLIP_PDU_LEN)
+    for encTxBuff, bytesCons in SLIP_encodeObject(BLE_DFU_OP_OBJECT_WRITE,
+                                                  BLE_DFU_initPacketData,
+                                                  BLE_DFU_MAX_SLIP_PDU_LEN):
        chunkTxCnt += 1
        totBytesCons += bytesCons
        print("Init File Chunk # {}, Out Buff len {}, tot bytes consumed {}".format(chunkTxCnt, len(encTxBuff), totBytesCons))
        __dump(encTxBuff)
 
-       txMsgBuff = [len(encTxBuff)]
-       txMsgBuff += encTxBuff
+       txMsgBuff = bytes([len(encTxBuff)]) + encTxBuff
 
        ble_dfu_send_msg(txMsgBuff)
 
@@ -1057,16 +1512,58 @@ parser.add_argument("--ver",          action="store_true", help="Show current ap
 parser.add_argument("--abort",        action="store_true", help="Abort DFU process")
 parser.add_argument("--status",       action="store_true", help="Get status from the target")
 parser.add_argument("--crc",          action="store_true", help=".dat and .bin CRC32")
-parser.add_argument("--intv",         type=int, help="Pkt interval (>0 and <= 5000) in milliseconds")
+parser.add_argument("--intv",         type=int, help="Pkt interval (>0 and <= 5000) in milliseconds (starting interval unless --fixed-pacing)")
+parser.add_argument("--fixed-pacing", action="store_true", help="Always wait --intv (default 500ms) between pkts, 1s for erase and 0.5s between data objects")
+parser.add_argument("--simulate",     action="store_true", help="Use a simulated SiG / DFU target (see SimulatedDFUTarget.py) and, without --upg, a random image")
+parser.add_argument("--sim-image-size", type=int, default=65536, help="With --simulate and no --upg, random app fw image size in bytes")
+parser.add_argument("--sim-chunk-ms", type=float, default=5.0, help="With --simulate, time for each msg to cross the STM32-BLE link")
+parser.add_argument("--sim-queue-depth", type=int, default=4, help="With --simulate, pkts the STM32 can queue before dropping")
+parser.add_argument("--sim-erase-ms", type=float, default=90.0, help="With --simulate, flash erase time per data object")
+parser.add_argument("--sim-drop-rate", type=float, default=0, help="With --simulate, fraction of pkts lost at random")
+parser.add_argument("--sim-seed",     type=int, help="With --simulate, random seed")
+parser.add_argument("--sim-state",    type=str, help="With --simulate, file the simulated target keeps its init packet and data objects in across runs")
+parser.add_argument("--sim-disconnect-after", type=int, help="With --simulate, simulate a USB disconnect after this many data objects")
+parser.add_argument("--journal",      type=str, default="ble_dfu_journal.json", help="Transfer journal used to resume an interrupted upgrade")
+parser.add_argument("--no-journal",   action="store_true", help="Neither read nor write the transfer journal")
+parser.add_argument("--slip-test",    action="store_true", help="Check the bulk SLIP codec against the legacy one on random data, then exit")
+parser.add_argument("--slip-benchmark", action="store_true", help="Time legacy vs bulk SLIP encode/decode of a full image (--upg .bin, else random), then exit")
+parser.add_argument("--slip-image-size", type=int, default=262144, help="With --slip-benchmark and no --upg, random image size in bytes")
 args = parser.parse_args()
 
 # print("args : ", sys.argv)
 
-dev = usb.core.find(idVendor=0x24aa, idProduct=0x4000)
+if args.slip_test or args.slip_benchmark:
+   ok = True
+   if args.slip_test:
+      ok = SLIP_selfTest()
+   if args.slip_benchmark:
+      if args.upg is not None:
+         with open("170086_sig_ble_nrf_v" + args.upg + ".bin", mode='rb') as slipImageFileObj:
+            slipImage = slipImageFileObj.read()
+      else:
+         slipImage = random.Random(0).randbytes(args.slip_image_size)
+      SLIP_benchmark(slipImage)
+   sys.exit(0 if ok else 1)
+
+if args.simulate:
+   import SimulatedDFUTarget
+   dev = SimulatedDFUTarget.create(chunk_ms=args.sim_chunk_ms,
+                                   queue_depth=args.sim_queue_depth,
+                                   erase_ms=args.sim_erase_ms,
+                                   drop_rate=args.sim_drop_rate,
+                                   seed=args.sim_seed,
+                                   state_file=args.sim_state,
+                                   disconnect_after=args.sim_disconnect_after)
+else:
+   dev = usb.core.find(idVendor=0x24aa, idProduct=0x4000)
 if not dev:
    print("No spectrometer found")
    sys.exit()
 
+BLE_DFU_adaptivePacing = not args.fixed_pacing
+if BLE_DFU_adaptivePacing:
+   BLE_DFU_pktIntvSecs = BLE_DFU_ADAPTIVE_PKT_INTV_SECS
+
 if args.intv is not None:
    if args.intv < 0 or args.intv > 5000:
       print("Specify valid pkt interval - range is 0 to 5000 millisecs !!")
@@ -1074,10 +1571,11 @@ if args.intv is not None:
    BLE_DFU_pktIntvSecs = args.intv
    BLE_DFU_pktIntvSecs /= 1000
 
-print("Pkt interval set to {} s".format(BLE_DFU_pktIntvSecs))
+print("Pkt interval set to {} s{}".format(BLE_DFU_pktIntvSecs, " (adaptive)" if BLE_DFU_adaptivePacing else ""))
 
 if args.abort:
-   ble_dfu_sendAbortReqMsg()
+   if ble_dfu_sendAbortReqMsg() == BLE_DFU_RC_SUCCESS:
+      ble_dfu_clearJournal("target discarded the upload")
    quit()
 
 if args.ver:
@@ -1104,15 +1602,27 @@ if args.status:
       BLE_DFU_dispTgtErrorCode(rc)
       print("Could not get app fw offset and/or CRC32 from target ... !!!  \n")
       rc = False
+      offset = crc32 = None
    else:
       maxSz = respList[1]
       offset = respList[2]
       crc32 = respList[3]
 
       print("App fw info from target: [max Sz {}, off {}, crc32 0x{:02x}]".format(maxSz, offset, crc32))
+
+   if not args.no_journal:
+      print("")
+      ble_dfu_displayJournal(offset, crc32)
    quit()
 
-if args.upg is not None:
+if args.simulate and args.upg is None:
+    simRng = random.Random(args.sim_seed)
+    BLE_DFU_initPacketData = list(simRng.randbytes(72))
+    BLE_DFU_appFwImage = list(simRng.randbytes(args.sim_image_size))
+    print("Simulating upgrade with a random init packet of {} bytes and app fw image of {} bytes".format(
+          len(BLE_DFU_initPacketData), len(BLE_DFU_appFwImage)))
+
+elif args.upg is not None:
     print("Upgrading to version {}".format(args.upg))
     # Read in the init file
     BLE_DFU_initFileName = "170086_sig_ble_nrf_v" + args.upg + ".dat"
@@ -1188,13 +1698,30 @@ initFileCalcdCRC32 = __calcCRC32(bytes(BLE_DFU_initPacketData))
 
 print("init packet calcd CRC32 is 0x{:08x}, size is {}".format(initFileCalcdCRC32, len(BLE_DFU_initPacketData)))
 
+ble_dfu_startJournal(BLE_DFU_initPacketData, BLE_DFU_appFwImage, args.upg or "simulated")
+
 # If there is no init packet or the init packet is invalid, create a new object
-if (tgtInitPktOffset != len(BLE_DFU_initPacketData) \
-    or (tgtInitPktCRC32 != initFileCalcdCRC32)):
+BLE_DFU_sendInitPkt = (tgtInitPktOffset != len(BLE_DFU_initPacketData) \
+                       or (tgtInitPktCRC32 != initFileCalcdCRC32))
+
+# With the right init packet in place, the data objects the target holds can
+# be kept if they are a prefix of this image.  Otherwise the only way to
+# discard them is to send the init packet again.
+if not BLE_DFU_sendInitPkt:
+   if ble_dfu_checkResume(BLE_DFU_appFwImage) is None:
+      print("Re-sending init packet to restart the app fw upload from the beginning ...")
+      BLE_DFU_sendInitPkt = True
+   else:
+      # Execute acts on the selected object, which is now the data object
+      ble_dfu_getInitPktInfo()
+
+if BLE_DFU_sendInitPkt:
    rc = BLE_DFU_sendInitPktToTgt(BLE_DFU_initPacketData, tgtMTU) 
    if rc != BLE_DFU_RC_SUCCESS:
       BLE_DFU_dispTgtErrorCode(rc)
       quit()
+   # creating the command object discarded any data objects on the target
+   ble_dfu_journalTruncate(0)
 else:
    print("Target has received valid init packet .... ")
 
@@ -1216,12 +1743,20 @@ print("Target has successfully validated the init packet .... :-)  ")
 print('Now sending App Firmware Image .....')
 
 rc = ble_dfu_sendAppFwToTgt(BLE_DFU_appFwImage)
+if args.simulate:
+   print(dev.summary())
+   print("Image committed by simulated target {} app fw image".format(
+         "matches" if bytes(dev.image) == bytes(BLE_DFU_appFwImage) else "DOES NOT match"))
 # if rc == BLE_DFU_RC_PARTIAL_SUCCESS: 
 if rc != BLE_DFU_RC_SUCCESS:
    print("Not resetting UART back to normal mode ...")
+   if BLE_DFU_journal is not None:
+      print("Progress saved in DFU journal {}; run the same upgrade again to resume".format(args.journal))
    print("Done ....")
    quit()
 
+ble_dfu_clearJournal("upgrade complete")
+
 try:
   result = dev.ctrl_transfer(HOST_TO_DEVICE,
                              0xff,
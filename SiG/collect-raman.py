@@ -9,16 +9,20 @@
 
 import sys
 import re
+import math
 from time import sleep
 from datetime import datetime
 
 import matplotlib.pyplot as plt
+import numpy as np
 import traceback
 import usb.core
 import argparse
 import struct
 import sys
 
+from functools import lru_cache
+
 HOST_TO_DEVICE = 0x40
 DEVICE_TO_HOST = 0xC0
 TIMEOUT_MS = 1000
@@ -26,6 +30,32 @@ TIMEOUT_MS = 1000
 MAX_PAGES = 8
 PAGE_SIZE = 64
 
+# generate_axes() and _generate_axes() from generic/Wavecal.py (documented there)
+def generate_axes(coeffs, pixels, excitation_nm=None):
+    coeffs = tuple(0.0 if c is None or math.isnan(c) else float(c) for c in coeffs)
+    if excitation_nm is None or math.isnan(excitation_nm) or excitation_nm <= 0:
+        excitation_nm = None
+    else:
+        excitation_nm = float(excitation_nm)
+    return _generate_axes(coeffs, int(pixels), excitation_nm)
+
+@lru_cache(maxsize=64)
+def _generate_axes(coeffs, pixels, excitation_nm):
+    x = np.arange(pixels, dtype=np.float64)
+    wavelengths = np.full(pixels, coeffs[-1] if coeffs else 0.0)
+    for c in reversed(coeffs[:-1]):
+        wavelengths *= x
+        wavelengths += c
+    wavelengths.setflags(write=False)
+
+    wavenumbers = None
+    if excitation_nm is not None:
+        with np.errstate(divide="ignore"):
+            wavenumbers = np.where(wavelengths != 0, 1e7 / excitation_nm - 1e7 / wavelengths, 0.0)
+        wavenumbers.setflags(write=False)
+
+    return wavelengths, wavenumbers
+
 # An extensible, stateful "Test Fixture" 
 class Fixture(object):
 
@@ -75,7 +105,10 @@ class Fixture(object):
         self.fpga_version = self.get_fpga_version()
         self.read_eeprom()
         self.generate_wavelengths()
-        print(f"Connected to {self.model} {self.serial_number} with {self.pixels} pixels ({self.wavelengths[0]:.2f}, {self.wavelengths[-1]:.2f}nm) ({self.wavenumbers[0]:.2f}, {self.wavenumbers[-1]:.2f}cm-1)")
+        if self.wavenumbers is not None:
+            print(f"Connected to {self.model} {self.serial_number} with {self.pixels} pixels ({self.wavelengths[0]:.2f}, {self.wavelengths[-1]:.2f}nm) ({self.wavenumbers[0]:.2f}, {self.wavenumbers[-1]:.2f}cm-1)")
+        else:
+            print(f"Connected to {self.model} {self.serial_number} with {self.pixels} pixels ({self.wavelengths[0]:.2f}, {self.wavelengths[-1]:.2f}nm) (no excitation in EEPROM)")
         print(f"ARM {self.fw_version}, FPGA {self.fpga_version}")
 
     def read_eeprom(self):
@@ -101,16 +134,8 @@ class Fixture(object):
         self.min_laser_power_mW = self.unpack((3, 32,  4), "f")
 
     def generate_wavelengths(self):
-        self.wavelengths = []
-        self.wavenumbers = []
-        for i in range(self.pixels):
-            wavelength = self.wavecal_C0 \
-                       + self.wavecal_C1 * i \
-                       + self.wavecal_C2 * i * i \
-                       + self.wavecal_C3 * i * i * i
-            wavenumber = 1e7 / self.excitation_nm - 1e7 / wavelength
-            self.wavelengths.append(wavelength)
-            self.wavenumbers.append(wavenumber)
+        coeffs = (self.wavecal_C0, self.wavecal_C1, self.wavecal_C2, self.wavecal_C3)
+        self.wavelengths, self.wavenumbers = generate_axes(coeffs, self.pixels, self.excitation_nm)
 
     ############################################################################
     # Commands
@@ -142,7 +167,8 @@ class Fixture(object):
             # header rows
             self.outfile.write("pixel, %s\n"      % (", ".join([str(x) for x in range(self.pixels)])))
             self.outfile.write("wavelength, %s\n" % (", ".join([f"{x:.2f}" for x in self.wavelengths])))
-            self.outfile.write("wavenumber, %s\n" % (", ".join([f"{x:.2f}" for x in self.wavenumbers])))
+            if self.wavenumbers is not None:
+                self.outfile.write("wavenumber, %s\n" % (", ".join([f"{x:.2f}" for x in self.wavenumbers])))
 
         # enable laser
         if self.args.fire_laser:
@@ -1,20 +1,206 @@
 import datetime
+import io
 import optparse
 import os
+import random
+import re
 import sys
+import time
+import zlib
 
 #Documentation by Nico
 #Script by Robert Dickerson
-c          = 0		# This will control how many bytes of bin data per line of the .c file
-iBlockSize = 16384  # This doesn't seem to do anything since it doesn't appear agian in the program, but the number does.
+iBlockSize = 1 << 20	# Bytes of bin data converted at a time (a multiple of BYTES_PER_LINE)
 bError     = False  # Flag to show when there is an error with the arguments.
-bFirstLine = True
 
+BYTES_PER_LINE = 16		# This will control how many bytes of bin data per line of the .c file
+
+# The FPGA is configured LSB first, so every byte of the bin file goes into the
+# array with its bits reversed.  REVERSED_BITS[b] is b with its bits reversed.
+REVERSED_BITS = bytes(int('{:08b}'.format(b)[::-1], 2) for b in range(256))
+
+# Optional compression of the (bit-reversed) array, for firmware that can
+# decompress it.  'rle' is PackBits: a control byte n of 0..127 is followed by
+# n+1 literal bytes, and one of 129..255 by a single byte to repeat 257-n times.
+COMPRESSION_DEFINES = { 'zlib': 'FPGA_DATA_ZLIB', 'rle': 'FPGA_DATA_RLE' }
+
+RUN_PATTERN = re.compile(rb'(.)\1{2,127}', re.DOTALL)
+
+def writeFpgaDataArrayLegacy(fb, cof):
+	''' the original byte-at-a-time conversion, kept as the reference for --benchmark '''
+	c          = 0
+	bFirstLine = True
+
+	block = fb.read(16384)
+
+	while len(block) > 0:
+		sOutput = []
+
+		for b in block:
+			if type(b) is str:
+				bn = int('{:08b}'.format(ord(b))[::-1],2)
+			elif type(b) is int:
+				bn = int('{:08b}'.format(b)[::-1],2)
+
+			sOutput.append('0x' + format(ord(chr(bn)), 'x').zfill(2))
+			c += 1
+
+			if c >= 16:
+				if not bFirstLine:
+					cof.write(',\n')
+				else:
+					bFirstLine = False
+
+				cof.write('\t' + ', '.join(sOutput))
+				sOutput = []
+				c       = 0
+
+		if c > 0:
+			cof.write(',\n\t' + ', '.join(sOutput))
+
+		block = fb.read(16384)
+
+def formatLines(data):
+	''' data (a multiple of BYTES_PER_LINE long) as '0x..' lines joined by ',\n\t' '''
+	text = data.hex(' ')
+	stride = 3 * BYTES_PER_LINE
+	lines = [text[i : i + stride - 1] for i in range(0, len(text), stride)]
+	return '0x' + ',\n\t0x'.join(lines).replace(' ', ', 0x')
+
+def writeArrayData(blocks, cof):
+	'''
+	Writes the bytes from the iterable blocks as the body of a C array, with
+	the same layout as writeFpgaDataArrayLegacy() (including its ',\n\t'
+	before a final partial line).  @returns the number of bytes written
+	'''
+	bFirstLine = True
+	carry = b''
+	count = 0
+	for block in blocks:
+		count += len(block)
+		data = carry + block
+		nFull = len(data) - len(data) % BYTES_PER_LINE
+		carry = data[nFull:]
+		if nFull:
+			cof.write(('\t' if bFirstLine else ',\n\t') + formatLines(data[:nFull]))
+			bFirstLine = False
+	if carry:
+		cof.write(',\n\t0x' + carry.hex(' ').replace(' ', ', 0x'))
+	return count
+
+def readReversedBlocks(fb):
+	block = fb.read(iBlockSize)
+	while len(block) > 0:
+		yield block.translate(REVERSED_BITS)
+		block = fb.read(iBlockSize)
+
+def compressZlib(blocks):
+	compressor = zlib.compressobj(9)
+	for block in blocks:
+		yield compressor.compress(block)
+	yield compressor.flush()
+
+def packBits(data):
+	''' PackBits-encode data: runs of 3 or more identical bytes, else literals '''
+	out = bytearray()
+	literalStart = 0
+	for run in RUN_PATTERN.finditer(data):
+		for i in range(literalStart, run.start(), 128):
+			literal = data[i : min(i + 128, run.start())]
+			out.append(len(literal) - 1)
+			out += literal
+		out.append(257 - len(run.group()))
+		out.append(data[run.start()])
+		literalStart = run.end()
+	for i in range(literalStart, len(data), 128):
+		literal = data[i : i + 128]
+		out.append(len(literal) - 1)
+		out += literal
+	return bytes(out)
+
+def unpackBits(data):
+	out = bytearray()
+	i = 0
+	while i < len(data):
+		n = data[i]
+		if n < 128:
+			out += data[i + 1 : i + n + 2]
+			i += n + 2
+		elif n > 128:
+			out += data[i + 1 : i + 2] * (257 - n)
+			i += 2
+		else:
+			i += 1
+	return bytes(out)
+
+def compressRle(blocks):
+	# runs are not merged across blocks, which costs at most a few bytes per block
+	for block in blocks:
+		yield packBits(block)
+
+def writeFpgaDataArray(fb, cof, compression=None):
+	''' @returns the number of bytes in the array '''
+	blocks = readReversedBlocks(fb)
+	if compression == 'zlib':
+		blocks = compressZlib(blocks)
+	elif compression == 'rle':
+		blocks = compressRle(blocks)
+	return writeArrayData(blocks, cof)
+
+def makeTestImage(rng, size):
+	''' random data broken up by runs of 0x00 / 0xFF, like an FPGA bitstream '''
+	image = bytearray(rng.randbytes(size))
+	offset = 0
+	while offset < size:
+		offset += rng.randrange(1, 2048)
+		runLen = rng.choice([1, 2, 3, 127, 128, 129, 300, 5000])
+		image[offset : offset + runLen] = bytes([rng.choice([0x00, 0xFF])]) * len(image[offset : offset + runLen])
+		offset += runLen
+	return bytes(image)
+
+def benchmark(size, cases=300):
+	''' output-identity test against the legacy converter, then timings.  @returns True if all passed '''
+	rng = random.Random(0)
+	mismatches = 0
+	sizes = [0, 1, 15, 16, 17, 16383, 16384, 16385, 32768 + 5] + [rng.randrange(0, 100000) for i in range(cases)]
+	for imageSize in sizes:
+		image = makeTestImage(rng, imageSize)
+		legacy = io.StringIO()
+		writeFpgaDataArrayLegacy(io.BytesIO(image), legacy)
+		new = io.StringIO()
+		writeFpgaDataArray(io.BytesIO(image), new)
+		if legacy.getvalue() != new.getvalue():
+			mismatches += 1
+			print('MISMATCH: array differs for a ' + str(imageSize) + ' byte image')
+
+		reversedImage = image.translate(REVERSED_BITS)
+		if unpackBits(b''.join(compressRle([reversedImage[i : i + 4096] for i in range(0, len(reversedImage), 4096)]))) != reversedImage \
+		   or zlib.decompress(b''.join(compressZlib([reversedImage]))) != reversedImage:
+			mismatches += 1
+			print('MISMATCH: compressed array does not decompress for a ' + str(imageSize) + ' byte image')
+	print(str(len(sizes)) + ' random images: ' + str(mismatches) + ' mismatches')
+
+	image = makeTestImage(rng, size)
+	timings = []
+	for label, convert in [('legacy', writeFpgaDataArrayLegacy),
+	                       ('table', writeFpgaDataArray),
+	                       ('table + rle', lambda fb, cof: writeFpgaDataArray(fb, cof, 'rle')),
+	                       ('table + zlib', lambda fb, cof: writeFpgaDataArray(fb, cof, 'zlib'))]:
+		cof = io.StringIO()
+		start = time.perf_counter()
+		count = convert(io.BytesIO(image), cof)
+		secs = time.perf_counter() - start
+		timings.append(secs)
+		print('\t{:14s} {:8.3f} s  {:6.1f}x  array {} bytes'.format(label, secs, timings[0] / secs, len(image) if count is None else count))
+	return mismatches == 0
 
 parser = optparse.OptionParser(version='%prog 1.0')
 parser.add_option('-f', dest='FpgaBinFile', help='FPGA Bin File')
 parser.add_option('-c', dest='COutputFile', help='C Output File')
 parser.add_option('-i', dest='HOutputFile', help='Header Output File')
+parser.add_option('-z', dest='Compression', choices=list(COMPRESSION_DEFINES), help='Compress the array (zlib or rle) for firmware that can decompress it')
+parser.add_option('--benchmark', dest='Benchmark', action='store_true', help='Check the output against the original converter on random images, then time it')
+parser.add_option('--benchmark-size', dest='BenchmarkSize', type='int', default=4 << 20, help='Random image size for --benchmark')
 
 if len(sys.argv) <= 1:
 	parser.print_help()
@@ -22,6 +208,9 @@ if len(sys.argv) <= 1:
 	
 (options, args) = parser.parse_args()
 
+if options.Benchmark:
+	sys.exit(0 if benchmark(options.BenchmarkSize) else 1)
+
 if options.FpgaBinFile is None:
 	print('ERROR: Need to Specify FPGA Bin File (-f)')
 	bError = True
@@ -46,6 +235,8 @@ print('# FPGA Converter from BIN to C')
 print('################################################################################')
 print('\tFPGA Bin File = ' + options.FpgaBinFile)
 print('\tC Output File = ' + options.COutputFile)
+if options.Compression:
+	print('\tCompression   = ' + options.Compression)
 print('################################################################################')
    
    
@@ -70,35 +261,8 @@ except:
 	sys.exit(2)
 	
 
-block = fb.read(16384)
+iArraySize = writeFpgaDataArray(fb, cof, options.Compression)
 
-while len(block) > 0:
-	sOutput = []
-	
-	for b in block:			
-		if type(b) is str:
-			bn = int('{:08b}'.format(ord(b))[::-1],2)
-		elif type(b) is int:
-			bn = int('{:08b}'.format(b)[::-1],2)	
-			
-		sOutput.append('0x' + format(ord(chr(bn)), 'x').zfill(2))
-		c += 1
-		
-		if c >= 16:
-			if not bFirstLine:
-				cof.write(',\n')
-			else:
-				bFirstLine = False
-				
-			cof.write('\t' + ', '.join(sOutput))
-			sOutput = []
-			c       = 0
-	
-	if c > 0:
-		cof.write(',\n\t' + ', '.join(sOutput))
-		
-	block = fb.read(16384)
-	
 cof.write('\n};\n\n')
    
 try:
@@ -116,7 +280,13 @@ hof.write('#include <stdint.h>\n\n')
 hof.write('#define FPGA_PROGRAM_SIZE ' + str(os.path.getsize(options.FpgaBinFile)) +
           '\t\t// size of Spartan-6 FPGA ' + str(os.path.getsize(options.FpgaBinFile)) + 
 	       ' bytes\n')
-hof.write('const uint8_t FPGAData[FPGA_PROGRAM_SIZE];\n\n')
+if options.Compression:
+	hof.write('#define ' + COMPRESSION_DEFINES[options.Compression] + ' 1\n')
+	hof.write('#define FPGA_DATA_SIZE ' + str(iArraySize) +
+	          '\t\t// FPGAData holds the program ' + options.Compression + '-compressed\n')
+	hof.write('const uint8_t FPGAData[FPGA_DATA_SIZE];\n\n')
+else:
+	hof.write('const uint8_t FPGAData[FPGA_PROGRAM_SIZE];\n\n')
 hof.write('#endif //FPGA_DATA_H\n')
 
 
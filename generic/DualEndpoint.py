@@ -0,0 +1,203 @@
+import array
+import threading
+import usb.core
+import usb.util
+import numpy as np
+
+from time import sleep, perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+HOST_TO_DEVICE = 0x40
+DEVICE_TO_HOST = 0xC0
+
+ENDPOINTS = (0x82, 0x86)
+
+class DualEndpointReader:
+    """
+    Reads 2048-pixel FX2 spectra, which arrive as 1024 pixels apiece on bulk
+    endpoints 0x82 and 0x86.
+
+    By default (concurrent=True) the 0x86 read is handed to a persistent
+    worker thread while the caller reads 0x82, so both transfers are in
+    flight at once instead of one after the other.  Each half lands in its own
+    preallocated array.array and is reassembled into one preallocated uint16
+    spectrum.  concurrent=False reproduces the legacy sequence: 0x82, sleep
+    sleep_ms (the "empirically determined" 5ms), then 0x86.
+
+    read() returns a view of the internal spectrum, overwritten by the next
+    read(); copy (or tolist()) it to keep it.  If an endpoint returns short,
+    the result is correspondingly shorter.
+    """
+    def __init__(self, dev, pixels=2048, concurrent=True, sleep_ms=5):
+        self.dev = dev
+        self.pixels = pixels
+        self.concurrent = concurrent
+        self.sleep_ms = sleep_ms
+        self.half_bytes = pixels # pixels / 2 endpoints * 2 bytes
+
+        self.buffers = { ep: array.array('B', bytes(self.half_bytes)) for ep in ENDPOINTS }
+        self.halves = { ep: np.frombuffer(self.buffers[ep], dtype="<u2") for ep in ENDPOINTS }
+        self.spectrum = np.zeros(pixels, dtype=np.uint16)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ep86") if concurrent else None
+
+    def read_endpoint(self, ep, timeout_ms):
+        """ fill the endpoint's buffer, tolerating partial reads; @returns bytes read """
+        buf = self.buffers[ep]
+        count = self.dev.read(ep, buf, timeout_ms)
+        while count < self.half_bytes:
+            data = self.dev.read(ep, self.half_bytes - count, timeout_ms)
+            if len(data) == 0:
+                break
+            buf[count : count + len(data)] = array.array('B', data)
+            count += len(data)
+        return count
+
+    def read(self, timeout_ms=1000):
+        if self.concurrent:
+            future = self.executor.submit(self.read_endpoint, 0x86, timeout_ms)
+            try:
+                count_82 = self.read_endpoint(0x82, timeout_ms)
+            finally:
+                # never leave the worker writing into the buffers after we return
+                count_86 = future.result()
+        else:
+            count_82 = self.read_endpoint(0x82, timeout_ms)
+            if self.sleep_ms:
+                sleep(self.sleep_ms / 1000.0)
+            count_86 = self.read_endpoint(0x86, timeout_ms)
+
+        n82 = count_82 // 2
+        n86 = count_86 // 2
+        self.spectrum[:n82] = self.halves[0x82][:n82]
+        self.spectrum[n82 : n82 + n86] = self.halves[0x86][:n86]
+        return self.spectrum[:n82 + n86]
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+
+class FakeDualEndpointDevice:
+    """
+    Stand-in for a 2048-pixel FX2 spectrometer.  After ACQUIRE (0xad) each
+    endpoint has one 1024-pixel half ready once the integration time has
+    elapsed; each read then takes transfer_ms of "bus time", and reads on
+    the two endpoints may overlap.  Pixel n carries value n, with pixel 0
+    replaced by a frame counter, so reassembly can be checked.
+    """
+    def __init__(self, pixels=2048, transfer_ms=1.0):
+        self.idVendor = 0x24aa
+        self.idProduct = 0x1000
+        self.pixels = pixels
+        self.transfer_ms = transfer_ms
+        self.integration_time_ms = 10
+        self.lock = threading.Lock()
+        self.frame = 0
+        self.ready = { ep: [] for ep in ENDPOINTS } # per-endpoint queue of (ready time, payload)
+
+        self.template = np.arange(pixels, dtype="<u2")
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+        if bmRequestType == DEVICE_TO_HOST:
+            return array.array('B', bytes(data_or_wLength))
+        with self.lock:
+            if bRequest == 0xb2:
+                self.integration_time_ms = wValue
+            elif bRequest == 0xad:
+                self.frame += 1
+                spectrum = self.template.copy()
+                spectrum[0] = self.frame & 0xffff
+                payload = spectrum.tobytes()
+                ready = perf_counter() + self.integration_time_ms / 1000.0
+                half = len(payload) // 2
+                self.ready[0x82].append((ready, payload[:half]))
+                self.ready[0x86].append((ready, payload[half:]))
+        return 0
+
+    def read(self, endpoint, size_or_buffer, timeout=1000):
+        with self.lock:
+            queue = self.ready[endpoint]
+            pending = queue[0] if queue else None
+        if pending is None:
+            sleep(timeout / 1000.0)
+            raise usb.core.USBTimeoutError("fake timeout")
+
+        ready, payload = pending
+        wait = ready - perf_counter()
+        if wait > timeout / 1000.0:
+            sleep(timeout / 1000.0)
+            raise usb.core.USBTimeoutError("fake timeout")
+        sleep(max(0, wait) + self.transfer_ms / 1000.0)
+
+        size = size_or_buffer if isinstance(size_or_buffer, int) else len(size_or_buffer)
+        with self.lock:
+            data = payload[:size]
+            if size >= len(payload):
+                queue.pop(0)
+            else:
+                queue[0] = (ready, payload[size:])
+        if isinstance(size_or_buffer, int):
+            return array.array('B', data)
+        size_or_buffer[:len(data)] = array.array('B', data)
+        return len(data)
+
+if __name__ == "__main__":
+    import argparse
+
+    argparser = argparse.ArgumentParser(
+        description="compare sequential (with/without inter-endpoint sleep) and concurrent 0x82/0x86 reads on a 2048-pixel FX2",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    argparser.add_argument("--fake",                action="store_true", help="use a fake two-endpoint device instead of hardware")
+    argparser.add_argument("--fake-transfer-ms",    type=float,          help="fake per-endpoint transfer time", default=1.0)
+    argparser.add_argument("--pid",                 type=str,            help="USB PID in hex", default="1000")
+    argparser.add_argument("--spectra",             type=int,            help="spectra per strategy", default=100)
+    argparser.add_argument("--integration-time-ms", type=int,            help="integration time", default=1)
+    argparser.add_argument("--sleep-ms",            type=str,            help="comma-delimited inter-endpoint sleeps to try sequentially", default="5,0")
+    args = argparser.parse_args()
+
+    if args.fake:
+        dev = FakeDualEndpointDevice(transfer_ms=args.fake_transfer_ms)
+    else:
+        import os
+        dev = usb.core.find(idVendor=0x24aa, idProduct=int(args.pid, 16))
+        if dev is None:
+            print("No spectrometers found")
+            raise SystemExit(1)
+        if os.name == "posix":
+            dev.set_configuration(1)
+            usb.util.claim_interface(dev, 0)
+
+    dev.ctrl_transfer(HOST_TO_DEVICE, 0xb2, args.integration_time_ms, 0, [0] * 8, 1000)
+    timeout_ms = 1000 + args.integration_time_ms * 2
+
+    strategies = [ (f"sequential, {ms}ms sleep", False, int(ms)) for ms in args.sleep_ms.split(",") ]
+    strategies.append(("concurrent", True, 0))
+
+    results = []
+    for label, concurrent, sleep_ms in strategies:
+        reader = DualEndpointReader(dev, concurrent=concurrent, sleep_ms=sleep_ms)
+        errors = short = corrupt = 0
+        start = perf_counter()
+        for i in range(args.spectra):
+            dev.ctrl_transfer(HOST_TO_DEVICE, 0xad, 0, 0, [0] * 8, 1000)
+            try:
+                spectrum = reader.read(timeout_ms)
+            except usb.core.USBError:
+                errors += 1
+                continue
+            if len(spectrum) != reader.pixels:
+                short += 1
+            elif args.fake and not np.array_equal(spectrum[1:], dev.template[1:]):
+                corrupt += 1
+        elapsed = perf_counter() - start
+        reader.close()
+        results.append((label, args.spectra / elapsed, errors, short, corrupt))
+
+    print(f"\n{'strategy':28s} {'spectra/sec':>12s} {'errors':>7s} {'short':>6s} {'corrupt':>8s}")
+    for label, rate, errors, short, corrupt in results:
+        print(f"{label:28s} {rate:12.1f} {errors:7d} {short:6d} {corrupt:8d}")
+
+    baseline = results[0][1]
+    print(f"\nconcurrent vs {results[0][0]}: {results[-1][1] / baseline:.2f}x")
+    for label, rate, errors, short, corrupt in results[1:-1]:
+        verdict = "still needed" if errors or short or corrupt else "not needed here"
+        print(f"inter-endpoint sleep ({label}): {verdict}")
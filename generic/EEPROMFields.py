@@ -1,4 +1,12 @@
+import os
+import re
+import json
 import struct
+import hashlib
+
+from datetime import datetime
+
+PAGE_SIZE = 64
 
 class EEPROMField:
     def __init__(self, pos, data_type, name):
@@ -131,12 +139,99 @@ def get_eeprom_fields():
 
 def parse_eeprom_pages(pages):
     """ @param pages char[8][64] """
+    global compiled_parser
+    if compiled_parser is None:
+        compiled_parser = EEPROMParser()
+    return compiled_parser.parse(pages)
+
+def parse_eeprom_pages_by_field(pages):
+    """ 
+    Original field-at-a-time parser, retained as the reference implementation 
+    for EEPROMParser.
+    """
     fields = get_eeprom_fields()
     eeprom = {}
     for name, field in fields.items():
         eeprom[name] = unpack(field.pos, field.data_type, name, pages)
     return eeprom
 
+class EEPROMParser:
+    """
+    Precompiled EEPROM parser.  The struct layouts are built from EEPROM_FIELDS 
+    once, so each 64-byte page is decoded with a single unpack_from() (plus one 
+    more for each set of overlapping fields, e.g. start_integ and 
+    startup_integration_time_ms).  Output is identical to 
+    parse_eeprom_pages_by_field(); pages which are missing, short or not 
+    bytes-like fall back to it field by field, including its error messages.
+    """
+    def __init__(self):
+        self.fields = get_eeprom_fields()
+
+        # page -> list of layers, each { "fmt", "end", "slots": {(offset, length, data_type): index} }
+        layers_by_page = {}
+        slot_by_name = {}
+        for field in sorted(self.fields.values(), key=lambda f: (f.page, f.offset)):
+            if field.data_type in ["s", "*"]:
+                code = f"{field.length}s"
+            elif struct.calcsize("=" + field.data_type) == field.length:
+                code = field.data_type
+            else:
+                continue # unpack() would fail, so leave it to the fallback
+
+            key = (field.offset, field.length, field.data_type)
+            layers = layers_by_page.setdefault(field.page, [])
+            for layer_index, layer in enumerate(layers):
+                if key in layer["slots"]:
+                    break
+                if layer["end"] <= field.offset:
+                    pad = field.offset - layer["end"]
+                    layer["fmt"] += (f"{pad}x" if pad else "") + code
+                    layer["end"] = field.offset + field.length
+                    layer["slots"][key] = len(layer["slots"])
+                    break
+            else:
+                layer_index = len(layers)
+                layers.append({ "fmt": (f"{field.offset}x" if field.offset else "") + code,
+                                "end": field.offset + field.length,
+                                "slots": { key: 0 } })
+            slot_by_name[field.name] = (layer_index, layers[layer_index]["slots"][key])
+
+        self.structs = { page: [ struct.Struct("=" + layer["fmt"]) for layer in layers ] 
+                         for page, layers in layers_by_page.items() }
+
+        # (name, page, layer, index, data_type) in EEPROM_FIELDS order; layer None means fallback
+        self.plan = []
+        for name, field in self.fields.items():
+            layer, index = slot_by_name.get(name, (None, None))
+            self.plan.append((name, field.page, layer, index, field.data_type))
+
+    def parse(self, pages):
+        values = {}
+        for page, structs in self.structs.items():
+            values[page] = None
+            if page < len(pages) and pages[page] is not None:
+                try:
+                    values[page] = [ s.unpack_from(pages[page]) for s in structs ]
+                except (struct.error, TypeError):
+                    pass
+
+        eeprom = {}
+        for name, page, layer, index, data_type in self.plan:
+            if layer is None or values[page] is None:
+                field = self.fields[name]
+                eeprom[name] = unpack(field.pos, field.data_type, name, pages)
+                continue
+
+            value = values[page][layer][index]
+            if data_type == "s":
+                value = value.split(b"\0", 1)[0].decode("latin-1")
+            elif data_type == "*":
+                value = list(value)
+            eeprom[name] = value
+        return eeprom
+
+compiled_parser = None # EEPROMParser, built on first use
+
 def dump_feature_mask(value):
     print(f"FeatureMask 0x{value:02x}:")
     for bit, label in FEATURE_MASK_FLAGS:
@@ -183,3 +278,215 @@ def unpack(address, data_type, field, pages):
             return
 
     return unpack_result
+
+################################################################################
+# EEPROM cache
+################################################################################
+
+# Reading all 8 pages over USB is a significant part of startup time, so scripts 
+# may cache raw pages on disk, one JSON file per serial number:
+#
+#   { "version": 1, "serial_number": "WP-01234", "fw_version": "1.0.2.3",
+#     "sha256": <hash of all pages>, "timestamp": ..., "pages": [ <hex>, ... ] }
+#
+# On connect, only page 0 and EEPROM_CACHE_VALIDATION_PAGE are read from the 
+# device; if both match the cache (and firmware revision and content hash 
+# agree) the remaining pages are taken from the cache.
+
+EEPROM_CACHE_VERSION = 1
+EEPROM_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".wasatch", "eeprom-cache")
+EEPROM_CACHE_VALIDATION_PAGE = 1 # wavecal, the page most often rewritten in the field
+
+def hash_eeprom_pages(pages):
+    h = hashlib.sha256()
+    for page in pages:
+        h.update(bytes(page))
+    return h.hexdigest()
+
+def get_eeprom_cache_path(serial_number, cache_dir=None):
+    filename = re.sub(r"[^A-Za-z0-9_.-]", "_", serial_number)
+    return os.path.join(cache_dir or EEPROM_CACHE_DIR, f"{filename}.json")
+
+def load_eeprom_cache(serial_number, fw_version, cache_dir=None):
+    """ @returns cached pages as bytearrays, or None if missing, stale or corrupt """
+    path = get_eeprom_cache_path(serial_number, cache_dir)
+    if not os.path.exists(path):
+        return
+
+    try:
+        with open(path) as infile:
+            doc = json.load(infile)
+        if doc["version"] != EEPROM_CACHE_VERSION:
+            return
+        if doc["serial_number"] != serial_number or doc["fw_version"] != fw_version:
+            return
+        pages = [ bytearray.fromhex(page) for page in doc["pages"] ]
+    except (OSError, ValueError, KeyError, TypeError):
+        return
+
+    if hash_eeprom_pages(pages) != doc["sha256"]:
+        return
+    return pages
+
+def save_eeprom_cache(pages, fw_version, cache_dir=None):
+    serial_number = unpack((0, 16, 16), "s", "serial_number", pages)
+    if not serial_number:
+        return
+
+    doc = { "version":       EEPROM_CACHE_VERSION,
+            "serial_number": serial_number,
+            "fw_version":    fw_version,
+            "sha256":        hash_eeprom_pages(pages),
+            "timestamp":     str(datetime.now()),
+            "pages":         [ bytes(page).hex() for page in pages ] }
+
+    path = get_eeprom_cache_path(serial_number, cache_dir)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as outfile:
+            json.dump(doc, outfile, indent=2)
+        os.replace(tmp, path)
+    except OSError as ex:
+        print(f"unable to save EEPROM cache {path}: {ex}")
+
+def read_eeprom_pages_cached(read_page, fw_version, max_pages=8, refresh=False, cache_dir=None):
+    """
+    @param read_page  callable returning the 64-byte page n from the device
+    @param fw_version cache entries from other firmware revisions are ignored
+    @param refresh    force a full read (and update the cache)
+    @returns (pages, cached), where cached indicates whether pages came from the cache
+    """
+    page0 = read_page(0)
+    serial_number = unpack((0, 16, 16), "s", "serial_number", [ page0 ])
+
+    validated = {}
+    if serial_number and not refresh:
+        cached = load_eeprom_cache(serial_number, fw_version, cache_dir)
+        if cached is not None and len(cached) >= max_pages and bytes(cached[0]) == bytes(page0):
+            check = EEPROM_CACHE_VALIDATION_PAGE
+            if check < max_pages:
+                validated[check] = read_page(check)
+            if check >= max_pages or bytes(validated[check]) == bytes(cached[check]):
+                return (cached[:max_pages], True)
+
+    pages = [ page0 ]
+    for page in range(1, max_pages):
+        pages.append(validated[page] if page in validated else read_page(page))
+
+    if serial_number:
+        save_eeprom_cache(pages, fw_version, cache_dir)
+    return (pages, False)
+
+################################################################################
+# Self-test
+################################################################################
+
+# EEPROM image recorded from a WP-638X (also used as an example in eeprom-util.py)
+RECORDED_PAGES = [
+    "57502d363338582d4631332d522d494c57502d303136313600000000000000002c0100000100010900190008000a00003333f33f0000000000000000ffffff0e",
+    "c9fe2044216ffe3d58b526378d8b23b28115784528de0ec3e295efbe14000a009db17542f6b337bc95bf56b510277a0d31322f31342f323032330000414741ff",
+    "5331363031312d31313036000000000000080a4000e85dc62b14081a00ff0700003f0000003f0000003f000000000000000000000000000000000000000000ff",
+    "ffffffffffffffffffffffffc63f78415da6f63e38dc933ad7cbdcb600007a430000803f55641f440800000060ea0000d289ed40ffffffffffffffffffffffff",
+    "00ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff",
+    "170382012805e1055f063001ffffffffffffffffffffffffffffffffb10350000000000000000000000000000000ffffffffffffffffffffffffffffffffff01",
+    "0000000000ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff",
+    "ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff",
+]
+
+def load_eeprom_pages_json(filename):
+    """ load pages from an eeprom-util.py --save-file (or ENLIGHTEN eeprom_backups) file """
+    with open(filename) as infile:
+        doc = json.load(infile)
+    return [ bytearray(int(v) for v in m.split(",")) 
+             for m in re.findall(r"array\('B', \[([0-9, ]+)\]\)", doc["buffers"]) ]
+
+def load_eeprom_dump(filename):
+    """
+    Load EEPROM page images from any of the dump formats eeprom-util.py 
+    understands: --save-file JSON (or ENLIGHTEN eeprom_backups), eeprom-util.py
+    text output ("Page 0: array('B', [...])") or an ENLIGHTEN logfile 
+    (GET_MODEL_CONFIG(n) responses).
+
+    @returns a list of distinct images (a logfile may hold several 
+             connections) in order of last appearance, each a list of 64-byte
+             bytearray pages
+    """
+    if filename.lower().endswith(".json"):
+        return [ load_eeprom_pages_json(filename) ]
+
+    with open(filename, errors="replace") as infile:
+        text = infile.read()
+
+    images = []
+    current = None
+    for m in re.finditer(r"(?:GET_MODEL_CONFIG\((\d+)\)|Page\s+(\d+)\s*:).*?array\('B',\s*\[([0-9,\s]+)\]\)", text):
+        page = int(m.group(1) if m.group(1) is not None else m.group(2))
+        values = bytearray(int(v) for v in m.group(3).split(","))
+        if len(values) != PAGE_SIZE:
+            continue
+
+        if page == 0:
+            current = []
+            images.append(current)
+        if current is None:
+            continue
+
+        if page == len(current):
+            current.append(values)
+        elif page < len(current):
+            current[page] = values # re-read
+
+    # the same unit may have connected several times; keep each image at its 
+    # last occurrence, so the final entry is the most recent connection
+    unique = {}
+    for pages in images:
+        key = b"".join(pages)
+        unique.pop(key, None)
+        unique[key] = pages
+    return list(unique.values())
+
+if __name__ == "__main__":
+    import sys
+    import random
+    import argparse
+    from time import perf_counter
+
+    argparser = argparse.ArgumentParser(description="verify and benchmark EEPROMParser against the field-by-field parser")
+    argparser.add_argument("--random",     type=int, default=10000, help="number of random page images to verify")
+    argparser.add_argument("--iterations", type=int, default=10000, help="benchmark iterations")
+    argparser.add_argument("--seed",       type=int, default=0,     help="random seed")
+    argparser.add_argument("files",        nargs="*",               help="additional eeprom-util.py --save-file JSON dumps to verify")
+    args = argparser.parse_args()
+
+    def same(a, b):
+        # repr so that NaN floats compare equal
+        return a.keys() == b.keys() and all(repr(a[k]) == repr(b[k]) for k in a)
+
+    rng = random.Random(args.seed)
+    images = [ ("recorded", [ bytearray.fromhex(page) for page in RECORDED_PAGES ]) ]
+    for filename in args.files:
+        images.append((filename, load_eeprom_pages_json(filename)))
+    for i in range(args.random):
+        count = rng.choice([7, 8, 9])
+        images.append((f"random {i}", [ bytearray(rng.getrandbits(8) for j in range(64)) for page in range(count) ]))
+
+    failures = 0
+    for label, pages in images:
+        if not same(parse_eeprom_pages(pages), parse_eeprom_pages_by_field(pages)):
+            print(f"MISMATCH: {label}")
+            failures += 1
+    print(f"verified {len(images)} images: {failures} mismatches")
+
+    pages = images[0][1]
+    results = {}
+    for label, func in [ ("by field", parse_eeprom_pages_by_field), ("compiled", parse_eeprom_pages) ]:
+        start = perf_counter()
+        for i in range(args.iterations):
+            func(pages)
+        results[label] = perf_counter() - start
+        print(f"{label:10s} {1e6 * results[label] / args.iterations:8.2f} us/parse")
+    print(f"speedup {results['by field'] / results['compiled']:.1f}x")
+
+    if failures:
+        sys.exit(1)
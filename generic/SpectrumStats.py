@@ -0,0 +1,51 @@
+import numpy as np
+
+class SpectrumStats:
+    """
+    Online per-pixel mean, variance, min and max over a series of spectra.
+
+    Uses Welford's algorithm, vectorized across pixels, so each add() is a
+    handful of NumPy operations and memory use stays constant no matter how
+    many spectra are accumulated.  stdev() matches np.std (population, ddof=0)
+    over the same spectra.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean  = None
+        self.m2    = None
+        self.min   = None
+        self.max   = None
+
+    def add(self, spectrum):
+        x = np.asarray(spectrum, dtype=np.float64)
+        if self.count == 0:
+            self.mean = np.zeros(len(x))
+            self.m2   = np.zeros(len(x))
+            self.min  = x.copy()
+            self.max  = x.copy()
+        elif len(x) != len(self.mean):
+            raise ValueError(f"spectrum has {len(x)} pixels, expected {len(self.mean)}")
+
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        np.minimum(self.min, x, out=self.min)
+        np.maximum(self.max, x, out=self.max)
+
+    def variance(self, ddof=0):
+        if self.count <= ddof:
+            return None
+        return self.m2 / (self.count - ddof)
+
+    def stdev(self, ddof=0):
+        var = self.variance(ddof)
+        return None if var is None else np.sqrt(var)
+
+    def mean_stdev(self):
+        """ average over pixels of each pixel's stdev over time """
+        std = self.stdev()
+        return None if std is None else float(np.mean(std))
@@ -0,0 +1,345 @@
+import time
+import array
+import atexit
+import struct
+import threading
+import usb.core
+import usb.util
+
+from collections import defaultdict
+
+################################################################################
+# USB record / replay
+################################################################################
+
+# RecordingDevice wraps a pyusb device and logs every control and bulk
+# transfer, with perf_counter_ns timestamps, to a compact binary trace.
+# ReplayDevice serves a trace back in place of the hardware, either with the
+# recorded device-side latencies or as fast as possible, so host-side
+# throughput can be measured (and regressions caught) without a spectrometer.
+#
+# Trace file layout (little-endian):
+#
+#   header: magic "WPUSBTRC", version (H)
+#   then records, each RECORD followed by 'result' bytes of data (if result > 0):
+#
+#     kind          B   KIND_*
+#     device        B   index of the device within the trace
+#     request_type  B   bmRequestType (control) or endpoint (bulk)
+#     request       B   bRequest (control)
+#     value         H   wValue (control)
+#     index         H   wIndex (control)
+#     length        I   bytes requested (IN) or sent (OUT)
+#     start_ns      q   relative to the start of the trace
+#     elapsed_ns    q   time spent in pyusb
+#     result        i   bytes transferred, or ERROR_*
+#
+#   KIND_DEVICE records describe a device: value = idVendor, index = idProduct,
+#   request = address, length = max packet size of endpoint 0x82.
+
+TRACE_MAGIC = b"WPUSBTRC"
+TRACE_VERSION = 1
+
+HEADER = struct.Struct("<8sH")
+RECORD = struct.Struct("<BBBBHHIqqi")
+
+KIND_DEVICE   = 0
+KIND_CTRL_IN  = 1
+KIND_CTRL_OUT = 2
+KIND_BULK_IN  = 3
+KIND_BULK_OUT = 4
+
+KIND_NAMES = { KIND_DEVICE: "device", KIND_CTRL_IN: "ctrl in", KIND_CTRL_OUT: "ctrl out",
+               KIND_BULK_IN: "bulk in", KIND_BULK_OUT: "bulk out" }
+
+ERROR_TIMEOUT = -1
+ERROR_USB     = -2
+
+def to_bytes(data):
+    if data is None or isinstance(data, int):
+        return b""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return bytes(data)
+    if isinstance(data, array.array):
+        return data.tobytes()
+    return bytes(data) # list of ints
+
+class TraceRecord:
+    def __init__(self, kind, device, request_type, request, value, index, length, start_ns, elapsed_ns, result, data):
+        self.kind         = kind
+        self.device       = device
+        self.request_type = request_type
+        self.request      = request
+        self.value        = value
+        self.index        = index
+        self.length       = length
+        self.start_ns     = start_ns
+        self.elapsed_ns   = elapsed_ns
+        self.result       = result
+        self.data         = data
+
+class TraceWriter:
+    """ thread-safe (multiple devices may be recorded concurrently) """
+    def __init__(self, filename):
+        self.filename = filename
+        self.outfile = open(filename, "wb", buffering=1024 * 1024)
+        self.outfile.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION))
+        self.lock = threading.Lock()
+        self.start_ns = time.perf_counter_ns()
+        self.device_count = 0
+        self.count = 0
+        atexit.register(self.close)
+
+    def add_device(self, dev, max_packet_size):
+        with self.lock:
+            index = self.device_count
+            self.device_count += 1
+        self.write(KIND_DEVICE, index, 0, getattr(dev, "address", 0) or 0, dev.idVendor, dev.idProduct, max_packet_size, self.start_ns, 0, 0, b"")
+        return index
+
+    def write(self, kind, device, request_type, request, value, index, length, start_ns, elapsed_ns, result, data):
+        record = RECORD.pack(kind, device, request_type, request, value, index, length, start_ns - self.start_ns, elapsed_ns, result)
+        with self.lock:
+            if self.outfile is None:
+                return
+            self.outfile.write(record)
+            if data:
+                self.outfile.write(data)
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.outfile is not None:
+                self.outfile.close()
+                self.outfile = None
+                print(f"recorded {self.count} USB transfers to {self.filename}")
+
+class RecordingDevice:
+    """
+    Transparent proxy for a pyusb device (or anything with the same
+    ctrl_transfer/read/write signatures) which logs each transfer to a
+    TraceWriter.  Other attributes pass through to the wrapped device.
+    """
+    def __init__(self, dev, writer):
+        self._dev = dev
+        self._writer = writer
+        self._index = writer.add_device(dev, self.find_max_packet_size(dev))
+
+    def __getattr__(self, name):
+        return getattr(self._dev, name)
+
+    def find_max_packet_size(self, dev):
+        try:
+            intf = dev.get_active_configuration()[(0, 0)]
+            ep = usb.util.find_descriptor(intf, bEndpointAddress=0x82)
+            return ep.wMaxPacketSize if ep is not None else 0
+        except Exception:
+            return 0
+
+    def _call(self, kind, request_type, request, value, index, length, func, *args):
+        start = time.perf_counter_ns()
+        try:
+            result = func(*args)
+        except usb.core.USBTimeoutError:
+            self._writer.write(kind, self._index, request_type, request, value, index, length, start, time.perf_counter_ns() - start, ERROR_TIMEOUT, b"")
+            raise
+        except usb.core.USBError:
+            self._writer.write(kind, self._index, request_type, request, value, index, length, start, time.perf_counter_ns() - start, ERROR_USB, b"")
+            raise
+        return start, time.perf_counter_ns() - start, result
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+        if bmRequestType & 0x80:
+            length = data_or_wLength if isinstance(data_or_wLength, int) else len(data_or_wLength or [])
+            start, elapsed, result = self._call(KIND_CTRL_IN, bmRequestType, bRequest, wValue, wIndex, length,
+                self._dev.ctrl_transfer, bmRequestType, bRequest, wValue, wIndex, data_or_wLength, timeout)
+            data = to_bytes(data_or_wLength[:result]) if isinstance(result, int) else to_bytes(result)
+            self._writer.write(KIND_CTRL_IN, self._index, bmRequestType, bRequest, wValue, wIndex, length, start, elapsed, len(data), data)
+        else:
+            data = to_bytes(data_or_wLength)
+            start, elapsed, result = self._call(KIND_CTRL_OUT, bmRequestType, bRequest, wValue, wIndex, len(data),
+                self._dev.ctrl_transfer, bmRequestType, bRequest, wValue, wIndex, data_or_wLength, timeout)
+            self._writer.write(KIND_CTRL_OUT, self._index, bmRequestType, bRequest, wValue, wIndex, len(data), start, elapsed, len(data), data)
+        return result
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        length = size_or_buffer if isinstance(size_or_buffer, int) else len(size_or_buffer)
+        start, elapsed, result = self._call(KIND_BULK_IN, endpoint, 0, 0, 0, length,
+            self._dev.read, endpoint, size_or_buffer, timeout)
+        data = to_bytes(size_or_buffer[:result]) if isinstance(result, int) else to_bytes(result)
+        self._writer.write(KIND_BULK_IN, self._index, endpoint, 0, 0, 0, length, start, elapsed, len(data), data)
+        return result
+
+    def write(self, endpoint, data, timeout=None):
+        payload = to_bytes(data)
+        start, elapsed, result = self._call(KIND_BULK_OUT, endpoint, 0, 0, 0, len(payload),
+            self._dev.write, endpoint, data, timeout)
+        self._writer.write(KIND_BULK_OUT, self._index, endpoint, 0, 0, 0, len(payload), start, elapsed, result, b"")
+        return result
+
+def load_trace(filename):
+    """ @returns list of TraceRecord (including KIND_DEVICE) """
+    with open(filename, "rb") as infile:
+        buf = infile.read()
+    magic, version = HEADER.unpack_from(buf, 0)
+    if magic != TRACE_MAGIC:
+        raise ValueError(f"{filename} is not a USB trace")
+    if version != TRACE_VERSION:
+        raise ValueError(f"{filename} is trace version {version}, expected {TRACE_VERSION}")
+
+    records = []
+    pos = HEADER.size
+    while pos + RECORD.size <= len(buf):
+        fields = RECORD.unpack_from(buf, pos)
+        pos += RECORD.size
+        result = fields[-1]
+        data = b""
+        if result > 0 and fields[0] in [KIND_CTRL_IN, KIND_CTRL_OUT, KIND_BULK_IN]:
+            data = buf[pos : pos + result]
+            pos += result
+        records.append(TraceRecord(*fields, data))
+    return records
+
+class ReplayDevice:
+    """
+    Serves a recorded session back through the pyusb calls the scripts use.
+
+    Control IN responses are matched on (bmRequestType, bRequest, wValue,
+    wIndex) and bulk IN data on endpoint, each in recorded order, so small
+    differences in call ordering between recording and replay don't matter.
+    Bulk data is treated as a stream: a read returns at most the rest of the
+    current recorded transfer, so callers may use different chunk sizes.
+    When a queue is exhausted it wraps around (counted in 'wrapped'), letting
+    a short recording drive a long benchmark.  Recorded timeouts and USB
+    errors are raised again.
+
+    With realtime=True each served transfer sleeps for its recorded
+    elapsed_ns, reproducing device-side latency (e.g. integration time);
+    otherwise replay runs as fast as the host can go.
+    """
+    def __init__(self, info, records, realtime=False):
+        self.idVendor        = info.value
+        self.idProduct       = info.index
+        self.address         = info.request
+        self.max_packet_size = info.length or 512
+        self.realtime        = realtime
+
+        self.served   = 0
+        self.wrapped  = 0
+        self.unmatched = 0
+
+        self.ctrl = defaultdict(list)
+        self.bulk = defaultdict(list)
+        for r in records:
+            if r.kind in [KIND_CTRL_IN, KIND_CTRL_OUT]:
+                self.ctrl[(r.request_type, r.request, r.value, r.index)].append(r)
+            elif r.kind == KIND_BULK_IN:
+                self.bulk[r.request_type].append(r)
+
+        self.ctrl_pos = defaultdict(int)
+        self.bulk_pos = defaultdict(int)
+        self.pending = {} # endpoint -> remaining bytes of the current bulk record
+
+    def set_configuration(self, configuration=None):
+        pass
+
+    def next_record(self, queues, positions, key):
+        queue = queues.get(key)
+        if not queue:
+            return None
+        pos = positions[key]
+        if pos >= len(queue):
+            pos = 0
+            self.wrapped += 1
+        positions[key] = pos + 1
+        self.served += 1
+        return queue[pos]
+
+    def wait(self, record):
+        if self.realtime and record.elapsed_ns > 0:
+            time.sleep(record.elapsed_ns / 1e9)
+        if record.result == ERROR_TIMEOUT:
+            raise usb.core.USBTimeoutError("replayed timeout")
+        if record.result == ERROR_USB:
+            raise usb.core.USBError("replayed USB error")
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+        record = self.next_record(self.ctrl, self.ctrl_pos, (bmRequestType, bRequest, wValue, wIndex))
+        if not bmRequestType & 0x80:
+            if record is None:
+                self.unmatched += 1
+            else:
+                self.wait(record)
+            return len(to_bytes(data_or_wLength))
+
+        if record is None:
+            self.unmatched += 1
+            raise usb.core.USBError(f"no recorded response to request 0x{bRequest:02x} value 0x{wValue:04x} index 0x{wIndex:04x}")
+        self.wait(record)
+        if isinstance(data_or_wLength, int):
+            return array.array('B', record.data[:data_or_wLength])
+        n = min(len(record.data), len(data_or_wLength))
+        data_or_wLength[:n] = array.array('B', record.data[:n])
+        return n
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        size = size_or_buffer if isinstance(size_or_buffer, int) else len(size_or_buffer)
+        data = self.pending.get(endpoint)
+        if not data:
+            record = self.next_record(self.bulk, self.bulk_pos, endpoint)
+            if record is None:
+                self.unmatched += 1
+                if timeout:
+                    time.sleep(timeout / 1000.0)
+                raise usb.core.USBTimeoutError(f"no recorded data on endpoint 0x{endpoint:02x}")
+            self.wait(record)
+            data = memoryview(record.data)
+
+        chunk, self.pending[endpoint] = data[:size], data[size:]
+        if isinstance(size_or_buffer, int):
+            return array.array('B', chunk)
+        size_or_buffer[:len(chunk)] = array.array('B', chunk)
+        return len(chunk)
+
+    def write(self, endpoint, data, timeout=None):
+        return len(to_bytes(data))
+
+    def summary(self):
+        return f"replayed {self.served} transfers ({self.wrapped} wrapped, {self.unmatched} unmatched)"
+
+def load_replay_devices(filename, realtime=False):
+    """ @returns one ReplayDevice per device in the trace """
+    records = load_trace(filename)
+    devices = []
+    for info in [ r for r in records if r.kind == KIND_DEVICE ]:
+        devices.append(ReplayDevice(info, [ r for r in records if r.device == info.device and r.kind != KIND_DEVICE ], realtime))
+    return devices
+
+if __name__ == "__main__":
+    import argparse
+
+    argparser = argparse.ArgumentParser(description="summarize a USB trace recorded with --record")
+    argparser.add_argument("filename", help="trace file")
+    argparser.add_argument("--dump",   action="store_true", help="print every transfer")
+    args = argparser.parse_args()
+
+    records = load_trace(args.filename)
+    summary = defaultdict(lambda: [0, 0, 0, 0]) # count, bytes, elapsed_ns, errors
+    for r in records:
+        if r.kind == KIND_DEVICE:
+            print(f"device {r.device}: VID 0x{r.value:04x} PID 0x{r.index:04x} address {r.request} max packet {r.length}")
+            continue
+        if args.dump:
+            print(f"{r.start_ns / 1e6:12.3f}ms dev {r.device} {KIND_NAMES[r.kind]:8s} 0x{r.request_type:02x} 0x{r.request:02x} 0x{r.value:04x} 0x{r.index:04x} len {r.length:5d} -> {r.result:5d} in {r.elapsed_ns / 1e3:9.1f}us")
+        key = (r.device, KIND_NAMES[r.kind], r.request if r.kind in [KIND_CTRL_IN, KIND_CTRL_OUT] else r.request_type)
+        s = summary[key]
+        s[0] += 1
+        s[1] += max(r.result, 0)
+        s[2] += r.elapsed_ns
+        s[3] += r.result < 0
+
+    duration = (records[-1].start_ns + records[-1].elapsed_ns) / 1e9 if records else 0
+    print(f"{len(records)} records over {duration:.3f}sec")
+    print(f"{'dev':>3s} {'kind':8s} {'req/ep':>6s} {'count':>7s} {'bytes':>10s} {'avg us':>10s} {'errors':>6s}")
+    for (device, kind, request), (count, total, elapsed_ns, errors) in sorted(summary.items()):
+        print(f"{device:3d} {kind:8s} {'0x%02x' % request:>6s} {count:7d} {total:10d} {elapsed_ns / count / 1e3:10.1f} {errors:6d}")
@@ -0,0 +1,106 @@
+import math
+import numpy as np
+
+from functools import lru_cache
+
+def generate_axes(coeffs, pixels, excitation_nm=None):
+    """
+    Generate the wavelength and (optionally) Raman-shift wavenumber axes for a
+    wavecal polynomial.
+
+    @param coeffs        wavecal_c0..c3 or c0..c4 (NaN coefficients, as from
+                         an unprogrammed wavecal_c4, are treated as zero)
+    @param pixels        active_pixels_horizontal
+    @param excitation_nm laser wavelength; wavenumbers are None unless positive
+    @returns (wavelengths, wavenumbers) as read-only float64 NumPy arrays
+
+    The polynomial is evaluated with Horner's rule over np.arange(pixels), so
+    there are no per-pixel Python operations and no separately-computed powers
+    of i.  Results are memoized on (coeffs, pixels, excitation_nm), so
+    reconnects and multi-device sessions with the same calibration share one
+    pair of arrays (hence read-only: copy before modifying).  Pixels whose
+    wavelength is zero get wavenumber zero.
+    """
+    coeffs = tuple(0.0 if c is None or math.isnan(c) else float(c) for c in coeffs)
+    if excitation_nm is None or math.isnan(excitation_nm) or excitation_nm <= 0:
+        excitation_nm = None
+    else:
+        excitation_nm = float(excitation_nm)
+    return _generate_axes(coeffs, int(pixels), excitation_nm)
+
+def generate_wavelengths(coeffs, pixels):
+    return generate_axes(coeffs, pixels)[0]
+
+def generate_wavenumbers(coeffs, pixels, excitation_nm):
+    return generate_axes(coeffs, pixels, excitation_nm)[1]
+
+@lru_cache(maxsize=64)
+def _generate_axes(coeffs, pixels, excitation_nm):
+    x = np.arange(pixels, dtype=np.float64)
+    wavelengths = np.full(pixels, coeffs[-1] if coeffs else 0.0)
+    for c in reversed(coeffs[:-1]):
+        wavelengths *= x
+        wavelengths += c
+    wavelengths.setflags(write=False)
+
+    wavenumbers = None
+    if excitation_nm is not None:
+        with np.errstate(divide="ignore"):
+            wavenumbers = np.where(wavelengths != 0, 1e7 / excitation_nm - 1e7 / wavelengths, 0.0)
+        wavenumbers.setflags(write=False)
+
+    return wavelengths, wavenumbers
+
+if __name__ == "__main__":
+    import random
+    import argparse
+    from time import perf_counter
+
+    argparser = argparse.ArgumentParser(description="verify and benchmark generate_axes against the per-pixel loop")
+    argparser.add_argument("--pixels",     type=int, default=2048,  help="pixels")
+    argparser.add_argument("--iterations", type=int, default=1000,  help="benchmark iterations")
+    argparser.add_argument("--seed",       type=int, default=0,     help="random seed")
+    args = argparser.parse_args()
+
+    def by_pixel(coeffs, pixels, excitation_nm):
+        wavelengths = []
+        wavenumbers = []
+        for i in range(pixels):
+            nm = coeffs[0] + coeffs[1] * i + coeffs[2] * i * i + coeffs[3] * i * i * i + coeffs[4] * i * i * i * i
+            wavelengths.append(nm)
+            wavenumbers.append(1e7 / excitation_nm - 1e7 / nm)
+        return wavelengths, wavenumbers
+
+    rng = random.Random(args.seed)
+    worst = 0
+    for trial in range(100):
+        coeffs = [ rng.uniform(200, 1000), rng.uniform(0.01, 0.5), rng.gauss(0, 1e-5), rng.gauss(0, 1e-9), rng.gauss(0, 1e-13) ]
+        excitation_nm = coeffs[0] - rng.uniform(5, 50)
+        expected = by_pixel(coeffs, args.pixels, excitation_nm)
+        actual = generate_axes(coeffs, args.pixels, excitation_nm)
+        worst = max(worst, np.max(np.abs(np.array(expected[0]) - actual[0])),
+                           np.max(np.abs(np.array(expected[1]) - actual[1])))
+    print(f"verified 100 calibrations: max abs difference {worst:.3g}")
+
+    coeffs = [ 780.0, 0.1, -1e-5, 1e-9, 1e-13 ]
+    start = perf_counter()
+    for i in range(args.iterations):
+        by_pixel(coeffs, args.pixels, 785.0)
+    loop_sec = perf_counter() - start
+
+    start = perf_counter()
+    for i in range(args.iterations):
+        _generate_axes.cache_clear()
+        generate_axes(coeffs, args.pixels, 785.0)
+    horner_sec = perf_counter() - start
+
+    start = perf_counter()
+    for i in range(args.iterations):
+        generate_axes(coeffs, args.pixels, 785.0)
+    cached_sec = perf_counter() - start
+
+    for label, sec in [ ("by pixel", loop_sec), ("horner", horner_sec), ("cached", cached_sec) ]:
+        print(f"{label:10s} {1e6 * sec / args.iterations:10.2f} us/axis ({loop_sec / sec:.1f}x)")
+
+    if worst > 1e-6:
+        raise SystemExit(1)
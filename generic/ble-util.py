@@ -4,14 +4,17 @@ import numpy as np
 import argparse
 import asyncio
 import struct
+import json
 import re
 
-from time import sleep
+from time import sleep, perf_counter
 from bleak import BleakScanner, BleakClient
 from datetime import datetime
 from functools import partial
 
 import EEPROMFields
+import Wavecal
+from SpectrumStats import SpectrumStats
 
 ################################################################################
 # Globals
@@ -87,6 +90,8 @@ class Fixture:
 
         # scanning
         self.client = None                                  # instantiated BleakClient
+        self.local_name = None                              # advertised name of the connected device (e.g. 'WP-SiG:WP-01791')
+        self.device_info = {}
         self.keep_scanning = True
         self.stop_scanning_event = asyncio.Event()
 
@@ -104,6 +109,11 @@ class Fixture:
 
         self.notifications = set()                          # all Characteristics to which we're subscribed for notifications
 
+        # Spectra
+        self.pixels_read = 0
+        self.spectrum_buffer = None                         # preallocated uint16 array filled by spectra_notification
+        self.spectrum_complete = asyncio.Event()            # set when the last pixel lands
+
         # Characteristics
         self.code_by_name = { "LASER_STATE":             0xff03,
                               "ACQUIRE":                 0xff04,
@@ -143,6 +153,13 @@ class Fixture:
         group.add_argument("--monitor",                 action="store_true", help="monitor battery, laser state etc")
         group.add_argument("--search-timeout-sec",      type=int,            help="how long to search for spectrometers", default=30)
 
+        group = parser.add_argument_group('EEPROM')
+        group.add_argument("--eeprom-window",           type=int,            help="EEPROM chunk requests kept outstanding (1 for the original one-at-a-time read)", default=8)
+        group.add_argument("--eeprom-timeout-ms",       type=int,            help="per-chunk response timeout when pipelined", default=2000)
+        group.add_argument("--eeprom-retries",          type=int,            help="passes re-requesting missing chunks when pipelined", default=3)
+        group.add_argument("--eeprom-cache",            type=str,            help="JSON file caching EEPROM pages by serial number ('' to disable)", default="ble_eeprom_cache.json")
+        group.add_argument("--refresh-eeprom",          action="store_true", help="ignore any cached EEPROM and re-read it from the device")
+
         group = parser.add_argument_group('Spectra')
         group.add_argument("--spectra",                 type=int,            help="number of spectra to acquire", default=5)
         group.add_argument("--auto-dark",               action="store_true", help="take Auto-Dark measurements")
@@ -154,6 +171,7 @@ class Fixture:
         group.add_argument("--timeout-ms",              type=int,            help="override timeout (ms)")
         group.add_argument("--keep-waiting",            action="store_true", help="don't timeout")
         group.add_argument("--loop-forever",            action="store_true", help="repeat measurement until killed with ctrl-C")
+        group.add_argument("--legacy-spectra",          action="store_true", help="decode pixel-by-pixel and poll for completion every 200ms (for comparison)")
                                                          
         group = parser.add_argument_group('Acquisition Parameters')
         group.add_argument("--integration-time-ms",     type=int,            help="set integration time")
@@ -198,15 +216,27 @@ class Fixture:
         group.add_argument("--accessors",               action="store_true", help="exercise getter/setters")
         group.add_argument("--setter-delay-ms",         type=int,            help="minimum delay / settle time after writing generic setter", default=1000)
 
+        group = parser.add_argument_group('Benchmark')
+        group.add_argument("--benchmark",               action="store_true", help="measure legacy vs event-driven spectrum latency against a fake BLE client (no hardware; uses --spectra, --integration-time-ms)")
+        group.add_argument("--benchmark-pixels",        type=int,            help="fake spectrometer pixels", default=1952)
+        group.add_argument("--benchmark-packet-ms",     type=float,          help="interval between replayed SPECTRA notifications", default=7.5)
+        group.add_argument("--benchmark-mtu",           type=int,            help="fake negotiated MTU (sets pixels per notification)", default=247)
+
         self.args = parser.parse_args()
 
         if self.args.debug:
             debugging = True
 
+        self.legacy_spectra = self.args.legacy_spectra
+
     async def run(self):
 
         # note: will not connect to 'random' or first-found device, for laser safety reasons
         print(f"ble-util {self.VERSION}")
+        if self.args.benchmark:
+            await self.benchmark()
+            return
+
         if self.args.serial_number:
             print(f"Searching for {self.args.serial_number}...")
         elif self.args.first:
@@ -351,6 +381,8 @@ class Fixture:
 
         self.dump(device, advertisement_data)
 
+        self.local_name = advertisement_data.local_name
+
         self.debug("instantiating BleakClient")
         self.client = BleakClient(address_or_ble_device=device, 
                                   disconnected_callback=self.disconnected_callback,
@@ -477,6 +509,7 @@ class Fixture:
         if uuid is None:
             raise RuntimeError(f"invalid characteristic {name}")
         extra = []
+        seq = None
 
         if name == "GENERIC":
             # STEP FIVE: allocate a new sequence number, and associate it with the passed callback
@@ -511,6 +544,8 @@ class Fixture:
             self.debug(f"write_char: waiting for {ack_name} ack")
             await self.generics.wait(ack_name)
 
+        return seq
+
     def expand_path(self, name, data):
         if name != "GENERIC":
             return [ f"0x{v:02x}" for v in data ]
@@ -836,12 +871,12 @@ class Fixture:
             with open(self.args.outfile, "a") as outfile:
                 outfile.write(f"pixel, " + ", ".join([f"{v}" for v in range(self.pixels)]) + "\n")
                 outfile.write(f"wavelengths, " + ", ".join([f"{v:.2f}" for v in self.wavelengths]) + "\n")
-                if self.wavenumbers:
+                if self.wavenumbers is not None:
                     outfile.write(f"wavenumbers, " + ", ".join([f"{v:.2f}" for v in self.wavenumbers]) + "\n")
 
         # init graph
         if self.args.plot:
-            xaxis = self.wavenumbers if self.wavenumbers else self.wavelengths
+            xaxis = self.wavenumbers if self.wavenumbers is not None else self.wavelengths
             plt.ion()
 
         # init ramps
@@ -853,13 +888,13 @@ class Fixture:
 
         try:
             # collect however many spectra were requested
-            collection = []
+            collection = SpectrumStats()
             for step in range(self.args.spectra):
                 await self.update_ramps(step)
 
                 # if we're doing ramps, take a set of repeats at each step to capture any settling
                 repeats = self.args.ramp_repeats if self.ramping else 1
-                spectra = []
+                spectra = SpectrumStats()
                 for repeat in range(repeats):
                     start_time = datetime.now()
                     try:
@@ -880,8 +915,8 @@ class Fixture:
                     hi = max(spectrum)
                     avg = sum(spectrum) / len(spectrum)
                     std = np.std(spectrum)
-                    spectra.append(spectrum)
-                    collection.append(spectrum)
+                    spectra.add(spectrum)
+                    collection.add(spectrum)
 
                     print(f"{now} received spectrum {step+1:3d}/{self.args.spectra} (elapsed {elapsed_ms:5d}ms, max {hi:8.2f}, avg {avg:8.2f}, std {std:8.2f}) {spectrum[:10]}")
 
@@ -901,21 +936,11 @@ class Fixture:
 
                 if repeats > 1:
                     # if we're doing some kind of ramping, compute the average pixel stdev (pixel noise over time, not space)
-                    stds = []
-                    for px in range(len(spectra[0])):
-                        px_std = np.std([ spectrum[px] for spectrum in spectra ])
-                        stds.append(px_std)
-                    avg_std = np.mean(stds)
-                    print(f"average PIXEL stdev (over repeats) over the entire spectrum: {avg_std:.2f}\n")
+                    print(f"average PIXEL stdev (over repeats) over the entire spectrum: {spectra.mean_stdev():.2f}\n")
 
             if repeats > 1:
                 # if we're doing some kind of ramping, compute the average pixel stdev (pixel noise over time, not space)
-                stds = []
-                for px in range(len(collection[0])):
-                    px_std = np.std([ spectrum[px] for spectrum in collection ])
-                    stds.append(px_std)
-                avg_std = np.mean(stds)
-                print(f"average PIXEL stdev (over collection) over the entire spectrum: {avg_std:.2f}\n")
+                print(f"average PIXEL stdev (over collection) over the entire spectrum: {collection.mean_stdev():.2f}\n")
 
         except KeyboardInterrupt:
             print()
@@ -958,7 +983,6 @@ class Fixture:
         self.debug(f"acquire_notification: {msg}")
         
     def spectra_notification(self, sender, data):
-        ok = True
         if (len(data) < 3):
             raise RuntimeError(f"received invalid SPECTRA notification of {len(data)} bytes: {data}")
 
@@ -977,8 +1001,24 @@ class Fixture:
         if first_pixel != self.pixels_read:
             raise RuntimeError(f"received first_pixel {first_pixel} when pixels_read {self.pixels_read}")
 
-        spectral_data = data[2:]
-        
+        if self.legacy_spectra:
+            self.decode_pixels_legacy(data[2:])
+            return
+
+        # pixel intensities are little-endian uint16
+        pixels_in_packet = (len(data) - 2) // 2
+        end = self.pixels_read + pixels_in_packet
+        if end > self.pixels:
+            raise RuntimeError(f"{end - self.pixels} trailing pixels in packet")
+
+        self.spectrum_buffer[self.pixels_read:end] = np.frombuffer(data, dtype="<u2", count=pixels_in_packet, offset=2)
+        self.pixels_read = end
+
+        if self.pixels_read == self.pixels:
+            self.spectrum_complete.set()
+
+    def decode_pixels_legacy(self, spectral_data):
+        """ original per-pixel decode into self.spectrum (--legacy-spectra) """
         pixels_in_packet = int(len(spectral_data) / 2)
 
         for i in range(pixels_in_packet):
@@ -996,7 +1036,11 @@ class Fixture:
 
     async def get_spectrum(self):
         self.pixels_read = 0
-        self.spectrum = [0] * self.pixels
+        if self.legacy_spectra:
+            self.spectrum = [0] * self.pixels
+        elif self.spectrum_buffer is None or len(self.spectrum_buffer) != self.pixels:
+            self.spectrum_buffer = np.zeros(self.pixels, dtype=np.uint16)
+        self.spectrum_complete.clear()
 
         # determine which type of measurement
         if self.args.auto_raman: 
@@ -1019,13 +1063,21 @@ class Fixture:
         self.debug(f"waiting for {self.pixels} pixels over {timeout_ms} ms")
 
         # wait for spectral data to arrive
-        start_time = datetime.now()
-        while self.pixels_read < self.pixels:
-            if not self.args.keep_waiting and (datetime.now() - start_time).total_seconds() * 1000 > timeout_ms:
+        if self.legacy_spectra:
+            start_time = datetime.now()
+            while self.pixels_read < self.pixels:
+                if not self.args.keep_waiting and (datetime.now() - start_time).total_seconds() * 1000 > timeout_ms:
+                    raise WPTimeout(f"failed to read spectrum within timeout {timeout_ms}ms")
+
+                # self.debug(f"still waiting for spectra ({self.pixels_read}/{self.pixels} read)")
+                await asyncio.sleep(0.2)
+        else:
+            # spectra_notification sets the event as soon as the last pixel lands
+            try:
+                await asyncio.wait_for(self.spectrum_complete.wait(), None if self.args.keep_waiting else timeout_ms / 1000.0)
+            except asyncio.TimeoutError:
                 raise WPTimeout(f"failed to read spectrum within timeout {timeout_ms}ms")
-
-            # self.debug(f"still waiting for spectra ({self.pixels_read}/{self.pixels} read)")
-            await asyncio.sleep(0.2)
+            self.spectrum = self.spectrum_buffer.tolist()
 
         ########################################################################
         # post-processing
@@ -1042,13 +1094,97 @@ class Fixture:
             
         return self.spectrum
 
+    ############################################################################
+    # Benchmark
+    ############################################################################
+
+    async def benchmark(self):
+        """
+        Exercise get_spectrum and read_eeprom against a FakeBleakClient, 
+        comparing the original and current implementation of each.
+        """
+        self.pixels = self.args.benchmark_pixels
+        self.integration_time_ms = self.args.integration_time_ms if self.args.integration_time_ms is not None else 100
+        self.client = FakeBleakClient(uuid_by_name        = { name: self.get_uuid_by_name(name) for name in self.code_by_name },
+                                      pixels              = self.pixels,
+                                      integration_time_ms = self.integration_time_ms,
+                                      packet_ms           = self.args.benchmark_packet_ms,
+                                      mtu                 = self.args.benchmark_mtu)
+        for name, callback in [ ("SPECTRA", self.spectra_notification), ("GENERIC", self.generics.notification_callback) ]:
+            await self.client.start_notify(self.get_uuid_by_name(name), callback)
+            self.notifications.add(self.get_uuid_by_name(name))
+
+        await self.benchmark_spectra()
+        await self.benchmark_eeprom()
+
+    async def benchmark_spectra(self):
+        """
+        End-to-end spectrum latency (ACQUIRE write to returned spectrum), first
+        with the legacy per-pixel decode and 200ms completion polling, then 
+        event-driven.  The floor is the ACQUIRE write, the fake's integration 
+        time, and the time taken to replay every notification packet.
+        """
+        packets = -(-self.pixels // self.client.pixels_per_packet)
+        floor_ms = self.args.benchmark_packet_ms + self.integration_time_ms + packets * self.args.benchmark_packet_ms
+        print(f"fake client: {self.pixels} pixels in {packets} packets of {self.client.pixels_per_packet} pixels, "
+              f"{self.args.benchmark_packet_ms}ms apart, integration time {self.integration_time_ms}ms (floor {floor_ms:.1f}ms)")
+
+        results = []
+        for label, legacy in [ ("legacy (200ms poll)", True), ("event-driven", False) ]:
+            self.legacy_spectra = legacy
+            latencies = []
+            mismatches = 0
+            for i in range(self.args.spectra):
+                start = perf_counter()
+                spectrum = await self.get_spectrum()
+                latencies.append((perf_counter() - start) * 1000)
+                if spectrum != self.client.last_spectrum:
+                    mismatches += 1
+            results.append((label, latencies, mismatches))
+
+        print(f"\n{'mode':20s} {'mean ms':>8s} {'median':>8s} {'max':>8s} {'over floor':>10s} {'mismatches':>10s}")
+        for label, latencies, mismatches in results:
+            mean = np.mean(latencies)
+            print(f"{label:20s} {mean:8.1f} {np.median(latencies):8.1f} {max(latencies):8.1f} {mean - floor_ms:10.1f} {mismatches:10d}")
+
+        before, after = np.mean(results[0][1]), np.mean(results[1][1])
+        print(f"\nevent-driven saves {before - after:.1f}ms per spectrum ({before / after:.2f}x)\n")
+        self.legacy_spectra = self.args.legacy_spectra
+
+    async def benchmark_eeprom(self):
+        """ one-at-a-time vs pipelined EEPROM read (the cache is bypassed) """
+        self.max_eeprom_pages = len(self.client.eeprom)
+        eeprom_window = self.args.eeprom_window
+
+        results = []
+        for label, window in [ ("one-at-a-time", 1), (f"pipelined, window {eeprom_window}", eeprom_window) ]:
+            self.args.eeprom_window = window
+            start = perf_counter()
+            if window > 1:
+                await self.read_eeprom_pages_pipelined()
+            else:
+                await self.read_eeprom_pages()
+            elapsed_ms = (perf_counter() - start) * 1000
+            ok = [ bytes(page[:64]) for page in self.pages ] == self.client.eeprom
+            results.append((label, elapsed_ms, ok))
+        self.args.eeprom_window = eeprom_window
+
+        print(f"\n{'EEPROM read':24s} {'ms':>8s} {'correct':>8s}")
+        for label, elapsed_ms, ok in results:
+            print(f"{label:24s} {elapsed_ms:8.1f} {str(ok):>8s}")
+
     ############################################################################
     # EEPROM
     ############################################################################
 
     async def read_eeprom(self):
-        await self.read_eeprom_pages()
-        self.parse_eeprom_pages()
+        if not self.load_cached_eeprom():
+            if self.args.eeprom_window > 1:
+                await self.read_eeprom_pages_pipelined()
+            else:
+                await self.read_eeprom_pages()
+            self.parse_eeprom_pages()
+            self.save_cached_eeprom()
         self.generate_wavecal()
 
         # grab initial integration time (used for acquisition timeout)
@@ -1056,7 +1192,7 @@ class Fixture:
 
         msg  = f"Connected to {self.eeprom['model']} {self.eeprom['serial_number']} with {self.pixels} pixels "
         msg += f"from ({self.wavelengths[0]:.2f}, {self.wavelengths[-1]:.2f}nm)"
-        if self.wavenumbers:
+        if self.wavenumbers is not None:
             msg += f" ({self.wavenumbers[0]:.2f}, {self.wavenumbers[-1]:.2f}cm⁻¹)"
         try:
             print(msg)
@@ -1073,19 +1209,8 @@ class Fixture:
         self.pixels = self.eeprom["active_pixels_horizontal"]
         coeffs = [ self.eeprom[f"wavecal_c{i}"] for i in range(5) ]
 
-        self.wavelengths = []
-        for i in range(self.pixels):
-            nm = (  coeffs[0] +
-                  + coeffs[1] * i
-                  + coeffs[2] * i * i
-                  + coeffs[3] * i * i * i
-                  + coeffs[4] * i * i * i * i)
-            self.wavelengths.append(nm)
-
         self.excitation = self.eeprom["excitation_nm_float"] # @todo update for MultiWavelengthCalibration
-        self.wavenumbers = None
-        if self.excitation:
-            self.wavenumbers = [ (1e7/self.excitation - 1e7/nm) for nm in self.wavelengths ]
+        self.wavelengths, self.wavenumbers = Wavecal.generate_axes(coeffs, self.pixels, self.excitation)
 
     async def read_eeprom_pages(self):
         """ tweaked version of get_generic_value """
@@ -1122,6 +1247,144 @@ class Fixture:
         elapsed_sec = (datetime.now() - start_time).total_seconds()
         print(f"reading eeprom took {elapsed_sec:.2f} sec")
 
+    async def read_eeprom_pages_pipelined(self):
+        """
+        Pipelined version of read_eeprom_pages.  The first chunk is read alone 
+        to learn the chunk size; the remaining chunks are then requested with 
+        up to --eeprom-window requests outstanding, each response matched to 
+        its (page, offset) by GENERIC sequence number and stored in place as it
+        arrives.  Any byte ranges still missing (dropped or timed-out
+        responses) are re-requested, up to --eeprom-retries more passes.
+        """
+        start_time = datetime.now()
+
+        self.eeprom = {}
+        self.pages = [ bytearray(64) for page in range(self.max_eeprom_pages) ]
+        received = np.zeros((self.max_eeprom_pages, 64), dtype=bool)
+
+        name = "EEPROM_DATA"
+        window = asyncio.Semaphore(self.args.eeprom_window)
+        timeout_sec = self.args.eeprom_timeout_ms / 1000.0
+        requests = 0
+
+        async def read_chunk(page, offset):
+            nonlocal requests
+            arrived = asyncio.Event()
+
+            async def store(data):
+                data = bytes(data or b"")[:64 - offset]
+                self.pages[page][offset : offset + len(data)] = data
+                received[page, offset : offset + len(data)] = True
+                arrived.set()
+
+            request = self.generics.generate_read_request(name)
+            request.extend([0, page, offset]) # page is big-endian uint16
+
+            async with window:
+                requests += 1
+                self.debug(f"read_eeprom_pages_pipelined: requesting page {page} offset {offset}")
+                seq = await self.write_char("GENERIC", request, callback=store)
+                try:
+                    await asyncio.wait_for(arrived.wait(), timeout_sec)
+                except asyncio.TimeoutError:
+                    self.debug(f"read_eeprom_pages_pipelined: no response for page {page} offset {offset}")
+                    self.generics.get_callback(seq) # release the sequence number
+
+        def missing_chunks():
+            """ @returns (page, offset) of the start of each unread byte range """
+            return [ (page, offset) for page in range(self.max_eeprom_pages) for offset in range(64) 
+                     if not received[page, offset] and (offset == 0 or received[page, offset - 1]) ]
+
+        for attempt in range(1 + self.args.eeprom_retries):
+            await read_chunk(0, 0)
+            chunk_size = int(received[0].argmin()) if not received[0].all() else 64
+            if chunk_size:
+                break
+        else:
+            raise RuntimeError("no response to EEPROM read request")
+
+        await asyncio.gather(*[ read_chunk(page, offset) for page in range(self.max_eeprom_pages) 
+                                                         for offset in range(0, 64, chunk_size) if page or offset ])
+
+        for attempt in range(self.args.eeprom_retries):
+            missing = missing_chunks()
+            if not missing:
+                break
+            self.debug(f"read_eeprom_pages_pipelined: retrying {len(missing)} missing chunks: {missing}")
+            await asyncio.gather(*[ read_chunk(page, offset) for page, offset in missing ])
+
+        missing = missing_chunks()
+        if missing:
+            raise RuntimeError(f"failed to read EEPROM (page, offset) {missing} after {self.args.eeprom_retries} retries")
+
+        elapsed_sec = (datetime.now() - start_time).total_seconds()
+        print(f"reading eeprom took {elapsed_sec:.2f} sec ({requests} requests of {chunk_size} bytes, window {self.args.eeprom_window})")
+
+    def get_advertised_serial(self):
+        """ @returns 'WP-01791' from local_name 'WP-SiG:WP-01791' (None if unknown) """
+        if self.local_name is None or ":" not in self.local_name:
+            return None
+        return self.local_name.split(":")[-1]
+
+    def load_cached_eeprom(self):
+        """
+        Populate self.pages and self.eeprom from --eeprom-cache if it holds an 
+        entry for this unit's advertised serial number which was saved under 
+        the same Device Information (firmware revisions), and whose own 
+        serial_number still matches.  
+
+        @note the cache can't see EEPROM writes made by other tools; use 
+              --refresh-eeprom after changing the EEPROM
+        @returns True if the cache was used
+        """
+        serial = self.get_advertised_serial()
+        if not self.args.eeprom_cache or self.args.refresh_eeprom or serial is None:
+            return False
+
+        try:
+            with open(self.args.eeprom_cache) as infile:
+                entry = json.load(infile).get(serial)
+        except (OSError, ValueError) as ex:
+            self.debug(f"load_cached_eeprom: unable to read {self.args.eeprom_cache}: {ex}")
+            return False
+
+        if entry is None:
+            return False
+        if entry.get("device_info") != { k: str(v) for k, v in self.device_info.items() } or len(entry.get("pages", [])) != self.max_eeprom_pages:
+            self.debug(f"load_cached_eeprom: ignoring stale entry for {serial}")
+            return False
+
+        self.pages = [ bytearray.fromhex(page) for page in entry["pages"] ]
+        self.eeprom = {}
+        self.parse_eeprom_pages()
+        if str(self.eeprom.get("serial_number", "")).lower() not in self.local_name.lower():
+            self.debug(f"load_cached_eeprom: cached serial_number {self.eeprom.get('serial_number')} doesn't match {self.local_name}")
+            return False
+
+        print(f"loaded EEPROM for {serial} from {self.args.eeprom_cache} (saved {entry.get('saved')}; --refresh-eeprom to re-read)")
+        return True
+
+    def save_cached_eeprom(self):
+        serial = self.get_advertised_serial()
+        if not self.args.eeprom_cache or serial is None:
+            return
+
+        try:
+            with open(self.args.eeprom_cache) as infile:
+                cache = json.load(infile)
+        except (OSError, ValueError):
+            cache = {}
+
+        cache[serial] = { "saved":       datetime.now().isoformat(timespec="seconds"),
+                          "device_info": { k: str(v) for k, v in self.device_info.items() },
+                          "pages":       [ page.hex() for page in self.pages ] }
+        try:
+            with open(self.args.eeprom_cache, "w") as outfile:
+                json.dump(cache, outfile, indent=2)
+            self.debug(f"save_cached_eeprom: cached {serial} in {self.args.eeprom_cache}")
+        except OSError as ex:
+            print(f"unable to cache EEPROM in {self.args.eeprom_cache}: {ex}")
+
     def parse_eeprom_pages(self):
         for name, field in self.eeprom_field_loc.items():
             self.unpack_eeprom_field(field.pos, field.data_type, name)
@@ -1454,6 +1717,100 @@ class Generics:
         delta   = abs(actual - expected)
         return delta <= epsilon
 
+class FakeBleakClient:
+    """
+    Minimal stand-in for BleakClient, used by --benchmark.  
+
+    Each write with response takes packet_ms (one connection event).  Writing
+    ACQUIRE generates a synthetic spectrum which, after integration_time_ms, 
+    is replayed as ENG-0120 SPECTRA notifications (big-endian first-pixel 
+    index followed by little-endian uint16 intensities), one every packet_ms, 
+    each carrying as many pixels as fit in the MTU.  last_spectrum holds the 
+    most recent spectrum sent, for comparison.
+
+    GENERIC EEPROM_DATA read requests are answered packet_ms after the write
+    with up to EEPROM_CHUNK bytes of the fake EEPROM from the requested 
+    (page, offset); drop_rate discards that fraction of responses.
+    """
+    EEPROM_CHUNK = 16
+
+    def __init__(self, uuid_by_name, pixels, integration_time_ms=100, packet_ms=7.5, mtu=247, drop_rate=0, seed=0):
+        self.address = "FA:KE:00:00:00:00"
+        self.mtu_size = mtu
+        self.is_connected = True
+        self.services = []
+
+        self.uuid_by_name = { name: uuid.lower() for name, uuid in uuid_by_name.items() }
+        self.pixels = pixels
+        self.integration_time_ms = integration_time_ms
+        self.packet_ms = packet_ms
+        self.pixels_per_packet = (mtu - 3 - 2) // 2 # ATT header, first_pixel
+        self.drop_rate = drop_rate
+        self.rng = np.random.default_rng(seed)
+
+        self.callbacks = {}
+        self.tasks = set()
+        self.write_lock = asyncio.Lock()
+        self.frame = 0
+        self.last_spectrum = None
+
+        x = np.arange(pixels)
+        self.template = 1000 + 3000 * np.exp(-0.5 * ((x - pixels * 0.4) / 10) ** 2)
+        self.eeprom = [ self.rng.integers(0, 256, 64, dtype=np.uint8).tobytes() for page in range(9) ]
+
+    async def start_notify(self, uuid, callback):
+        self.callbacks[uuid.lower()] = callback
+
+    async def stop_notify(self, uuid):
+        self.callbacks.pop(uuid.lower(), None)
+
+    async def write_gatt_char(self, uuid, data, response=False):
+        if response:
+            async with self.write_lock: # one ATT request at a time
+                await asyncio.sleep(self.packet_ms / 1000.0)
+
+        uuid = uuid.lower()
+        if uuid == self.uuid_by_name["ACQUIRE"]:
+            self.spawn(self.replay(self.generate_packets()))
+        elif uuid == self.uuid_by_name["GENERIC"]:
+            # [ seq, 0xff, EEPROM_DATA getter 0x01, page MSB, page LSB, offset ]
+            if len(data) == 6 and data[1] == 0xff and data[2] == 0x01:
+                seq, page, offset = data[0], data[4], data[5]
+                payload = self.eeprom[page][offset : offset + self.EEPROM_CHUNK] if page < len(self.eeprom) else b""
+                if not (self.drop_rate and self.rng.random() < self.drop_rate):
+                    self.spawn(self.notify("GENERIC", [ bytearray([seq, 0]) + payload ], delay_ms=self.packet_ms))
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def generate_packets(self):
+        self.frame += 1
+        spectrum = self.template.astype("<u2")
+        spectrum[0] = self.frame & 0xffff
+        self.last_spectrum = spectrum.tolist()
+
+        packets = []
+        for first_pixel in range(0, self.pixels, self.pixels_per_packet):
+            chunk = spectrum[first_pixel : first_pixel + self.pixels_per_packet]
+            packets.append(bytearray(struct.pack(">H", first_pixel) + chunk.tobytes()))
+        return packets
+
+    async def replay(self, packets):
+        await asyncio.sleep(self.integration_time_ms / 1000.0)
+        await self.notify("SPECTRA", packets, delay_ms=self.packet_ms)
+
+    async def notify(self, name, packets, delay_ms=0):
+        uuid = self.uuid_by_name[name]
+        for packet in packets:
+            await asyncio.sleep(delay_ms / 1000.0)
+            callback = self.callbacks.get(uuid)
+            if callback:
+                result = callback(uuid, packet)
+                if asyncio.iscoroutine(result):
+                    await result
+
 ################################################################################
 # Main
 ################################################################################
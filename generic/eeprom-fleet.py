@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+################################################################################
+#                               eeprom-fleet.py                                #
+################################################################################
+#                                                                              #
+#  Batch analysis of EEPROM dumps collected across the fleet.                  #
+#                                                                              #
+#  Loads every eeprom-util.py --save-file JSON, eeprom-util.py text output     #
+#  and ENLIGHTEN logfile under the given directories (in parallel worker       #
+#  processes), then decodes all of them at once into a columnar NumPy table    #
+#  with one column per EEPROMFields.EEPROM_FIELDS entry.  Because every field  #
+#  sits at a fixed page/offset, each column is a single strided view over the  #
+#  stacked page images rather than a per-dump parse.                           #
+#                                                                              #
+#  Examples:                                                                   #
+#                                                                              #
+#   $ eeprom-fleet.py dumps/ --describe wavecal_c0,wavecal_c1 --group-by model #
+#   $ eeprom-fleet.py dumps/ --where "model~^WP-785" --feature-mask            #
+#   $ eeprom-fleet.py dumps/ --histogram excitation_nm_float --bins 20         #
+#   $ eeprom-fleet.py dumps/ --csv fleet.csv --npz fleet.npz                   #
+#   $ eeprom-fleet.py /tmp/synth --synthesize 10000   (benchmark data)         #
+#                                                                              #
+################################################################################
+
+import os
+import re
+import sys
+import random
+import argparse
+import array
+import numpy as np
+
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+import EEPROMFields
+
+MAX_PAGES = 9
+PAGE_SIZE = EEPROMFields.PAGE_SIZE
+EXTENSIONS = [".json", ".txt", ".log"]
+
+# struct format -> NumPy dtype (native byte order, as EEPROMFields.unpack)
+DTYPES = { "b": "=i1", "B": "=u1", "h": "=i2", "H": "=u2", "i": "=i4", "I": "=u4", "f": "=f4" }
+
+# field name, then the first operator after it (so values may contain "<", "=" etc)
+QUERY_PATTERN = re.compile(r"^\s*(\w+)\s*(==|!=|>=|<=|>|<|~|=)\s*(.*?)\s*$")
+
+def load_dumps(filenames):
+    """
+    Worker entry point: load a batch of dump files, returning
+    (filename, index, raw pages) for each image found, or (filename, None, error).
+    Pages are returned as one bytes object to keep the IPC payload small.
+    """
+    results = []
+    for filename in filenames:
+        try:
+            images = EEPROMFields.load_eeprom_dump(filename)
+        except Exception as ex:
+            results.append((filename, None, str(ex)))
+            continue
+        for index, pages in enumerate(images):
+            results.append((filename, index, b"".join(bytes(page) for page in pages[:MAX_PAGES])))
+    return results
+
+class FleetTable:
+    """
+    Columnar table of decoded EEPROMs.  columns maps field name -> NumPy array
+    of length rows; strings are unicode arrays, booleans bool, "*" fields are
+    (rows, length) uint8.  Fields on pages a given dump lacks are zero/empty,
+    and masked out by valid(name).
+    """
+    def __init__(self, images, page_count, filenames, indices):
+        self.images      = images       # (rows, MAX_PAGES, PAGE_SIZE) uint8
+        self.page_count  = page_count   # (rows,)
+        self.filenames   = filenames    # (rows,) str
+        self.indices     = indices      # (rows,) image index within file
+        self.fields      = EEPROMFields.get_eeprom_fields()
+        self.columns     = self.decode()
+
+    @property
+    def rows(self):
+        return len(self.page_count)
+
+    def decode(self):
+        columns = {}
+        for name, field in self.fields.items():
+            raw = np.ascontiguousarray(self.images[:, field.page, field.offset : field.offset + field.length])
+            if field.data_type == "s":
+                # stop at the first NULL, as EEPROMFields.unpack: blank everything 
+                # after it, and numpy drops the trailing NULLs itself
+                raw[np.logical_or.accumulate(raw == 0, axis=1)] = 0
+                col = np.char.decode(raw.view(f"S{field.length}").ravel(), "latin-1")
+            elif field.data_type == "*":
+                col = raw
+            elif field.data_type == "?":
+                col = raw[:, 0] != 0
+            else:
+                col = raw.view(DTYPES[field.data_type]).ravel()
+            columns[name] = col
+        return columns
+
+    def valid(self, name):
+        """ rows which actually contain the page holding this field """
+        return self.page_count > self.fields[name].page
+
+    def select(self, mask):
+        return FleetTable(self.images[mask], self.page_count[mask], self.filenames[mask], self.indices[mask])
+
+    def row(self, i):
+        """ one row as a dict, in the same form as EEPROMFields.parse_eeprom_pages """
+        result = {}
+        for name, col in self.columns.items():
+            if not self.valid(name)[i]:
+                result[name] = None
+            elif col.ndim == 2:
+                result[name] = col[i].tolist()
+            else:
+                result[name] = col[i].item()
+        return result
+
+    def pages(self, i):
+        return [ bytearray(self.images[i, page]) for page in range(self.page_count[i]) ]
+
+    def group_by(self, name):
+        """ @returns list of (label, boolean row mask) """
+        if name is None:
+            return [ ("all", np.ones(self.rows, dtype=bool)) ]
+        col = self.columns[name]
+        if col.ndim != 1:
+            raise ValueError(f"can't group by {name}")
+        keys, inverse = np.unique(col, return_inverse=True)
+        return [ (str(key), inverse == i) for i, key in enumerate(keys) ]
+
+class Fixture:
+    def __init__(self):
+        parser = argparse.ArgumentParser(description="batch analysis of fleet EEPROM dumps",
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        parser.add_argument("paths",            nargs="+",              help="directories (searched recursively) or dump files")
+        parser.add_argument("--workers",        type=int,               help="loader processes (default: CPU count)")
+        parser.add_argument("--batch",          type=int, default=256,  help="files per worker task")
+        parser.add_argument("--where",          action="append",        help="filter rows, e.g. model~^WP-785, format>=10, has_laser==1 (repeatable)")
+        parser.add_argument("--group-by",       type=str,               help="field to group statistics by (e.g. model)")
+        parser.add_argument("--describe",       type=str,               help="comma-delimited numeric fields to summarize")
+        parser.add_argument("--histogram",      type=str,               help="numeric field to histogram")
+        parser.add_argument("--bins",           type=int, default=10,   help="histogram bins")
+        parser.add_argument("--feature-mask",   action="store_true",    help="count feature_mask and feature_mask_xs bits")
+        parser.add_argument("--count",          type=str,               help="count distinct values of a field")
+        parser.add_argument("--columns",        type=str,               help="comma-delimited fields to export (default all)")
+        parser.add_argument("--csv",            type=str,               help="export table to CSV")
+        parser.add_argument("--npz",            type=str,               help="export table to NumPy .npz")
+        parser.add_argument("--verify",         type=int, default=0,    help="check this many rows against EEPROMFields.parse_eeprom_pages")
+        parser.add_argument("--synthesize",     type=int,               help="write this many synthetic dumps into the first path and exit")
+        parser.add_argument("--seed",           type=int, default=0,    help="random seed for --synthesize")
+        self.args = parser.parse_args()
+
+        self.fields = EEPROMFields.get_eeprom_fields()
+
+    def run(self):
+        if self.args.synthesize:
+            return self.synthesize(self.args.paths[0], self.args.synthesize)
+
+        table = self.load(self.args.paths)
+        if table is None:
+            return
+
+        for clause in self.args.where or []:
+            mask = self.query(table, clause)
+            table = table.select(mask)
+            print(f"where {clause}: {table.rows} rows")
+
+        if self.args.verify:
+            if not self.verify(table, self.args.verify):
+                sys.exit(1)
+        if self.args.count:
+            self.do_count(table, self.args.count)
+        if self.args.describe:
+            self.do_describe(table, self.args.describe.split(","))
+        if self.args.histogram:
+            self.do_histogram(table, self.args.histogram)
+        if self.args.feature_mask:
+            self.do_feature_mask(table)
+        if self.args.csv:
+            self.export_csv(table, self.args.csv)
+        if self.args.npz:
+            self.export_npz(table, self.args.npz)
+
+    ############################################################################
+    # loading
+    ############################################################################
+
+    def find_files(self, paths):
+        filenames = []
+        for path in paths:
+            if os.path.isfile(path):
+                filenames.append(path)
+                continue
+            for root, dirs, files in os.walk(path):
+                for name in files:
+                    if os.path.splitext(name)[1].lower() in EXTENSIONS:
+                        filenames.append(os.path.join(root, name))
+        return sorted(filenames)
+
+    def load(self, paths):
+        start = perf_counter()
+        filenames = self.find_files(paths)
+        if len(filenames) == 0:
+            print("no dump files found")
+            return
+
+        batches = [ filenames[i : i + self.args.batch] for i in range(0, len(filenames), self.args.batch) ]
+        results = []
+        with ProcessPoolExecutor(max_workers=self.args.workers) as executor:
+            for batch in executor.map(load_dumps, batches):
+                results.extend(batch)
+        loaded = perf_counter()
+
+        errors = [ r for r in results if r[1] is None ]
+        results = [ r for r in results if r[1] is not None and len(r[2]) > 0 ]
+        for filename, index, error in errors:
+            print(f"error loading {filename}: {error}")
+
+        rows = len(results)
+        images = np.zeros((rows, MAX_PAGES * PAGE_SIZE), dtype=np.uint8)
+        page_count = np.zeros(rows, dtype=np.int8)
+        for i, (filename, index, data) in enumerate(results):
+            images[i, :len(data)] = np.frombuffer(data, dtype=np.uint8)
+            page_count[i] = len(data) // PAGE_SIZE
+        images = images.reshape(rows, MAX_PAGES, PAGE_SIZE)
+
+        filenames_col = np.array([ r[0] for r in results ])
+        indices = np.array([ r[1] for r in results ], dtype=np.int32)
+        table = FleetTable(images, page_count, filenames_col, indices)
+        decoded = perf_counter()
+
+        print(f"loaded {rows} EEPROMs from {len(filenames)} files ({len(errors)} errors) in {loaded - start:.2f}sec, decoded {len(table.columns)} columns in {1000 * (decoded - loaded):.1f}ms")
+        return table
+
+    def synthesize(self, path, count):
+        """ write count plausible eeprom-util.py --save-file dumps (for benchmarking) """
+        rng = random.Random(self.args.seed)
+        os.makedirs(path, exist_ok=True)
+        base = [ bytearray.fromhex(page) for page in EEPROMFields.RECORDED_PAGES ]
+        models = [ b"WP-785X-ILP", b"WP-638X-FS", b"WP-532X-SR", b"WP-1064-XS" ]
+        start = perf_counter()
+        for i in range(count):
+            pages = [ bytearray(page) for page in base ]
+            pages[0][0:16] = models[i % len(models)].ljust(16, b"\0")
+            pages[0][16:32] = f"WP-{i:05d}".encode().ljust(16, b"\0")
+            pages[0][39:41] = rng.getrandbits(13).to_bytes(2, "little")
+            for j, coeff in enumerate([ 780 + rng.gauss(0, 5), 0.1 + rng.gauss(0, 0.001), rng.gauss(0, 1e-5), rng.gauss(0, 1e-9) ]):
+                pages[1][4*j : 4*j+4] = np.float32(coeff).tobytes()
+            doc = '{\n  "buffers": "%s"\n}\n' % str([ array.array("B", page) for page in pages ])
+            with open(os.path.join(path, f"WP-{i:05d}.json"), "w") as outfile:
+                outfile.write(doc)
+        print(f"wrote {count} dumps to {path} in {perf_counter() - start:.2f}sec")
+
+    ############################################################################
+    # queries
+    ############################################################################
+
+    def query(self, table, clause):
+        m = QUERY_PATTERN.match(clause)
+        if not m:
+            raise ValueError(f"can't parse clause {clause}")
+        name, op, value = m.groups()
+
+        if name not in table.columns:
+            raise ValueError(f"unknown field {name}")
+        col = table.columns[name]
+        valid = table.valid(name)
+
+        if op == "~":
+            pattern = re.compile(value)
+            return valid & np.array([ pattern.search(str(v)) is not None for v in col ], dtype=bool)
+
+        if col.dtype.kind == "U":
+            rhs = value
+        elif col.dtype.kind == "b":
+            rhs = value.lower() in ["1", "true", "yes"]
+        else:
+            rhs = float(value)
+
+        if   op in ["==", "="]: mask = col == rhs
+        elif op == "!=":        mask = col != rhs
+        elif op == ">=":        mask = col >= rhs
+        elif op == "<=":        mask = col <= rhs
+        elif op == ">":         mask = col >  rhs
+        elif op == "<":         mask = col <  rhs
+        return valid & mask
+
+    def numeric(self, table, name, mask):
+        col = table.columns[name]
+        if col.ndim != 1 or col.dtype.kind not in "biuf":
+            raise ValueError(f"{name} is not numeric")
+        values = col[mask & table.valid(name)].astype(np.float64)
+        return values[np.isfinite(values)]
+
+    def do_count(self, table, name):
+        col = table.columns[name]
+        values, counts = np.unique(col[table.valid(name)], return_counts=True)
+        print(f"\n{name}: {len(values)} distinct values")
+        for i in np.argsort(-counts, kind="stable"):
+            print(f"  {counts[i]:8d}  {values[i]}")
+
+    def do_describe(self, table, names):
+        percentiles = [5, 50, 95]
+        for name in names:
+            print(f"\n{name}:")
+            print(f"  {'group':20s} {'count':>7s} {'mean':>14s} {'stdev':>12s} {'min':>14s} " +
+                  " ".join(f"{'p%d' % p:>14s}" for p in percentiles) + f" {'max':>14s}")
+            for label, mask in table.group_by(self.args.group_by):
+                values = self.numeric(table, name, mask)
+                if len(values) == 0:
+                    print(f"  {label:20s} {0:7d}")
+                    continue
+                pct = np.percentile(values, percentiles)
+                print(f"  {label:20s} {len(values):7d} {values.mean():14.6g} {values.std():12.4g} {values.min():14.6g} " +
+                      " ".join(f"{v:14.6g}" for v in pct) + f" {values.max():14.6g}")
+
+    def do_histogram(self, table, name):
+        values = self.numeric(table, name, np.ones(table.rows, dtype=bool))
+        if len(values) == 0:
+            print(f"\n{name}: no values")
+            return
+        counts, edges = np.histogram(values, bins=self.args.bins)
+        width = 50
+        print(f"\n{name}: {len(values)} values")
+        for i in range(len(counts)):
+            bar = "#" * int(round(width * counts[i] / max(counts.max(), 1)))
+            print(f"  [{edges[i]:12.6g}, {edges[i+1]:12.6g}) {counts[i]:7d} {bar}")
+
+    def do_feature_mask(self, table):
+        for name, flags in [ ("feature_mask",    EEPROMFields.FEATURE_MASK_FLAGS),
+                             ("feature_mask_xs", EEPROMFields.FEATURE_MASK_XS_FLAGS) ]:
+            col = table.columns[name].astype(np.uint32)
+            groups = table.group_by(self.args.group_by)
+            print(f"\n{name}:")
+            print(f"  {'flag':32s} " + " ".join(f"{label[:14]:>14s}" for label, mask in groups))
+            totals = [ (mask & table.valid(name)).sum() for label, mask in groups ]
+            print(f"  {'(rows)':32s} " + " ".join(f"{total:14d}" for total in totals))
+            for bit, flag in flags:
+                on = (col & bit) != 0
+                counts = [ (on & mask & table.valid(name)).sum() for label, mask in groups ]
+                print(f"  {flag:32s} " + " ".join(f"{count:14d}" for count in counts))
+
+    ############################################################################
+    # exports
+    ############################################################################
+
+    def export_names(self, table):
+        if self.args.columns:
+            return self.args.columns.split(",")
+        return list(table.columns.keys())
+
+    def export_csv(self, table, filename):
+        names = self.export_names(table)
+        cells = []
+        for name in names:
+            col = table.columns[name]
+            if col.ndim == 2:
+                col = np.array([ row.tobytes().hex() for row in col ])
+            elif col.dtype.kind == "U":
+                col = np.char.replace(col, '"', '""')
+                col = np.char.add(np.char.add('"', col), '"')
+            else:
+                col = col.astype(str)
+            cells.append(np.where(table.valid(name), col, ""))
+
+        with open(filename, "w") as outfile:
+            outfile.write("filename,image," + ",".join(names) + "\n")
+            for i in range(table.rows):
+                outfile.write(f"{table.filenames[i]},{table.indices[i]}," + ",".join(c[i] for c in cells) + "\n")
+        print(f"wrote {table.rows} rows to {filename}")
+
+    def export_npz(self, table, filename):
+        names = self.export_names(table)
+        arrays = { name: table.columns[name] for name in names }
+        arrays["_filename"] = table.filenames
+        arrays["_image"] = table.indices
+        arrays["_page_count"] = table.page_count
+        np.savez_compressed(filename, **arrays)
+        print(f"wrote {table.rows} rows to {filename}")
+
+    ############################################################################
+    # verification
+    ############################################################################
+
+    def verify(self, table, count):
+        """ compare decoded rows with EEPROMFields.parse_eeprom_pages """
+        failures = 0
+        for i in range(min(count, table.rows)):
+            expected = EEPROMFields.parse_eeprom_pages(table.pages(i))
+            actual = table.row(i)
+            for name in expected:
+                if repr(expected[name]) != repr(actual[name]):
+                    print(f"MISMATCH {table.filenames[i]}[{table.indices[i]}] {name}: {expected[name]!r} != {actual[name]!r}")
+                    failures += 1
+        print(f"verified {min(count, table.rows)} rows: {failures} mismatches")
+        return failures == 0
+
+if __name__ == "__main__":
+    fixture = Fixture()
+    fixture.run()
@@ -11,6 +11,8 @@ import argparse
 import struct
 import sys
 
+from DualEndpoint import DualEndpointReader
+
 HOST_TO_DEVICE = 0x40
 DEVICE_TO_HOST = 0xC0
 TIMEOUT_MS = 5000
@@ -22,6 +24,7 @@ PAGE_SIZE = 64
 class Fixture(object):
     def __init__(self):
         self.dev = None
+        self.dual_endpoint_reader = None
 
         parser = argparse.ArgumentParser(
             description="Command-line utility to play with lasers (INHERENTLY DANGEROUS!)",
@@ -42,6 +45,8 @@ class Fixture(object):
         parser.add_argument("--pixels",                 type=int)
         parser.add_argument("--gain",                   type=float, default=8.0)
         parser.add_argument("--integration-time-ms",    type=int, default=100)
+        parser.add_argument("--concurrent-endpoints",   action="store_true", help="read 2048-pixel endpoints 0x82 and 0x86 at the same time (experimental; default is one after the other)")
+        parser.add_argument("--endpoint-sleep-ms",      type=int, default=0, help="unless --concurrent-endpoints, sleep between endpoints (ms) (default 0)")
 
         self.args = parser.parse_args()
 
@@ -157,8 +162,10 @@ class Fixture(object):
             if self.args.pixels == 1024:
                 data = self.dev.read(0x82, self.args.pixels * 2, TIMEOUT_MS)
             elif self.args.pixels == 2048:
-                data = self.dev.read(0x82, self.args.pixels )
-                data.extend(self.dev.read(0x86, self.args.pixels, TIMEOUT_MS))
+                if self.dual_endpoint_reader is None:
+                    self.dual_endpoint_reader = DualEndpointReader(self.dev, self.args.pixels,
+                        concurrent=self.args.concurrent_endpoints, sleep_ms=self.args.endpoint_sleep_ms)
+                return self.dual_endpoint_reader.read(TIMEOUT_MS).tolist()
             else:
                 raise Exception("invalid pixels {self.args.pixels}")
 
@@ -1,17 +1,39 @@
 import os
 import re
 import sys
+import json
 import struct
 import usb.core
+import usb.util
 import argparse
-from time import sleep
+from time import sleep, perf_counter_ns
 from datetime import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
+
+import EEPROMFields
+import USBTrace
+import Wavecal
 
 HOST_TO_DEVICE = 0x40
 DEVICE_TO_HOST = 0xC0
 TIMEOUT_MS     = 1000 
 
+# per-spectrum phases timed by get_spectrum (each a duration, in ns)
+#   trigger:    sending the ACQUIRE control transfer(s)
+#   first_byte: ACQUIRE sent (or start of read, if pipelined) until the first 
+#               bulk read returns (includes integration)
+#   read:       first read until the full spectrum has been read
+#
+# By default the spectrum is read in one bulk read, as in earlier versions, so
+# first_byte includes the transfer and read only covers any short-read retries.
+# --split-first-packet reads one wMaxPacketSize packet first to time the first
+# byte on its own, at the cost of an extra USB read per spectrum (so its read
+# and total times are not comparable with runs made without it).
+#   demarshal:  converting bytes to pixel intensities
+#   total:      all of the above
+PHASES = [ "trigger", "first_byte", "read", "demarshal", "total" ]
+PERCENTILES = [ 50, 90, 99 ]
+
 @dataclass
 class Result:
     integration_time_ms: int
@@ -22,6 +44,10 @@ class Result:
     integration_total_sec: float
     comms_total_sec: float
     comms_average_ms: float
+    delay_ms: int = 0
+    phases: dict = None         # phase -> { "p50", "p90", "p99", "max", "mean" } in ms
+    pipelined: bool = False
+    duplicates: int = 0         # consecutive spectra with identical sums
 
 class Fixture(object):
 
@@ -39,8 +65,44 @@ class Fixture(object):
         parser.add_argument("--outfile",             type=str,            help="CSV filename")
         parser.add_argument("--profile-ms",          type=str,            help="list of of integration times (e.g. 2000,1000,500,250,100,50,10,5,1)")
         parser.add_argument("--delay-step-ms",       type=int,            help="if provided, insert pre-trigger delay ranging from 0ms to integration time in 'step' ms increments", default=0)
+        parser.add_argument("--refresh-eeprom",      action="store_true", help="read all EEPROM pages rather than using the on-disk cache")
+        parser.add_argument("--pipeline",            action="store_true", help="also measure with each ACQUIRE sent before the previous spectrum is demarshalled")
+        parser.add_argument("--split-first-packet",  action="store_true", help="read the first bulk packet on its own to time first_byte (adds a USB read per spectrum)")
+        parser.add_argument("--json",                type=str,            help="save results, including per-phase latency percentiles, to JSON file")
+        parser.add_argument("--baseline",            type=str,            help="JSON file from an earlier --json run to check for regressions")
+        parser.add_argument("--regression-pct",      type=float,          help="flag phases whose p50/p90 grew by more than this percentage vs baseline", default=10)
+        parser.add_argument("--regression-min-ms",   type=float,          help="ignore regressions smaller than this many ms", default=0.5)
+        parser.add_argument("--record",              type=str,            help="record all USB transfers to this trace file")
+        parser.add_argument("--replay",              type=str,            help="replay a --record trace file instead of using USB hardware")
+        parser.add_argument("--replay-realtime",     action="store_true", help="replay with recorded device latencies (default as fast as possible)")
         self.args = parser.parse_args()
 
+        if self.args.replay:
+            self.device = USBTrace.load_replay_devices(self.args.replay, realtime=self.args.replay_realtime)[0]
+            self.max_packet_size = self.device.max_packet_size
+        elif not self.find_device():
+            return
+
+        if self.args.record:
+            self.device = USBTrace.RecordingDevice(self.device, USBTrace.TraceWriter(self.args.record))
+
+        self.fw_version = self.get_firmware_version()
+        self.fpga_version = self.get_fpga_version()
+        self.read_eeprom()
+        self.results = []
+        self.last_integ = None
+
+        print("connected to %s %s (%d-pixel %s) (%.2f, %.2fnm) (FW %s, FPGA %s)" % (
+            self.model, self.serial_number, 
+            self.pixels, self.detector,
+            self.wavelengths[0], self.wavelengths[-1], 
+            self.fw_version, self.fpga_version))
+
+    ############################################################################
+    # methods
+    ############################################################################
+
+    def find_device(self):
         self.device = None
         for pid in [0x1000, 0x2000, 0x4000]:
             self.debug("looking for PID 0x%04x" % pid)
@@ -57,27 +119,22 @@ class Fixture(object):
                 break
 
         if self.device is None:
-            return
+            return False
 
         if os.name == "posix":
             self.device.set_configuration(1)
             usb.util.claim_interface(self.device, 0)
 
-        self.read_eeprom()
-        self.fw_version = self.get_firmware_version()
-        self.fpga_version = self.get_fpga_version()
-        self.results = []
-        self.last_integ = None
-
-        print("connected to %s %s (%d-pixel %s) (%.2f, %.2fnm) (FW %s, FPGA %s)" % (
-            self.model, self.serial_number, 
-            self.pixels, self.detector,
-            self.wavelengths[0], self.wavelengths[-1], 
-            self.fw_version, self.fpga_version))
-
-    ############################################################################
-    # methods
-    ############################################################################
+        # the first bulk read must be a whole packet to avoid overflow
+        self.max_packet_size = 512
+        try:
+            intf = self.device.get_active_configuration()[(0, 0)]
+            ep = usb.util.find_descriptor(intf, bEndpointAddress=0x82)
+            if ep is not None:
+                self.max_packet_size = ep.wMaxPacketSize
+        except usb.core.USBError:
+            pass
+        return True
 
     def run(self):
         if self.args.profile_ms is not None:
@@ -92,6 +149,16 @@ class Fixture(object):
         if self.args.outfile:
             self.save_csv()
 
+        if self.args.json:
+            self.save_json()
+
+        if self.args.replay:
+            print(self.device.summary())
+
+        if self.args.baseline:
+            if self.compare_baseline():
+                sys.exit(1)
+
     def profile_integration_time(self, ms):
         print(f"Reading {self.args.count} spectra at {ms}ms")
 
@@ -107,68 +174,189 @@ class Fixture(object):
         else:
             delay_values = [ 0 ]
 
+        modes = [ False, True ] if self.args.pipeline else [ False ]
         for delay_ms in delay_values:
-            
-            last_total = 0
-            start = datetime.now()
-            max_elapsed_ms = -1
-            for i in range(self.args.count):
-
-                this_start = datetime.now()
-                if delay_ms > 0:
-                    sleep(delay_ms / 1000.0)
-                spectrum = self.get_spectrum(ms)
-                this_elapsed_ms = (datetime.now() - this_start).total_seconds() * 1000.0
-                max_elapsed_ms = max(max_elapsed_ms, this_elapsed_ms)
-
-                # make sure we're really reading distinct spectra
-                total = sum(spectrum)
-                print(f"{datetime.now()}: spectrum {i+1} (delay {delay_ms}ms, sum {total})")
-
-                if total == last_total:
-                    print("Warning: consecutive spectra summed to %d" % total)
-                last_total = total
-
-            end = datetime.now()
-            max_elapsed_ms = int(round(max_elapsed_ms, 0))
-
-            # record observed time
-            elapsed_sec = (end - start).total_seconds()
-            scan_rate = float(self.args.count) / elapsed_sec
-            measurement_rate = 1000.0 / scan_rate
-
-            # compare vs theoretical time
-            integration_total_sec = self.args.count * ms * 0.001
-            comms_total_sec = elapsed_sec - integration_total_sec
-            comms_average_ms = (comms_total_sec / self.args.count) * 1000.0
-
-            print("")
-            print(f"read {self.args.count} spectra at {ms} ms in {elapsed_sec:.2f} sec\n")
-            print(f"max elapsed             = {max_elapsed_ms} ms")
-            print(f"measurement rate        = {measurement_rate:6.2f} ms/spectrum")
-            print(f"scan rate               = {scan_rate:6.2f} spectra/sec")
-            print(f"cumulative integration  = {integration_total_sec:6.2f} sec")
-            print(f"cumulative latency      = {comms_total_sec:6.2f} sec")
-            print(f"average latency         = {comms_average_ms:6.2f} ms/spectrum")
-
-            r = Result(integration_time_ms  = ms,
-                       elapsed_sec          = elapsed_sec,
-                       max_elapsed_ms       = max_elapsed_ms,
-                       scan_rate            = scan_rate,
-                       measurement_rate     = measurement_rate,
-                       integration_total_sec= integration_total_sec,
-                       comms_total_sec      = comms_total_sec,
-                       comms_average_ms     = comms_average_ms)
-            self.results.append(r)
+            for pipelined in modes:
+                self.measure(ms, delay_ms, pipelined)
+
+            if self.args.pipeline:
+                sync, piped = self.results[-2:]
+                print("")
+                print(f"pipelined scan rate {piped.scan_rate:.2f} vs synchronous {sync.scan_rate:.2f} spectra/sec " +
+                      f"({100.0 * (piped.scan_rate - sync.scan_rate) / sync.scan_rate:+.1f}%), " +
+                      f"{piped.duplicates} duplicate frames")
+
+    def measure(self, ms, delay_ms, pipelined):
+        """ 
+        Read self.args.count spectra and record a Result.  If pipelined, the 
+        ACQUIRE for each spectrum is sent as soon as the previous spectrum's
+        bulk read completes, so demarshalling (and the USB round-trip of the
+        ACQUIRE itself) overlap the next integration.
+        """
+        if pipelined:
+            print(f"\nReading {self.args.count} spectra at {ms}ms (pipelined)")
+
+        last_total = 0
+        duplicates = 0
+        start = datetime.now()
+        max_elapsed_ms = -1
+        phase_ns = { phase: [] for phase in PHASES }
+        for i in range(self.args.count):
+
+            this_start = datetime.now()
+            if delay_ms > 0:
+                sleep(delay_ms / 1000.0)
+
+            # don't leave an orphaned acquisition queued after the last spectrum
+            send_trigger = not pipelined or i == 0
+            trigger_next = pipelined and i + 1 < self.args.count
+            spectrum = self.get_spectrum(ms, send_trigger=send_trigger, trigger_next=trigger_next)
+
+            this_elapsed_ms = (datetime.now() - this_start).total_seconds() * 1000.0
+            max_elapsed_ms = max(max_elapsed_ms, this_elapsed_ms)
+            for phase in PHASES:
+                phase_ns[phase].append(self.last_phases[phase])
+
+            # make sure we're really reading distinct spectra
+            total = sum(spectrum)
+            print(f"{datetime.now()}: spectrum {i+1} (delay {delay_ms}ms, sum {total})")
+
+            if total == last_total:
+                print("Warning: consecutive spectra summed to %d" % total)
+                duplicates += 1
+            last_total = total
+
+        end = datetime.now()
+        max_elapsed_ms = int(round(max_elapsed_ms, 0))
+
+        # record observed time
+        elapsed_sec = (end - start).total_seconds()
+        scan_rate = float(self.args.count) / elapsed_sec
+        measurement_rate = 1000.0 / scan_rate
+
+        # compare vs theoretical time
+        integration_total_sec = self.args.count * ms * 0.001
+        comms_total_sec = elapsed_sec - integration_total_sec
+        comms_average_ms = (comms_total_sec / self.args.count) * 1000.0
+
+        print("")
+        print(f"read {self.args.count} spectra at {ms} ms in {elapsed_sec:.2f} sec{' (pipelined)' if pipelined else ''}\n")
+        print(f"max elapsed             = {max_elapsed_ms} ms")
+        print(f"measurement rate        = {measurement_rate:6.2f} ms/spectrum")
+        print(f"scan rate               = {scan_rate:6.2f} spectra/sec")
+        print(f"cumulative integration  = {integration_total_sec:6.2f} sec")
+        print(f"cumulative latency      = {comms_total_sec:6.2f} sec")
+        print(f"average latency         = {comms_average_ms:6.2f} ms/spectrum")
+
+        phases = { phase: self.summarize_phase(values) for phase, values in phase_ns.items() }
+        self.print_phases(phases)
+
+        r = Result(integration_time_ms  = ms,
+                   elapsed_sec          = elapsed_sec,
+                   max_elapsed_ms       = max_elapsed_ms,
+                   scan_rate            = scan_rate,
+                   measurement_rate     = measurement_rate,
+                   integration_total_sec= integration_total_sec,
+                   comms_total_sec      = comms_total_sec,
+                   comms_average_ms     = comms_average_ms,
+                   delay_ms             = delay_ms,
+                   phases               = phases,
+                   pipelined            = pipelined,
+                   duplicates           = duplicates)
+        self.results.append(r)
+
+    def summarize_phase(self, values_ns):
+        """ nearest-rank percentiles of a list of ns durations, reported in ms """
+        ordered = sorted(values_ns)
+        n = len(ordered)
+        summary = {}
+        for pct in PERCENTILES:
+            rank = max(1, -(-pct * n // 100)) # ceil
+            summary[f"p{pct}"] = ordered[rank - 1] / 1e6
+        summary["max"] = ordered[-1] / 1e6
+        summary["mean"] = sum(ordered) / n / 1e6
+        return summary
+
+    def print_phases(self, phases):
+        print("")
+        print("phase (ms)        " + "".join([f"{'p' + str(pct):>10s}" for pct in PERCENTILES]) + f"{'max':>10s}{'mean':>10s}")
+        for phase, summary in phases.items():
+            print(f"{phase:18s}" + "".join([f"{summary['p' + str(pct)]:10.3f}" for pct in PERCENTILES]) + f"{summary['max']:10.3f}{summary['mean']:10.3f}")
+
+    def save_json(self):
+        doc = { "timestamp":     str(datetime.now()),
+                "model":         self.model,
+                "serial_number": self.serial_number,
+                "pixels":        self.pixels,
+                "fw_version":    self.fw_version,
+                "fpga_version":  self.fpga_version,
+                "count":         self.args.count,
+                "split_first_packet": self.args.split_first_packet,
+                "results":       [ asdict(r) for r in self.results ] }
+        with open(self.args.json, "w") as outfile:
+            json.dump(doc, outfile, indent=2)
+        print(f"saved {self.args.json}")
+
+    def compare_baseline(self):
+        """ 
+        Compare per-phase p50/p90 and scan rate against an earlier --json run.
+        Returns True if any regression exceeded the configured thresholds.
+        """
+        with open(self.args.baseline) as infile:
+            baseline = json.load(infile)
+
+        base_by_key = { (r["integration_time_ms"], r.get("delay_ms", 0), r.get("pipelined", False)): r for r in baseline["results"] }
+        pct = self.args.regression_pct
+        min_ms = self.args.regression_min_ms
+
+        print("")
+        print(f"comparing against baseline {self.args.baseline} ({baseline['model']} {baseline['serial_number']}, {baseline['timestamp']})")
+        if baseline.get("split_first_packet", False) != self.args.split_first_packet:
+            print("  WARNING: baseline and this run differ in --split-first-packet, so read and total times are not comparable")
+        regressions = 0
+        for r in self.results:
+            label = f"{r.integration_time_ms}ms (delay {r.delay_ms}ms{', pipelined' if r.pipelined else ''})"
+            base = base_by_key.get((r.integration_time_ms, r.delay_ms, r.pipelined), None)
+            if base is None:
+                print(f"  {label}: not in baseline")
+                continue
+
+            base_rate = base["scan_rate"]
+            if r.scan_rate < base_rate * (1 - pct / 100.0):
+                print(f"  REGRESSION {label}: scan rate {r.scan_rate:.2f} vs {base_rate:.2f} spectra/sec")
+                regressions += 1
+
+            for phase in PHASES:
+                if phase not in base["phases"]:
+                    continue
+                for stat in [ "p50", "p90" ]:
+                    old = base["phases"][phase][stat]
+                    new = r.phases[phase][stat]
+                    if new > old * (1 + pct / 100.0) and new - old > min_ms:
+                        print(f"  REGRESSION {label}: {phase} {stat} {new:.3f}ms vs {old:.3f}ms (+{100.0 * (new - old) / old if old else 0:.0f}%)")
+                        regressions += 1
+
+        if regressions:
+            print(f"{regressions} regressions found")
+        else:
+            print(f"no regressions beyond {pct}% / {min_ms}ms")
+        return regressions > 0
 
     def save_csv(self):
         with open(self.args.outfile, "w") as outfile:
-            outfile.write(f"Spectra, Integration Time (ms), Elapsed Sec, Max Elapsed (ms), Measurement Rate (ms/spectrum), Scan Rate (spectra/sec), Cumulative Integration Sec, Cumulative Latency Sec, Average Latency (ms/spectrum)\n")
+            outfile.write(f"Spectra, Integration Time (ms), Elapsed Sec, Max Elapsed (ms), Measurement Rate (ms/spectrum), Scan Rate (spectra/sec), Cumulative Integration Sec, Cumulative Latency Sec, Average Latency (ms/spectrum), Pipelined, Duplicates\n")
             for r in self.results:
-                outfile.write(f"{self.args.count}, {r.integration_time_ms}, {r.elapsed_sec}, {r.max_elapsed_ms}, {r.measurement_rate}, {r.scan_rate}, {r.integration_total_sec}, {r.comms_total_sec}, {r.comms_average_ms}\n")
+                outfile.write(f"{self.args.count}, {r.integration_time_ms}, {r.elapsed_sec}, {r.max_elapsed_ms}, {r.measurement_rate}, {r.scan_rate}, {r.integration_total_sec}, {r.comms_total_sec}, {r.comms_average_ms}, {r.pipelined}, {r.duplicates}\n")
 
     def read_eeprom(self):
-        self.buffers = [self.get_cmd(0xff, 0x01, page) for page in range(8)]
+        read_page = lambda page: self.get_cmd(0xff, 0x01, page)
+        if self.args.replay:
+            self.buffers = [ read_page(page) for page in range(8) ]
+        else:
+            # recordings should replay without anyone's cache
+            refresh = self.args.refresh_eeprom or self.args.record
+            self.buffers, cached = EEPROMFields.read_eeprom_pages_cached(read_page, self.fw_version, refresh=refresh)
+            self.debug(f"EEPROM pages from cache: {cached}")
 
         # parse key fields (extend as needed)
         self.format          = self.unpack((0, 63,  1), "B")
@@ -183,13 +371,7 @@ class Fixture(object):
         if self.format > 7:
             self.wavelength_coeffs[4] = self.unpack((2, 21,  4), "f")
 
-        self.wavelengths = [0] * self.pixels
-        for i in range(self.pixels):
-            self.wavelengths[i] = self.wavelength_coeffs[0] \
-                                + self.wavelength_coeffs[1] * i \
-                                + self.wavelength_coeffs[2] * i * i \
-                                + self.wavelength_coeffs[3] * i * i * i \
-                                + self.wavelength_coeffs[4] * i * i * i * i
+        self.wavelengths = Wavecal.generate_wavelengths(self.wavelength_coeffs, self.pixels)
 
     def get_firmware_version(self):
         result = self.get_cmd(0xc0)
@@ -212,31 +394,58 @@ class Fixture(object):
             return
         self.send_cmd(0xb2, n)
 
-    def get_spectrum(self, ms):
+    def get_spectrum(self, ms, send_trigger=True, trigger_next=False):
+        """
+        @param send_trigger  false if the ACQUIRE was already sent (pipelined)
+        @param trigger_next  send the next ACQUIRE as soon as the bulk read completes
+        """
         timeout_ms = TIMEOUT_MS + ms * 10
         if self.last_integ is not None:
             timeout_ms += self.last_integ * 10
 
         # send trigger
-        self.send_cmd(0xad)
+        t_start = perf_counter_ns()
+        if send_trigger:
+            self.send_cmd(0xad)
+        t_triggered = perf_counter_ns()
 
         bytes_to_read = self.pixels * 2
         data = []
+        t_first = None
         while True:
             try:
-                this_data = self.device.read(0x82, bytes_to_read, timeout=timeout_ms)
+                # optionally read the first packet on its own, to see when data started flowing
+                if t_first is None and self.args.split_first_packet:
+                    size = min(self.max_packet_size, bytes_to_read)
+                else:
+                    size = bytes_to_read - len(data)
+                this_data = self.device.read(0x82, size, timeout=timeout_ms)
+                if t_first is None:
+                    t_first = perf_counter_ns()
                 data.extend(this_data)
                 if len(data) >= bytes_to_read:
                     break
             except usb.core.USBTimeoutError as ex:
                 if not self.args.keep_trying:
                     raise 
+        t_read = perf_counter_ns()
+
+        if trigger_next:
+            self.send_cmd(0xad)
+        t_next = perf_counter_ns()
 
         self.last_integ = ms
 
         spectrum = []
         for i in range(0, len(data), 2):
             spectrum.append(data[i] | (data[i+1] << 8))
+        t_done = perf_counter_ns()
+
+        self.last_phases = { "trigger":    (t_triggered - t_start) + (t_next - t_read),
+                             "first_byte": t_first - t_triggered,
+                             "read":       t_read - t_first,
+                             "demarshal":  t_done - t_next,
+                             "total":      t_done - t_start }
         return spectrum
 
     ############################################################################
@@ -11,11 +11,12 @@ import sys
 import re
 import os
 
-from time import sleep
 from datetime import datetime
 
 import EEPROMFields
 
+from DualEndpoint import DualEndpointReader
+
 if platform.system() == "Darwin":
     from ctypes import *
     from CoreFoundation import *
@@ -42,6 +43,7 @@ class Fixture(object):
         self.subformat = None
 
         self.spectrum_count = 0
+        self.dual_endpoint_reader = None
         self.timeouts = 0
 
         parser = argparse.ArgumentParser()
@@ -53,6 +55,10 @@ class Fixture(object):
         parser.add_argument("--spectra",             type=int,            help="read the given number of spectra", default=10)
         parser.add_argument("--pid",                 type=str,            help="desired PID (default 1000)", default="1000")
         parser.add_argument("--outfile",             type=str,            help="outfile to save full spectra")
+        parser.add_argument("--eeprom-cache",        action="store_true", help="use the on-disk EEPROM cache (reads the FW revision before the EEPROM, unlike Wasatch.NET)")
+        parser.add_argument("--refresh-eeprom",      action="store_true", help="with --eeprom-cache, read all EEPROM pages and update the cache")
+        parser.add_argument("--concurrent-endpoints", action="store_true", help="read 2048-pixel FX2 endpoints 0x82 and 0x86 at the same time (experimental; default is one after the other)")
+        parser.add_argument("--endpoint-sleep-ms",   type=int,            help="unless --concurrent-endpoints, sleep between endpoints", default=5)
         self.args = parser.parse_args()
 
         self.pid = int(self.args.pid, 16)
@@ -191,7 +197,15 @@ class Fixture(object):
     ############################################################################
 
     def read_eeprom(self):
-        self.buffers = [self.get_cmd(0xff, 0x01, page) for page in range(8)]
+        if not self.args.eeprom_cache:
+            self.buffers = [self.get_cmd(0xff, 0x01, page) for page in range(8)]
+        else:
+            # Wasatch.NET reads the EEPROM before the FW revision, but the cache is keyed on it
+            fw_rev = self.get_firmware_version()
+            self.buffers, cached = EEPROMFields.read_eeprom_pages_cached(
+                lambda page: self.get_cmd(0xff, 0x01, page), fw_rev, refresh=self.args.refresh_eeprom)
+            if cached:
+                print("EEPROM pages 1-7 taken from cache (--refresh-eeprom to re-read)")
 
         self.eeprom = EEPROMFields.parse_eeprom_pages(self.buffers)
         # self.eeprom["format"]        = self.unpack((0, 63,  1), "B")
@@ -316,11 +330,11 @@ class Fixture(object):
         self.debug(f"using timeout_ms {timeout_ms}")
         self.send_cmd(0xad, 0)
 
-        endpoints = [0x82]
-        block_len_bytes = self.pixels * 2
-        if self.pixels == 2048 and self.pid != 0x4000: # ARM doesn't need this
-            endpoints = [0x82, 0x86]
-            block_len_bytes = 2048 # 1024 pixels apiece from two endpoints
+        # 2048-pixel FX2s return 1024 pixels apiece from two endpoints (ARM doesn't need this)
+        dual_endpoint = self.pixels == 2048 and self.pid != 0x4000
+        if dual_endpoint and self.dual_endpoint_reader is None:
+            self.dual_endpoint_reader = DualEndpointReader(self.device, self.pixels,
+                concurrent=self.args.concurrent_endpoints, sleep_ms=self.args.endpoint_sleep_ms)
 
         if self.pid == 0x4000:
             # assume all ARMs are IMX (this isn't actually true)
@@ -333,19 +347,16 @@ class Fixture(object):
 
         spectrum = []
         try:
-            for endpoint in endpoints:
-                self.debug(f"waiting for {block_len_bytes} bytes from endpoint 0x{endpoint:02x} (timeout {timeout_ms}ms)")
-                data = self.device.read(endpoint, block_len_bytes, timeout=timeout_ms)
+            if dual_endpoint:
+                self.debug(f"waiting for {self.pixels} pixels from endpoints 0x82 and 0x86 (timeout {timeout_ms}ms)")
+                spectrum = self.dual_endpoint_reader.read(timeout_ms).tolist()
+                print(f"read {len(spectrum) * 2} bytes")
+            else:
+                block_len_bytes = self.pixels * 2
+                self.debug(f"waiting for {block_len_bytes} bytes from endpoint 0x82 (timeout {timeout_ms}ms)")
+                data = self.device.read(0x82, block_len_bytes, timeout=timeout_ms)
                 print(f"read {len(data)} bytes")
-
-                subspectrum = [int(i | (j << 8)) for i, j in zip(data[::2], data[1::2])] # LSB-MSB
-                spectrum.extend(subspectrum)
-
-                # empirically determined need for 5ms delay when switching endpoints
-                # on 2048px detectors during area scan
-                if self.pixels == 2048 and self.pid != 0x4000: 
-                    print("sleeping 5ms between endpoints")
-                    sleep(0.005)
+                spectrum = [int(i | (j << 8)) for i, j in zip(data[::2], data[1::2])] # LSB-MSB
         except usb.core.USBError as ute:
             self.timeouts += 1
             print(f"ignoring usb.core.USBError number {self.timeouts}")
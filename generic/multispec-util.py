@@ -4,21 +4,27 @@
 # make certain things very easy and debuggable from the command-line
 
 import platform
+import array
 import math
 import sys
 import re
 import os
-from time import sleep
+from time import sleep, perf_counter
 from datetime import datetime
 import matplotlib.pyplot as plt
 import numpy as np
 
 import traceback
+import threading
 import usb.core
 import argparse
 import struct
 
-from EEPROMFields import parse_eeprom_pages
+from concurrent.futures import ThreadPoolExecutor
+
+from EEPROMFields import parse_eeprom_pages, read_eeprom_pages_cached
+from SpectrumStats import SpectrumStats
+import USBTrace
 
 if platform.system() == "Darwin":
     import usb.backend.libusb1 as backend
@@ -46,14 +52,26 @@ class Fixture(object):
         self.args = self.parse_args()
 
         self.devices = []
-        for pid in [0x1000, 0x2000, 0x4000]:
-            if self.args.pid is not None:
-                if pid != int(self.args.pid, 16):
-                    continue
-            self.devices.extend(usb.core.find(find_all=True, idVendor=0x24aa, idProduct=pid, backend=backend.get_backend()))
+        if self.args.benchmark_demarshal:
+            return
 
-        for dev in self.devices:
-            self.connect(dev)
+        if self.args.replay:
+            self.devices = USBTrace.load_replay_devices(self.args.replay, realtime=self.args.replay_realtime)
+        elif self.args.simulate:
+            self.devices = [ SimulatedSpectrometer(i, self.args.pixels) for i in range(self.args.simulate) ]
+        else:
+            for pid in [0x1000, 0x2000, 0x4000]:
+                if self.args.pid is not None:
+                    if pid != int(self.args.pid, 16):
+                        continue
+                self.devices.extend(usb.core.find(find_all=True, idVendor=0x24aa, idProduct=pid, backend=backend.get_backend()))
+
+            for dev in self.devices:
+                self.connect(dev)
+
+        if self.args.record:
+            writer = USBTrace.TraceWriter(self.args.record)
+            self.devices = [ USBTrace.RecordingDevice(dev, writer) for dev in self.devices ]
 
         # read settings for each unit
         for dev in self.devices:
@@ -96,6 +114,11 @@ class Fixture(object):
         group.add_argument("--pixels",              type=int,            help="override pixel count")
         group.add_argument("--set-dfu",             action="store_true", help="set matching spectrometers to DFU mode")
         group.add_argument("--keep-trying",         action="store_true", help="ignore timeouts")
+        group.add_argument("--simulate",            type=int,            help="use n simulated spectrometers instead of USB hardware")
+        group.add_argument("--refresh-eeprom",      action="store_true", help="read all EEPROM pages rather than using the on-disk cache")
+        group.add_argument("--record",              type=str,            help="record all USB transfers to this trace file")
+        group.add_argument("--replay",              type=str,            help="replay a --record trace file instead of using USB hardware")
+        group.add_argument("--replay-realtime",     action="store_true", help="replay with recorded device latencies (default as fast as possible)")
 
         group = parser.add_argument_group("Acquisition Parameters")
         group.add_argument("--integration-time-ms", type=int,            help="integration time (ms)")
@@ -108,6 +131,8 @@ class Fixture(object):
         group.add_argument("--continuous-count",    type=int,            help="how many spectra to read from a single ACQUIRE", default=1)
         group.add_argument("--loop",                type=int,            help="repeat n times", default=1)
         group.add_argument("--inner-loop",          type=int,            help="repeat n times", default=10)
+        group.add_argument("--concurrent",          action="store_true", help="trigger and read all spectrometers in parallel (one thread per device)")
+        group.add_argument("--pipeline",            action="store_true", help="send each ACQUIRE as soon as the previous spectrum is read, before processing it")
 
         group = parser.add_argument_group("Auto-Raman")
         group.add_argument("--auto-raman",          action="store_true", help="use Auto-Raman measurments")
@@ -147,6 +172,7 @@ class Fixture(object):
         group.add_argument("--monitor-battery",     action="store_true", help="monitor XS battery")
         group.add_argument("--charging",            action=argparse.BooleanOptionalAction, help="configure battery charging")
         group.add_argument("--shutdown",            action="store_true", help="turn off spectrometer")
+        group.add_argument("--benchmark-demarshal", type=int,            help="time n canned spectra through list vs NumPy demarshalling (no hardware)")
 
         group = parser.add_argument_group("OEM Accessory Connector")
         group.add_argument("--set-acc-state",       type=str, help="hex uint16 (0x0003 would enable GPIO and ACC_5V_OUT)")
@@ -182,7 +208,16 @@ class Fixture(object):
             self.debug("claimed device")
 
     def read_eeprom(self, dev):
-        dev.buffers = [self.get_cmd(dev, 0xff, 0x01, page) for page in range(self.args.max_pages)]
+        read_page = lambda page: self.get_cmd(dev, 0xff, 0x01, page)
+        if self.args.simulate or self.args.replay:
+            dev.buffers = [read_page(page) for page in range(self.args.max_pages)]
+        else:
+            # the load test needs its reference pages from hardware, and 
+            # recordings should replay without anyone's cache
+            refresh = self.args.refresh_eeprom or self.args.eeprom_load_test or self.args.record
+            dev.buffers, cached = read_eeprom_pages_cached(read_page, dev.fw_version, max_pages=self.args.max_pages, refresh=refresh)
+            if cached:
+                self.debug(f"using cached EEPROM pages 1-{self.args.max_pages - 1}")
         dev.eeprom = parse_eeprom_pages(dev.buffers)
 
         # save each page as hex string
@@ -718,85 +753,205 @@ class Fixture(object):
         if self.args.plot:
             plt.ion()
 
-        spectra = []
+        if self.args.concurrent:
+            self.trigger_barrier = threading.Barrier(len(self.devices))
+            for dev in self.devices:
+                dev.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=dev.eeprom["serial_number"])
+            self.frame_stats = []
+
+        duplicates = 0
+        for dev in self.devices:
+            dev.last_total = None
+            dev.triggered_ahead = False
+            dev.stats = SpectrumStats() # per device, as pixel counts may differ
+
         start_time = datetime.now()
         for i in range(self.args.spectra):
 
             if self.args.laser_trigger_sn:
                 self.pulse_laser_trigger()
 
+            if self.args.concurrent:
+                frame = self.acquire_frame_concurrent(i)
+            else:
+                frame = self.acquire_frame_serial(i)
+
             start = None
-            for dev in self.devices:
-                self.dump_log(dev, f"spectrum {i}")
-
-                for j in range(self.args.continuous_count):
-                    # send a software trigger on the FIRST of a continuous burst, unless hardware triggering enabled
-                    send_trigger = (j == 0) and not self.args.hardware_trigger
-                    acq_type = 3 if self.args.auto_raman else 0
-                    spectrum = self.get_spectrum(dev, send_trigger, acq_type)
-
-                    now = datetime.now()
-                    if not start:
-                        start = now
-                    print("%s Spectrum %3d/%3d/%3d %s ..." % (now, j+1, i+1, self.args.spectra, spectrum[:10]))
-                    spectra.append(spectrum)
-                    if outfile is not None:
-                        outfile.write("%s, %s\n" % (now, ", ".join([str(x) for x in spectrum])))
-
-                    #if self.args.laser_enable:
-                    #    self.get_laser_temperature(dev)
-
-                    if self.args.frame_id:
-                        self.get_frame_count(dev)
-
-                    if self.args.plot:
-                        if not self.args.overlay:
-                            plt.clf()
-                        plt.plot(spectrum)
-                        plt.draw()
-                        plt.pause(0.01)
-
-            if len(self.devices) > 1:
+            for dev, j, spectrum, now in frame:
+                if not start:
+                    start = now
+                print("%s Spectrum %3d/%3d/%3d %s ..." % (now, j+1, i+1, self.args.spectra, spectrum[:10]))
+                try:
+                    dev.stats.add(spectrum)
+                except ValueError as ex:
+                    # statistics are a summary only: never abort acquisition over them
+                    print(f"Warning: not including spectrum in stats for {dev.eeprom['serial_number']}: {ex}")
+
+                # make sure we're really reading distinct spectra
+                total = int(np.sum(spectrum))
+                if total == getattr(dev, "last_total", None):
+                    print(f"Warning: consecutive spectra summed to {total} on {dev.eeprom['serial_number']}")
+                    duplicates += 1
+                dev.last_total = total
+
+                if outfile is not None:
+                    outfile.write("%s, %s\n" % (now, ", ".join([str(x) for x in spectrum])))
+
+                #if self.args.laser_enable:
+                #    self.get_laser_temperature(dev)
+
+                if self.args.frame_id:
+                    self.get_frame_count(dev)
+
+                if self.args.plot:
+                    if not self.args.overlay:
+                        plt.clf()
+                    plt.plot(spectrum)
+                    plt.draw()
+                    plt.pause(0.01)
+
+            if len(self.devices) > 1 and not self.args.concurrent:
                 print(f"All spectra received within {(datetime.now() - start).total_seconds() * 1000:.2f}ms (first to last)")
             self.debug(f"sleeping {self.args.delay_ms}ms")
             sleep(self.args.delay_ms / 1000.0 )
 
-        if len(spectra):
+        if self.args.concurrent:
+            for dev in self.devices:
+                dev.executor.shutdown()
+            self.report_frame_stats()
+
+        if any(dev.stats.count for dev in self.devices):
             elapsed_sec = (datetime.now() - start_time).total_seconds() 
-            stdevs = []
-            for px in range(len(spectra[0])):
-                values = []
-                for t in range(len(spectra)):
-                    values.append(spectra[t][px])
-                stdevs.append(np.std(values))
-            avg_std = sum(stdevs) / len(stdevs)
-            print(f"Mean pixel stdev over {len(spectra)} spectra: {avg_std:.2f}")
+            for dev in self.devices:
+                stats = dev.stats
+                if stats.count:
+                    sn = dev.eeprom["serial_number"]
+                    print(f"{sn}: mean pixel stdev over {stats.count} spectra: {stats.mean_stdev():.2f}")
+                    print(f"{sn}: pixel range over {stats.count} spectra: min {stats.min.min():.0f}, max {stats.max.max():.0f}")
             print(f"Elapsed time: {elapsed_sec:.3f} sec")
+            print(f"Scan rate: {self.args.spectra / elapsed_sec:.2f} frames/sec{' (pipelined)' if self.pipelining() else ''}, {duplicates} duplicate spectra")
 
         if outfile is not None:
             outfile.close()
 
-    def get_spectrum(self, dev, send_trigger=True, acq_type=0):
+    def acquire_frame_serial(self, i):
+        """ 
+        Generates (dev, j, spectrum, timestamp) tuples, triggering and reading
+        each device in turn.
+        """
+        for dev in self.devices:
+            self.dump_log(dev, f"spectrum {i}")
+
+            for j in range(self.args.continuous_count):
+                # send a software trigger on the FIRST of a continuous burst, unless hardware triggering enabled
+                send_trigger = (j == 0) and not self.args.hardware_trigger
+                acq_type = 3 if self.args.auto_raman else 0
+                spectrum = self.get_spectrum(dev, send_trigger, acq_type, trigger_next=self.trigger_next(i))
+                yield (dev, j, spectrum, datetime.now())
+
+    def acquire_frame_concurrent(self, i):
+        """
+        Triggers all devices together, each from its own worker thread, and 
+        returns a list of (dev, j, spectrum, timestamp) tuples once every 
+        device has delivered its spectra for this iteration.
+        """
+        for dev in self.devices:
+            self.dump_log(dev, f"spectrum {i}")
+
+        futures = [ (dev, dev.executor.submit(self.acquire_device, dev, i)) for dev in self.devices ]
+
+        frame = []
+        stats = { "triggered": [], "completed": [], "latency_ms": {} }
+        for dev, future in futures:
+            triggered, results = future.result()
+            stats["triggered"].append(triggered)
+            for j, (spectrum, completed, now) in enumerate(results):
+                frame.append((dev, j, spectrum, now))
+            stats["completed"].append(completed)
+            stats["latency_ms"][dev.eeprom["serial_number"]] = (completed - triggered) * 1000.0
+
+        trigger_skew_ms = (max(stats["triggered"]) - min(stats["triggered"])) * 1000.0
+        skew_ms = (max(stats["completed"]) - min(stats["completed"])) * 1000.0
+        self.frame_stats.append((skew_ms, stats["latency_ms"]))
+
+        print(f"All spectra received within {skew_ms:.2f}ms (first to last), triggers within {trigger_skew_ms:.2f}ms")
+        for sn, ms in stats["latency_ms"].items():
+            print(f"  {sn:16s} latency {ms:8.2f}ms")
+        return frame
+
+    def acquire_device(self, dev, i):
+        """
+        Runs on the device's worker thread.  Waits for every other worker to
+        arrive at the barrier so triggers go out together, then reads the 
+        device's continuous burst.  Returns (trigger_time, [(spectrum, 
+        completed, timestamp)]), with times from perf_counter.
+        """
+        self.trigger_barrier.wait()
+        triggered = perf_counter()
+
+        results = []
+        for j in range(self.args.continuous_count):
+            send_trigger = (j == 0) and not self.args.hardware_trigger
+            acq_type = 3 if self.args.auto_raman else 0
+            spectrum = self.get_spectrum(dev, send_trigger, acq_type, trigger_next=self.trigger_next(i))
+            results.append((spectrum.copy(), perf_counter(), datetime.now()))
+        return (triggered, results)
+
+    def report_frame_stats(self):
+        if not self.frame_stats:
+            return
+
+        skews = [ skew for skew, latencies in self.frame_stats ]
+        print(f"Concurrent acquisition over {len(skews)} frames:")
+        print(f"  first-to-last skew: mean {np.mean(skews):8.2f}ms, max {np.max(skews):8.2f}ms")
+        for dev in self.devices:
+            sn = dev.eeprom["serial_number"]
+            latencies = [ latencies[sn] for skew, latencies in self.frame_stats ]
+            print(f"  {sn:16s} latency: mean {np.mean(latencies):8.2f}ms, max {np.max(latencies):8.2f}ms")
+
+    def pipelining(self):
+        """
+        Pipelining only applies to simple software-triggered acquisitions: 
+        continuous bursts are already queued by the firmware, and Auto-Raman,
+        hardware and laser-pulse triggering each need their own handshake.
+        """
+        return (self.args.pipeline 
+            and self.args.continuous_count == 1
+            and not self.args.hardware_trigger
+            and not self.args.auto_raman
+            and not self.args.laser_trigger_sn)
+
+    def trigger_next(self, i):
+        """ whether to queue the ACQUIRE for iteration i+1 once iteration i is read """
+        return self.pipelining() and i + 1 < self.args.spectra
+
+    def get_spectrum(self, dev, send_trigger=True, acq_type=0, trigger_next=False):
         if send_trigger:
-            spectrum = self.get_spectrum_sw_trigger(dev, acq_type)
+            spectrum = self.get_spectrum_sw_trigger(dev, acq_type, trigger_next)
         else:
             spectrum = self.get_spectrum_hw_trigger(dev)
 
+        return self.process_spectrum(dev, spectrum)
+
+    def process_spectrum(self, dev, spectrum):
         if dev.idProduct == 0x4000:
-            for i in range(4):
-                spectrum[i] = spectrum[4]
+            spectrum[:4] = spectrum[4]
 
         if self.args.bin_2x2:
             # note, this needs updated for 633XS
-            binned = []
-            for i in range(len(spectrum)-1):
-                binned.append((spectrum[i] + spectrum[i+1]) / 2.0)
-            binned.append(spectrum[-1])
+            binned = np.empty(len(spectrum), dtype=np.float64)
+            binned[:-1] = (spectrum[:-1].astype(np.float64) + spectrum[1:]) / 2.0
+            binned[-1] = spectrum[-1]
             spectrum = binned
         
         return spectrum
 
-    def get_spectrum_sw_trigger(self, dev, acq_type=0):
+    def get_spectrum_sw_trigger(self, dev, acq_type=0, trigger_next=False):
+        """
+        @param trigger_next  send the NEXT ACQUIRE as soon as this spectrum has
+                             been read, so the device integrates while we 
+                             process (the following call then won't re-send)
+        """
         sn = dev.eeprom["serial_number"]
         num_dev = len(self.devices)
         if self.args.integration_time_ms:
@@ -807,7 +962,10 @@ class Fixture(object):
         else:
             timeout_ms = TIMEOUT_MS + 100 * 2
 
-        if acq_type == 3:
+        if getattr(dev, "triggered_ahead", False):
+            self.debug(f"{datetime.now()} trigger already sent to {sn}")
+            dev.triggered_ahead = False
+        elif acq_type == 3:
             print(f"{datetime.now()} requesting Auto-Raman measurement...")
             self.test_auto_raman(dev)
         else:
@@ -815,29 +973,28 @@ class Fixture(object):
             self.send_cmd(dev, 0xad, acq_type)
 
         bytes_to_read = dev.pixels * 2
-        block_size = 64
-        block_size = bytes_to_read # testing multi-channel
-        data = []
 
-        print(f"{datetime.now()} trying to read {dev.pixels} pixels ({bytes_to_read} bytes) in chunks of {block_size} bytes with timeout {timeout_ms}ms from {sn}")
+        print(f"{datetime.now()} trying to read {dev.pixels} pixels ({bytes_to_read} bytes) with timeout {timeout_ms}ms from {sn}")
         while True:
             try:
-                self.debug(f"{datetime.now()} have {len(data)}/{bytes_to_read} bytes, reading next {block_size}")
-                this_data = dev.read(0x82, block_size, timeout=timeout_ms)
-                data.extend(this_data)
-                if len(data) >= bytes_to_read:
-                    break
+                spectrum = self.read_spectrum(dev, timeout_ms)
+                break
             except usb.core.USBTimeoutError as ex:
                 if not (self.args.keep_trying or self.args.auto_raman):
                     raise 
 
+        if trigger_next:
+            self.debug(f"{datetime.now()} sending next trigger to {sn} (pipelined)")
+            self.send_cmd(dev, 0xad, acq_type)
+            dev.triggered_ahead = True
+
         if acq_type == 3:
             final_integ_ms = self.get_integration_time_ms(dev)
             final_gain_db  = self.get_detector_gain(dev)
             final_scan_avg = self.get_scans_to_average(dev)
             print(f"Integration Time {final_integ_ms}ms, Gain {final_gain_db}dB, Avg {final_scan_avg} scans")
 
-        return self.demarshal_spectrum(data)
+        return spectrum
 
     def get_spectrum_hw_trigger(self, dev):
         sn = dev.eeprom["serial_number"]
@@ -845,25 +1002,110 @@ class Fixture(object):
         while True:
             try:
                 print(".", end='')
-                data = dev.read(0x82, dev.pixels * 2, timeout=1000) # timeout doesn't really matter, because we're in a loop that ignores timeouts
-                if data is not None:
-                    now = datetime.now()
-                    ms_since_last = (now - self.last_acquire).total_seconds() * 1000.0
-                    self.last_acquire = now
+                spectrum = self.read_spectrum(dev, timeout_ms=1000) # timeout doesn't really matter, because we're in a loop that ignores timeouts
+                now = datetime.now()
+                ms_since_last = (now - self.last_acquire).total_seconds() * 1000.0
+                self.last_acquire = now
 
-                    print(f"received ({ms_since_last:.2f}ms since last)")
-                    return self.demarshal_spectrum(data)
+                print(f"received ({ms_since_last:.2f}ms since last)")
+                return spectrum
 
             except usb.core.USBTimeoutError as ex:
                 pass
 
+    def get_spectrum_buffer(self, dev):
+        """ 
+        Returns the preallocated bulk-read buffer for this device, (re)allocating 
+        it if the pixel count has changed.  pyusb will only read "into" an 
+        array.array, so that's what we allocate.
+        """
+        bytes_to_read = dev.pixels * 2
+        buf = getattr(dev, "spectrum_buffer", None)
+        if buf is None or len(buf) != bytes_to_read:
+            buf = array.array('B', bytes(bytes_to_read))
+            dev.spectrum_buffer = buf
+        return buf
+
+    def read_spectrum(self, dev, timeout_ms):
+        """
+        Reads one spectrum from the bulk endpoint directly into the device's
+        preallocated buffer, and returns it as a little-endian uint16 view.
+
+        Note that the returned array ALIASES dev.spectrum_buffer, so it is only 
+        valid until the next read from the same device; copy() it if you need 
+        to keep it.
+        """
+        buf = self.get_spectrum_buffer(dev)
+        bytes_to_read = len(buf)
+
+        bytes_read = dev.read(0x82, buf, timeout=timeout_ms)
+        if bytes_read < bytes_to_read:
+            # pyusb can only fill an array from the start, so copy any remainder in
+            raw = np.frombuffer(buf, dtype=np.uint8)
+            while bytes_read < bytes_to_read:
+                self.debug(f"{datetime.now()} have {bytes_read}/{bytes_to_read} bytes, reading remainder")
+                this_data = dev.read(0x82, bytes_to_read - bytes_read, timeout=timeout_ms)
+                raw[bytes_read:bytes_read + len(this_data)] = this_data
+                bytes_read += len(this_data)
+
+        return np.frombuffer(buf, dtype="<u2")
+
     def demarshal_spectrum(self, data):
+        """ legacy list-based demarshalling, retained for --benchmark-demarshal """
         spectrum = []
         if data is not None:
             for i in range(0, len(data), 2):
                 spectrum.append(data[i] | (data[i+1] << 8))
         return spectrum
 
+    def benchmark_demarshal(self):
+        """
+        Times the legacy list-based read/demarshal/post-process path against the
+        NumPy path, using canned bulk payloads so no hardware is required.
+        """
+        pixels = self.args.pixels if self.args.pixels else 2048
+        count = self.args.benchmark_demarshal
+        payloads = [ os.urandom(pixels * 2) for i in range(16) ]
+
+        # ARM, so we exercise pixel stomping as well
+        legacy_dev = CannedDevice(0x4000, payloads)
+        dev = CannedDevice(0x4000, payloads)
+        dev.pixels = pixels
+
+        def legacy():
+            data = []
+            data.extend(legacy_dev.read(0x82, pixels * 2))
+            spectrum = self.demarshal_spectrum(data)
+            for i in range(4):
+                spectrum[i] = spectrum[4]
+            if self.args.bin_2x2:
+                binned = []
+                for i in range(len(spectrum)-1):
+                    binned.append((spectrum[i] + spectrum[i+1]) / 2.0)
+                binned.append(spectrum[-1])
+                spectrum = binned
+            return spectrum
+
+        def current():
+            return self.process_spectrum(dev, self.read_spectrum(dev, TIMEOUT_MS))
+
+        # the NumPy path must produce identical values
+        for i in range(len(payloads)):
+            if list(legacy()) != list(current()):
+                print(f"ERROR: NumPy demarshalling differs from list path on payload {i}")
+                return
+
+        print(f"Demarshalling {count} canned {pixels}-pixel spectra{' with 2x2 binning' if self.args.bin_2x2 else ''}")
+        results = {}
+        for label, func in [ ("list", legacy), ("numpy", current) ]:
+            start = perf_counter()
+            for i in range(count):
+                func()
+            elapsed_sec = perf_counter() - start
+            results[label] = elapsed_sec
+            print(f"  {label:6s} {elapsed_sec:8.3f} sec ({1e6 * elapsed_sec / count:9.2f} us/spectrum, {count / elapsed_sec:10.1f} spectra/sec)")
+        print(f"  speedup {results['list'] / results['numpy']:.1f}x")
+
     ############################################################################
     # Firmware Auto-Raman (USB)
     ############################################################################
@@ -955,6 +1197,90 @@ class Fixture(object):
             result = struct.unpack(data_type, buf[start_byte:end_byte])[0]
         return result
 
+# Serves canned bulk payloads through the pyusb read() interface, for 
+# benchmarking host-side processing without a spectrometer.
+class CannedDevice(object):
+    def __init__(self, pid, payloads):
+        self.idProduct = pid
+        self.payloads = payloads
+        self.count = 0
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        payload = self.payloads[self.count % len(self.payloads)]
+        self.count += 1
+        if isinstance(size_or_buffer, array.array):
+            n = min(len(size_or_buffer), len(payload))
+            size_or_buffer[:n] = array.array('B', payload[:n])
+            return n
+        return array.array('B', payload[:size_or_buffer])
+
+# A pyusb-compatible stand-in for an ARM spectrometer, so acquisition logic can
+# be exercised and timed without hardware.  Bulk reads block until the last
+# ACQUIRE plus the current integration time has elapsed, as on a real unit.
+class SimulatedSpectrometer(object):
+    def __init__(self, index, pixels=None):
+        self.idVendor  = 0x24aa
+        self.idProduct = 0x4000
+        self.address   = index + 1
+        self.pixels    = pixels if pixels else 1024
+        self.integration_time_ms = 100
+        self.acquire_time = None
+        self.lock = threading.Lock()
+
+        # minimal format-8 EEPROM
+        self.pages = [ bytearray(PAGE_SIZE) for page in range(8) ]
+        struct.pack_into("16s", self.pages[0],  0, b"WP-SIM")
+        struct.pack_into("16s", self.pages[0], 16, f"SIM{index:05d}".encode())
+        struct.pack_into("B",   self.pages[0], 63, 8)
+        struct.pack_into("4f",  self.pages[1],  0, 780.0, 0.1, 1e-6, 0.0)
+        struct.pack_into("H",   self.pages[2], 16, self.pixels)
+        struct.pack_into("f",   self.pages[3], 36, 785.0)
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+        if bmRequestType == HOST_TO_DEVICE:
+            with self.lock:
+                if bRequest == 0xb2:
+                    self.integration_time_ms = wValue
+                elif bRequest == 0xad:
+                    self.acquire_time = perf_counter()
+            return len(data_or_wLength) if data_or_wLength else 0
+
+        result = bytearray(data_or_wLength)
+        if bRequest == 0xc0:
+            result[:4] = [0, 0, 0, 1]
+        elif bRequest == 0xb4:
+            result[:3] = b"SIM"
+        elif bRequest == 0xbf:
+            struct.pack_into("<I", result, 0, self.integration_time_ms)
+        elif bRequest == 0xff and wValue == 0x01:
+            result[:PAGE_SIZE] = self.pages[wIndex] if wIndex < len(self.pages) else bytes(PAGE_SIZE)
+        return array.array('B', result)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        with self.lock:
+            acquire_time = self.acquire_time
+            self.acquire_time = None
+        if acquire_time is None:
+            sleep(timeout / 1000.0)
+            raise usb.core.USBTimeoutError("simulated timeout")
+
+        remaining = acquire_time + self.integration_time_ms / 1000.0 - perf_counter()
+        if remaining > 0:
+            sleep(remaining)
+
+        spectrum = (np.random.normal(1000, 10, self.pixels)).astype("<u2")
+        payload = array.array('B', spectrum.tobytes())
+        if isinstance(size_or_buffer, array.array):
+            n = min(len(size_or_buffer), len(payload))
+            size_or_buffer[:n] = payload[:n]
+            return n
+        return payload[:size_or_buffer]
+
 fixture = Fixture()
-if len(fixture.devices) > 0:
+if fixture.args.benchmark_demarshal:
+    fixture.benchmark_demarshal()
+elif len(fixture.devices) > 0:
     fixture.run()
+    if fixture.args.replay:
+        for dev in fixture.devices:
+            print(f"{dev.eeprom['serial_number']}: {dev.summary()}")
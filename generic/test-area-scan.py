@@ -4,10 +4,16 @@ import os
 import sys
 import png
 import time
+import array
+import queue
 import random
 import usb.core
 import argparse
 import datetime
+import threading
+import numpy as np
+
+from time import perf_counter
 
 HOST_TO_DEVICE = 0x40
 DEVICE_TO_HOST = 0xC0
@@ -30,7 +36,15 @@ def process_cmd_args():
     parser.add_argument("--start-line",          type=int,            help="vertical binning start line", default=0)
     parser.add_argument("--stop-line",           type=int,            help="vertical binning stop line", default=1079)
     parser.add_argument("--csvfile",             type=str,            help="optional file to save row-ordered CSV")
+    parser.add_argument("--binfile",             type=str,            help="optional file to save raw little-endian uint16 lines")
     parser.add_argument("--pngfile",             type=str,            help="optional file to save PNG images")
+    parser.add_argument("--png-bitdepth",        type=int,            help="8 (normalized, brightened) or 16 (raw counts)", default=8, choices=[8, 16])
+    parser.add_argument("--ring-lines",          type=int,            help="--single-acquire: lines buffered between USB reader and consumer", default=256)
+    parser.add_argument("--report-sec",          type=float,          help="--single-acquire: seconds between throughput reports", default=1.0)
+    parser.add_argument("--quiet",               action="store_true", help="don't print each line")
+    parser.add_argument("--simulate",            action="store_true", help="use a simulated line-streaming spectrometer instead of USB hardware")
+    parser.add_argument("--sim-fifo-lines",      type=int,            help="simulated device FIFO depth (older lines are lost on overflow)", default=8)
+    parser.add_argument("--sim-fault-rate",      type=float,          help="simulated fraction of reads which fail or repeat a line", default=0)
     return parser.parse_args()
 
 def send_code(cmd, value=0, index=0, buf=Z, timeout=TIMEOUT_MS):
@@ -39,6 +53,379 @@ def send_code(cmd, value=0, index=0, buf=Z, timeout=TIMEOUT_MS):
             cmd, value, index, buf, timeout))
     dev.ctrl_transfer(HOST_TO_DEVICE, cmd, value, index, buf, timeout)
 
+class LineWriter(threading.Thread):
+    """
+    Streams lines to CSV and/or raw binary through one open handle each, on a
+    background thread, so the USB read loop never waits on formatting or disk.
+    """
+    def __init__(self, csvfile=None, binfile=None):
+        super().__init__(daemon=True)
+        self.queue = queue.Queue()
+        self.csvfile = open(csvfile, "w") if csvfile else None
+        self.binfile = open(binfile, "wb") if binfile else None
+        self.max_backlog = 0
+
+    def write(self, spectrum):
+        self.queue.put(spectrum)
+        self.max_backlog = max(self.max_backlog, self.queue.qsize())
+
+    def run(self):
+        while True:
+            spectrum = self.queue.get()
+            if spectrum is None:
+                break
+            if self.csvfile:
+                self.csvfile.write(", ".join(map(str, spectrum.tolist())) + "\n")
+            if self.binfile:
+                self.binfile.write(spectrum.astype("<u2").tobytes())
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        for f in [self.csvfile, self.binfile]:
+            if f:
+                f.close()
+        print(f"LineWriter: max backlog {self.max_backlog} lines")
+
+def normalize(image, bitdepth=8):
+    """ 8-bit: normalize to 9-bit, then clamp to 8-bit (brightens image); 16-bit: raw counts """
+    if bitdepth == 16:
+        return image
+    hi = int(image.max())
+    if hi == 0:
+        return np.zeros(image.shape, dtype=np.uint8)
+    return np.minimum(255, (512.0 * image / hi).astype(np.int32)).astype(np.uint8)
+
+class LineRing:
+    """
+    Bounded ring of preallocated line buffers between the USB reader thread 
+    (producer) and the consumer thread.  The reader never blocks on the 
+    consumer: if the ring is full it reads into a scratch buffer and the line
+    is counted as an overrun, so the device FIFO keeps draining.
+    """
+    def __init__(self, slots, pixels):
+        self.slots = slots
+        self.buffers = [ array.array('B', bytes(pixels * 2)) for i in range(slots) ]
+        self.lines = [ np.frombuffer(buf, dtype="<u2") for buf in self.buffers ]
+        self.lengths = [ 0 ] * slots
+        self.scratch = array.array('B', bytes(pixels * 2))
+        self.head = 0 # next slot the reader fills
+        self.tail = 0 # next slot the consumer drains
+        self.high_water = 0
+        self.overruns = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def reserve(self):
+        """ buffer for the next read (scratch if the ring is full) """
+        with self.cond:
+            if self.head - self.tail >= self.slots:
+                return self.scratch
+            return self.buffers[self.head % self.slots]
+
+    def publish(self, buf, length):
+        with self.cond:
+            if buf is self.scratch:
+                self.overruns += 1
+                return
+            self.lengths[self.head % self.slots] = length
+            self.head += 1
+            self.high_water = max(self.high_water, self.head - self.tail)
+            self.cond.notify()
+
+    def take(self):
+        """ @returns the next line (a view, valid until release()), or None once closed and drained """
+        with self.cond:
+            while self.head == self.tail and not self.closed:
+                self.cond.wait()
+            if self.head == self.tail:
+                return None
+            slot = self.tail % self.slots
+            return self.lines[slot][:self.lengths[slot] // 2]
+
+    def release(self):
+        with self.cond:
+            self.tail += 1
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class LineStreamer:
+    """
+    --single-acquire pipeline.  A dedicated reader thread does nothing but 
+    keep a bulk read outstanding, landing each line in the LineRing and 
+    re-sending ACQUIRE immediately (no sleep) after a USB error.  A consumer
+    thread decodes the line index, detects duplicates and gaps, fills the 
+    frame buffer and hands lines to the LineWriter.  The main thread reports
+    sustained lines/sec, gaps, duplicates and ring high-water marks.
+    """
+    def __init__(self, image, writer):
+        self.image = image
+        self.writer = writer
+        self.ring = LineRing(args.ring_lines, args.pixels)
+        self.stop = threading.Event()
+
+        self.start_line = args.start_line
+        self.stop_line = min(args.stop_line, args.lines - 1)
+        self.set_step(args.line_step if args.line_step else 1)
+
+        self.lines_read = 0
+        self.reads = 0
+        self.timeouts = 0
+        self.usb_errors = 0
+        self.short_lines = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.missing = 0
+        self.frames = 0
+        self.last_index = None
+
+    def run(self):
+        threads = [ threading.Thread(target=self.read_loop, daemon=True),
+                    threading.Thread(target=self.consume_loop, daemon=True) ]
+
+        print("Sending single ACQUIRE")
+        send_code(0xad)
+        self.start_time = perf_counter()
+        for thread in threads:
+            thread.start()
+
+        last_time, last_count = self.start_time, 0
+        try:
+            while threads[1].is_alive():
+                threads[1].join(args.report_sec)
+                now = perf_counter()
+                self.report(now - last_time, self.lines_read - last_count)
+                last_time, last_count = now, self.lines_read
+        except KeyboardInterrupt:
+            print("stopping")
+        self.stop.set()
+        self.ring.close()
+        for thread in threads:
+            thread.join()
+        self.summary(perf_counter() - self.start_time)
+
+    def read_loop(self):
+        while not self.stop.is_set():
+            buf = self.ring.reserve()
+            try:
+                length = dev.read(0x82, buf, TIMEOUT_MS)
+            except usb.core.USBTimeoutError:
+                self.timeouts += 1
+                send_code(0xad)
+                continue
+            except usb.core.USBError:
+                self.usb_errors += 1
+                send_code(0xad)
+                continue
+            if self.stop.is_set():
+                break
+            self.reads += 1
+            self.ring.publish(buf, length)
+
+    def set_step(self, step):
+        self.step = step
+        self.lines_per_frame = (self.stop_line - self.start_line) // self.step + 1
+
+    def position(self, index):
+        return (index - self.start_line) // self.step
+
+    ## --randomize: the same host-side delays and line-step changes as the 
+    #  per-line ACQUIRE loop, applied between consuming lines
+    def randomize(self):
+        time.sleep(random.randint(1, 100) / 1000.0)
+        if 0 == self.lines_read % 100:
+            step = random.randint(1, 50)
+            set_line_step(step)
+            self.set_step(step)
+            self.last_index = None # don't count the change of step as a gap
+
+    def consume_loop(self):
+        while True:
+            if args.randomize:
+                time.sleep(random.randint(1, 100) / 1000.0)
+            spectrum = self.ring.take()
+            if spectrum is None:
+                break
+
+            if len(spectrum) < args.pixels:
+                self.short_lines += 1
+            index = int(spectrum[0]) if len(spectrum) else -1
+
+            dup = index
+            if index == self.last_index:
+                dup = "DUP"
+                self.duplicates += 1
+            elif self.last_index is not None:
+                skipped = (self.position(index) - self.position(self.last_index) - 1) % self.lines_per_frame
+                if skipped:
+                    self.gaps += 1
+                    self.missing += skipped
+                if self.position(index) <= self.position(self.last_index):
+                    self.frames += 1
+            self.last_index = index
+
+            if not args.quiet:
+                print("%s spectrum %4d (%3s): %s ..." % (datetime.datetime.now(), self.lines_read + 1, dup, spectrum[:10].tolist()))
+
+            if self.writer:
+                self.writer.write(spectrum.copy())
+
+            if args.pngfile:
+                if 0 <= index < len(self.image):
+                    n = min(len(spectrum), args.pixels)
+                    self.image[index, :n] = spectrum[:n]
+                else:
+                    print(f"    ditching overflow line {index}")
+
+            self.ring.release()
+            self.lines_read += 1
+            if not args.perpetual and self.lines_read > args.count:
+                self.stop.set()
+                break
+
+            if args.randomize:
+                self.randomize()
+
+    def report(self, elapsed_sec, lines):
+        rate = lines / elapsed_sec if elapsed_sec > 0 else 0
+        backlog = self.writer.queue.qsize() if self.writer else 0
+        print(f"STATUS: {rate:8.1f} lines/sec, {self.lines_read} lines, {self.frames} frames, {self.gaps} gaps ({self.missing} lines missing), " +
+              f"{self.duplicates} DUP, ring {self.ring.head - self.ring.tail}/{self.ring.slots} (high-water {self.ring.high_water}, {self.ring.overruns} overruns), " +
+              f"writer backlog {backlog}, {self.timeouts} timeouts, {self.usb_errors} USB errors")
+
+    def summary(self, elapsed_sec):
+        print(f"Read {self.lines_read} lines in {elapsed_sec:.2f}sec ({self.lines_read / elapsed_sec:.1f} lines/sec sustained)")
+        print(f"  bulk reads:         {self.reads} ({self.short_lines} short)")
+        print(f"  frames:             {self.frames}")
+        print(f"  duplicates (DUP):   {self.duplicates}")
+        print(f"  gaps:               {self.gaps} ({self.missing} lines missing)")
+        print(f"  ring high-water:    {self.ring.high_water}/{self.ring.slots} ({self.ring.overruns} overruns)")
+        print(f"  timeouts:           {self.timeouts}")
+        print(f"  USB errors:         {self.usb_errors}")
+
+class SimulatedAreaScan:
+    """
+    Simulated line-streaming spectrometer.  After ACQUIRE it produces one line
+    per integration time into a FIFO of --sim-fifo-lines; lines the host 
+    doesn't read in time are overwritten, just as on hardware, and counted in
+    'dropped' so LineStreamer's gap accounting can be checked against truth.
+    --sim-fault-rate injects failed reads (losing that line) and repeated
+    lines.  Without --single-acquire, each ACQUIRE yields a single line.
+    """
+    def __init__(self, pixels, streaming, fifo_lines, fault_rate):
+        self.idProduct = 0x4000
+        self.pixels = pixels
+        self.streaming = streaming
+        self.fifo_lines = fifo_lines
+        self.fault_rate = fault_rate
+        self.rng = random.Random(0)
+        self.lock = threading.Lock()
+
+        self.integration_time_ms = 10
+        self.start_line = 0
+        self.stop_line = 1079
+        self.line_step = 1
+
+        self.start_time = None  # when streaming began
+        self.next_seq = 0       # sequence number of the next line to deliver
+        self.pending = 0        # ACQUIREs not yet read (non-streaming)
+        self.last_line = None
+        self.dropped = 0
+        self.repeated = 0
+        self.errors = 0
+
+    def set_configuration(self, n=None):
+        pass
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+        if bmRequestType == DEVICE_TO_HOST:
+            if bRequest == 0xc0:
+                return array.array('B', [0, 0, 0, 1])
+            if bRequest == 0xb4:
+                return array.array('B', b"SIM-AREA")
+            return array.array('B', bytes(data_or_wLength))
+
+        with self.lock:
+            if bRequest == 0xb2:
+                self.integration_time_ms = max(1, wValue)
+            elif bRequest == 0xff and wValue == 0x21:
+                self.start_line = wIndex
+            elif bRequest == 0xff and wValue == 0x23:
+                self.stop_line = wIndex
+            elif bRequest == 0x90 and wValue == 0x19:
+                self.line_step = max(1, data_or_wLength[0])
+            elif bRequest == 0xad:
+                if not self.streaming:
+                    self.pending += 1
+                elif self.start_time is None:
+                    self.start_time = perf_counter()
+        return 0
+
+    def make_line(self, seq):
+        per_frame = (self.stop_line - self.start_line) // self.line_step + 1
+        index = self.start_line + (seq % per_frame) * self.line_step
+        line = np.arange(self.pixels, dtype=np.uint32) + seq
+        line = (line % 60000).astype("<u2")
+        line[0] = index
+        return line.tobytes()
+
+    def next_line(self, timeout):
+        period = self.integration_time_ms / 1000.0
+        with self.lock:
+            if self.streaming:
+                if self.start_time is None:
+                    return None
+                ready = self.start_time + (self.next_seq + 1) * period
+            else:
+                if self.pending == 0:
+                    return None
+                self.pending -= 1
+                ready = perf_counter() + period
+
+        wait = ready - perf_counter()
+        if wait > timeout / 1000.0:
+            time.sleep(timeout / 1000.0)
+            return None
+        if wait > 0:
+            time.sleep(wait)
+
+        with self.lock:
+            if self.streaming:
+                # lines overwritten in the FIFO while the host wasn't reading
+                completed = int((perf_counter() - self.start_time) / period)
+                oldest = completed - self.fifo_lines
+                if self.next_seq < oldest:
+                    self.dropped += oldest - self.next_seq
+                    self.next_seq = oldest
+
+            if self.last_line is not None and self.rng.random() < self.fault_rate:
+                if self.rng.random() < 0.5:
+                    self.repeated += 1
+                    return self.last_line
+                self.errors += 1
+                self.next_seq += 1
+                raise usb.core.USBError("simulated bulk error")
+
+            self.last_line = self.make_line(self.next_seq)
+            self.next_seq += 1
+            return self.last_line
+
+    def read(self, endpoint, size_or_buffer, timeout=TIMEOUT_MS):
+        line = self.next_line(timeout)
+        if line is None:
+            raise usb.core.USBTimeoutError("simulated timeout")
+        if isinstance(size_or_buffer, int):
+            return array.array('B', line[:size_or_buffer])
+        n = min(len(line), len(size_or_buffer))
+        size_or_buffer[:n] = array.array('B', line[:n])
+        return n
+
+    def summary(self):
+        print(f"Simulator: delivered {self.next_seq} lines, {self.dropped} dropped in FIFO, {self.errors} failed reads, {self.repeated} repeated lines")
+
 def set_line_step(n):
     print(f"setting line step {n}")
     send_code(0xeb, 0)
@@ -49,12 +436,15 @@ def set_line_step(n):
 args = process_cmd_args()
 
 # connect
-dev = usb.core.find(idVendor=0x24aa, idProduct=int(args.pid, 16))
+if args.simulate:
+    dev = SimulatedAreaScan(args.pixels, args.single_acquire, args.sim_fifo_lines, args.sim_fault_rate)
+else:
+    dev = usb.core.find(idVendor=0x24aa, idProduct=int(args.pid, 16))
 if dev is None:
     print("No spectrometers found")
     sys.exit(0)
 
-if os.name == "posix":
+if os.name == "posix" and not args.simulate:
     dev.set_configuration(1)
     usb.util.claim_interface(dev, 0)
 
@@ -84,89 +474,96 @@ if dev.idProduct == 0x4000:
 print("enabling area scan")
 send_code(0xeb, 1)
 
-# initialize CSV
-if args.csvfile:
-    print(f"Recording to {args.csvfile}")
-    if os.path.exists(args.csvfile):
-        os.remove(args.csvfile)
+# initialize CSV / binary
+writer = None
+if args.csvfile or args.binfile:
+    for filename in [args.csvfile, args.binfile]:
+        if filename:
+            print(f"Recording to {filename}")
+    writer = LineWriter(args.csvfile, args.binfile)
+    writer.start()
 
-# initialize PNG
-image = [[0 for _ in range(args.pixels)] for _ in range(args.lines)]
+# initialize PNG (frame buffer keyed by the line index embedded in pixel 0)
+image = np.zeros((args.lines, args.pixels), dtype=np.uint16)
 
 if not args.perpetual:
     print("Looping over %d spectra (lines)" % args.count)
 
+streamer = None
 if args.single_acquire:
-    print("Sending single ACQUIRE")
-    send_code(0xad)
-
-lines_read = 0
-last_index = -1
-start_time = datetime.datetime.now()
-while True:
-    if not args.perpetual and lines_read > args.count:
-        break
+    streamer = LineStreamer(image, writer)
+    streamer.run()
+else:
+    lines_read = 0
+    last_index = -1
+    start_time = datetime.datetime.now()
+    while True:
+        if not args.perpetual and lines_read > args.count:
+            break
+
+        delay_ms = random.randint(1, 100) if args.randomize else 0
+        time.sleep(delay_ms / 1000.0)
+        elapsed_ms = int((datetime.datetime.now() - start_time).total_seconds() * 1000)
 
-    delay_ms = random.randint(1, 100) if args.randomize else 0
-    time.sleep(delay_ms / 1000.0)
-    elapsed_ms = int((datetime.datetime.now() - start_time).total_seconds() * 1000)
-
-    if not args.single_acquire:
         send_code(0xad)
         
-    # read next line
-    try:
-        data = dev.read(0x82, args.pixels*2)
-    except usb.core.USBError as usb_err:
-        print(f"ERROR: dropped line, sending another ACQUIRE (elapsed {elapsed_ms}ms)")
-        time.sleep(0.1)
-        if args.single_acquire:
-            send_code(0xad)
-        continue
-
-    # deserialize to pixels
-    spectrum = []
-    for i in range(0, len(data), 2):
-        spectrum.append(data[i] | (data[i+1] << 8))
-
-    # extract line index
-    index = spectrum[0] 
-
-    dup = "DUP" if index == last_index else index
-    last_index = index
-
-    print("%s spectrum %4d (%3dms, %3s): %s ..." % (datetime.datetime.now(), lines_read + 1, delay_ms, dup, spectrum[:10]))
-
-    if args.csvfile:
-        with open(args.csvfile, "a") as csvfile:
-            csvfile.write(", ".join([f"{pixel}" for pixel in spectrum]) + "\n")
-
-    if args.pngfile:
-        if index < len(image):
-            image[index] = spectrum
-        else:
-            print(f"    ditching overflow line {index}")
-
-    lines_read += 1
-
-    if args.randomize:
-        time.sleep(random.randint(1, 100) / 1000.0)
-        if 0 == lines_read % 100:
-            set_line_step(random.randint(1, 50))
+        # read next line
+        try:
+            data = dev.read(0x82, args.pixels*2)
+        except usb.core.USBError as usb_err:
+            print(f"ERROR: dropped line (elapsed {elapsed_ms}ms)")
+            time.sleep(0.1)
+            continue
+
+        # deserialize to pixels
+        spectrum = np.frombuffer(data, dtype="<u2")
+
+        # extract line index
+        index = int(spectrum[0])
+
+        dup = "DUP" if index == last_index else index
+        last_index = index
+
+        print("%s spectrum %4d (%3dms, %3s): %s ..." % (datetime.datetime.now(), lines_read + 1, delay_ms, dup, spectrum[:10].tolist()))
+
+        if writer:
+            writer.write(spectrum)
+
+        if args.pngfile:
+            if index < len(image):
+                n = min(len(spectrum), args.pixels)
+                image[index, :n] = spectrum[:n]
+            else:
+                print(f"    ditching overflow line {index}")
+
+        lines_read += 1
+
+        if args.randomize:
+            time.sleep(random.randint(1, 100) / 1000.0)
+            if 0 == lines_read % 100:
+                set_line_step(random.randint(1, 50))
 
 print("Exiting area scan")
 send_code(0xeb, 0)
 
-if args.pngfile:
-    # normalize to 9-bit, then clamp to 8-bit (brightens image)
-    # (probably some clever Numpy way to do this)
-    hi = max([max(line) for line in image])
-    for y in range(args.lines):
-        for x in range(args.pixels):
-            image[y][x] = min(255, int((512.0 * image[y][x] / hi)))
+if args.simulate:
+    dev.summary()
+    if streamer and args.randomize:
+        print("Validation skipped: --randomize changes the line step while lines at the old step are still buffered")
+    elif streamer:
+        # every line lost in the device FIFO, a failed read or a ring overrun 
+        # must show up as a gap, except overrun repeats (which are DUPs never seen)
+        overrun_repeats = dev.repeated - streamer.duplicates
+        lost = dev.dropped + dev.errors + streamer.ring.overruns - overrun_repeats
+        ok = streamer.missing == lost and 0 <= overrun_repeats <= streamer.ring.overruns
+        print(f"Validation {'passed' if ok else 'FAILED'}: {streamer.missing} missing vs {lost} lost, {streamer.duplicates} DUP vs {dev.repeated} repeated")
+
+if writer:
+    writer.close()
 
+if args.pngfile:
     # save PNG file
     print(f"Saving {args.pngfile}")
     with open(args.pngfile, 'wb') as pngfile:
-        png_writer = png.Writer(width=args.pixels, height=args.lines)
-        png_writer.write(pngfile, image)
+        png_writer = png.Writer(width=args.pixels, height=args.lines, greyscale=True, bitdepth=args.png_bitdepth)
+        png_writer.write(pngfile, normalize(image, args.png_bitdepth))